@@ -20,16 +20,25 @@
 __author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
 
 
+import datetime
+import hashlib
+import itertools
 import json
 import logging
+import os
 import pprint
 
 from epfl.courses import base_handler
+from epfl.courses import cache
 from epfl.courses import config
+from epfl.courses import jobs
 from epfl.courses import models
+from epfl.courses import querystats
+from epfl.courses import registry
 from epfl.courses import static_data
+from epfl.courses import viewmodel
+from epfl.courses import search
 from epfl.courses.search import appsearch_admin
-from epfl.courses.search import parser
 
 from google.appengine.ext import db
 
@@ -37,15 +46,104 @@ from google.appengine.ext import db
 # SCIPER used to mark non-existent/multiple instructor
 INVALID_SCIPER = 126096
 
-COURSES_DATA_FILE = "data/consolidated_desc.json"
+# The consolidated course descriptions, one JSON object per line
+COURSES_DATA_FILE = "data/consolidated_desc.jsonl"
+# The single JSON document of the descriptions, read when the file above is
+# missing
+COURSES_LEGACY_DATA_FILE = "data/consolidated_desc.json"
+
+
+def ReadCourseDescriptions():
+  """Yield the consolidated course descriptions of the data file.
+
+  The JSON Lines file is read one line at a time, so the memory of the
+  import doesn't grow with the size of the catalog.
+  """
+
+  try:
+    data_file = open(COURSES_DATA_FILE, "r")
+  except IOError:
+    logging.warning("'%s' not found, loading '%s' entirely"
+                    % (COURSES_DATA_FILE, COURSES_LEGACY_DATA_FILE))
+    with open(COURSES_LEGACY_DATA_FILE, "r") as f:
+      course_data = json.load(f, encoding="utf-8")
+    for course_desc in course_data["consolidations"]:
+      yield course_desc
+    return
+
+  with data_file:
+    for line in data_file:
+      if line.strip():
+        yield json.loads(line, encoding="utf-8")
+
+
+def GetCourseLineOffsets():
+  """Return the byte offsets of the course descriptions in the data file.
+
+  The lines are only scanned, not parsed.  Returns None if there is only the
+  legacy data file.
+  """
+
+  if not os.path.exists(COURSES_DATA_FILE):
+    return None
+
+  offsets = []
+  offset = 0
+  with open(COURSES_DATA_FILE, "rb") as data_file:
+    for line in data_file:
+      if line.strip():
+        offsets.append(offset)
+      offset += len(line)
+  return offsets
+
+
+def ReadCourseDescriptionRange(offset, start, end):
+  """Yield the descriptions [start, end) of the data file, counted from the
+  line at the given byte offset.
+
+  The lines before start are skipped without being parsed.
+  """
+
+  with open(COURSES_DATA_FILE, "rb") as data_file:
+    if offset:
+      data_file.seek(offset - 1)
+      if data_file.read(1) != "\n":
+        raise ValueError("'%s' changed since its lines were counted"
+                         % COURSES_DATA_FILE)
+
+    lines = (line for line in data_file if line.strip())
+    for line in itertools.islice(lines, start, end):
+      yield json.loads(line, encoding="utf-8")
+
+
+def GetCourseDataHash():
+  """Return the hex SHA-1 of the course data file."""
+
+  data_hash = hashlib.sha1()
+  file_name = COURSES_DATA_FILE
+  if not os.path.exists(file_name):
+    file_name = COURSES_LEGACY_DATA_FILE
+  with open(file_name, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 16), ""):
+      data_hash.update(chunk)
+  return data_hash.hexdigest()
 
 
 class ImportCourseCatalog(base_handler.BaseHandler):
-  """Import the entire course catalog."""
+  """Import the entire course catalog.
+  
+  Only the courses whose description changed since the last import are
+  written and marked for indexing.  The descriptions are compared by a hash
+  kept in each course and its summary.
+  """
   
   # The courses are imported in buckets of this size
   bucket_size = 100
   
+  # Part of the content hashes.  Increment it when CreateCourse changes, so
+  # the next import rewrites all courses.
+  import_version = 1
+  
   # Mappings to read from the right free text descriptions. Keys are course
   # attributes, and values are the titles as parsed from ISA URLs.
   free_text_map = {
@@ -75,37 +173,88 @@ class ImportCourseCatalog(base_handler.BaseHandler):
   
   @staticmethod
   def PopulateSections():
-    for school in static_data.SCHOOLS.values():
-      models.School(key_name=school.code,
-                    title_en=school.title_en,
-                    title_fr=school.title_fr).put()
+    schools = [models.School(key_name=school.code,
+                             title_en=school.title_en,
+                             title_fr=school.title_fr)
+               for school in static_data.SCHOOLS.values()]
                     
-    for section in static_data.SECTIONS.values():      
-      models.Section(key_name=section.code,
-                     title_short=section.title_short,
-                     title_en=section.title_en,
-                     title_fr=section.title_fr,
-                     school=models.School.get_by_key_name(section.school),
-                     minor=section.minor,
-                     alias=section.alias).put()
+    sections = [models.Section(key_name=section.code,
+                               title_short=section.title_short,
+                               title_en=section.title_en,
+                               title_fr=section.title_fr,
+                               school=db.Key.from_path("School",
+                                                       section.school),
+                               minor=section.minor,
+                               alias=section.alias)
+                for section in static_data.SECTIONS.values()]
+    
+    db.put(schools + sections)
                      
   @staticmethod
-  def ResolveSectionKeys(section_key_names):
+  def LoadSectionKeys():
+    """Map the key name of each section to the key of its alias, if any.
+    
+    The mapping is built once per import from the static data, which
+    PopulateSections writes before the courses are imported.  A query would
+    not reliably see the sections just written.
+    """
+    
+    section_keys = {}
+    for section in static_data.SECTIONS.values():
+      key_name = section.alias if section.alias else section.code
+      if key_name in static_data.SECTIONS:
+        section_keys[section.code] = db.Key.from_path("Section", key_name)
+    return section_keys
+  
+  @staticmethod
+  def ResolveSectionKeys(section_key_names, section_keys):
     """Compute the set of keys after resolving all aliases."""
     
-    sections = [models.Section.get_by_key_name(section)
-                for section in section_key_names]
-    
-    aliased_key_names = [(section.alias if section.alias
-                          else section.key().name())
-                         for section in sections]
+    return [section_keys[section] for section in section_key_names]
+  
+  @staticmethod
+  def GetSectionNames(key_names):
+    """Return the names of the sections and their schools, as written by
+    PopulateSections, for the content hash of a course."""
+    
+    names = []
+    for key_name in key_names:
+      section = static_data.SECTIONS[key_name]
+      school = static_data.SCHOOLS[section.school]
+      names.append([section.title_short, section.title_en, section.title_fr,
+                    section.minor, section.master,
+                    school.code, school.title_en, school.title_fr])
+    return names
+  
+  @classmethod
+  def ComputeContentHash(cls, course_desc, language, section_keys):
+    """Return a stable hash of the data a course is created from.
+    
+    The view model of a course shows the names of its sections and schools,
+    so they are part of the hash: renaming a section changes the courses
+    at the next import.
+    """
+    
+    key_names = [key.name() for key in cls.ResolveSectionKeys(
+      [e["section"] for e in course_desc["study_plan_entry"]],
+      section_keys)]
+    content = {
+      "version": cls.import_version,
+      "id": course_desc["id"],
+      "description": course_desc[language],
+      "study_plan_entry": course_desc["study_plan_entry"],
+      "section_keys": key_names,
+      "section_names": cls.GetSectionNames(key_names),
+    }
     
-    return [models.Section.get_by_key_name(section).key()
-            for section in aliased_key_names]
+    return hashlib.sha1(json.dumps(content, sort_keys=True)).hexdigest()
   
   @classmethod
-  def CreateCourse(cls, course_desc, language):
-    """Import a single course description."""
+  def CreateCourse(cls, course_desc, language, section_keys):
+    """Import a single course description.
+    
+    The section keys are the mapping returned by LoadSectionKeys.
+    """
     
     # Create a new instance of a course, which will overwrite the old
     # one with the same key (if any).
@@ -118,9 +267,8 @@ class ImportCourseCatalog(base_handler.BaseHandler):
     course.title = course_desc_lang["title"]
     course.language = course_desc_lang["language"]
     
-    section_keys = cls.ResolveSectionKeys(
-      [e["section"] for e in course_desc["study_plan_entry"]])
-    course.section_keys = section_keys
+    course.section_keys = cls.ResolveSectionKeys(
+      [e["section"] for e in course_desc["study_plan_entry"]], section_keys)
     
     course.study_plans = [e["plan"] for e in course_desc["study_plan_entry"]]
     course.code_prefix = [(e["code"][0]
@@ -171,46 +319,216 @@ class ImportCourseCatalog(base_handler.BaseHandler):
       setattr(course, attr, course_desc_lang["free_text"].get(title))
     
     course.needs_indexing_ = True
+    viewmodel.CourseView.Store(course)
     
     return course
   
   @classmethod
-  def ImportAllCourses(cls, language):
-    """Import all courses found in the data file."""
-
-    with open(COURSES_DATA_FILE, "r") as f:
-      course_data = json.load(f, encoding="utf-8")
-      
-    course_bucket = []
+  def ImportCourseBucket(cls, bucket, language, section_keys, import_stats):
+    """Write the courses of a bucket of (description, hash) that changed."""
     
-    for course_desc in course_data["consolidations"]:
+    key_names = ["%s:%s" % (language, course_desc["id"])
+                 for course_desc, _ in bucket]
+    summaries = models.CourseSummary.get_by_key_name(key_names)
+    
+    entities = []
+    
+    for (course_desc, content_hash), summary in zip(bucket, summaries):
+      if summary and summary.content_hash_ == content_hash:
+        import_stats["unchanged"] += 1
+        continue
+      
       try:
-        course = cls.CreateCourse(course_desc, language)
-        course_bucket.append(course)
-        
-        if len(course_bucket) >= cls.bucket_size:
-          db.put(course_bucket)
-          course_bucket = []
+        course = cls.CreateCourse(course_desc, language, section_keys)
       except:
         logging.error("Error in processing course %s in language %s"
                       % (course_desc["id"], language))
         raise
+      
+      course.content_hash_ = content_hash
+      entities.append(course)
+      entities.append(models.CourseSummary.FromCourse(course))
+      import_stats["changed" if summary else "added"] += 1
+      
+    if entities:
+      db.put(entities)
+  
+  @classmethod
+  def RemoveMissingCourses(cls, language, import_stats):
+    """Delete the courses of the language that are not in the data file."""
+    
+    course_ids = set(course_desc["id"]
+                     for course_desc in ReadCourseDescriptions())
+    
+    query = models.Course.all(keys_only=True)
+    query.filter("desc_language_ =", language)
+    removed_ids = [key.name()[3:] for key in query.run(batch_size=1000)
+                   if key.name()[3:] not in course_ids]
+    
+    other_language = "fr" if language == "en" else "en"
+    
+    for start in range(0, len(removed_ids), cls.bucket_size):
+      batch_ids = removed_ids[start:start + cls.bucket_size]
+      key_names = ["%s:%s" % (language, course_id) for course_id in batch_ids]
+      db.delete([db.Key.from_path(kind, key_name)
+                 for kind in ["Course", "CourseSummary"]
+                 for key_name in key_names])
+      
+      # The search documents hold both languages, so they are rebuilt from
+      # the remaining language, if any
+      other_courses = models.Course.GetByCourseID(batch_ids, other_language)
+      remaining = [course for course in other_courses if course]
+      for course in remaining:
+        course.needs_indexing_ = True
+      db.put(remaining)
+      
+      appsearch_admin.AppEngineIndex.RemoveCourseDocuments(
+        [course_id for course_id, course in zip(batch_ids, other_courses)
+         if not course])
+      
+    import_stats["removed"] += len(removed_ids)
+  
+  @classmethod
+  def ImportCourses(cls, descriptions, language, section_keys, import_stats,
+                    checkpoint=None):
+    """Import the course descriptions of an iterable, in buckets.
+    
+    After each bucket is written, checkpoint is called with the number of
+    descriptions imported so far.
+    """
+    
+    course_count = 0
+    course_bucket = []
+    
+    for course_desc in descriptions:
+      content_hash = cls.ComputeContentHash(course_desc, language,
+                                            section_keys)
+      course_bucket.append((course_desc, content_hash))
+      
+      if len(course_bucket) >= cls.bucket_size:
+        cls.ImportCourseBucket(course_bucket, language, section_keys,
+                               import_stats)
+        course_count += len(course_bucket)
+        course_bucket = []
+        if checkpoint:
+          checkpoint(course_count)
         
     if course_bucket:
-      db.put(course_bucket)
+      cls.ImportCourseBucket(course_bucket, language, section_keys,
+                             import_stats)
+      course_count += len(course_bucket)
+      if checkpoint:
+        checkpoint(course_count)
+  
+  @staticmethod
+  def CreateImportStats():
+    return dict.fromkeys(["added", "changed", "removed", "unchanged"], 0)
+  
+  @staticmethod
+  def InvalidateCaches(import_stats):
+    if (import_stats["added"] or import_stats["changed"]
+        or import_stats["removed"]):
+      cache.CourseCache.Invalidate()
+      # The instances keep their local index until a task stores the new one
+      appsearch_admin.ScheduleLocalIndexSnapshot()
+    if import_stats["removed"]:
+      # The removed courses left the search index
+      cache.Generation.Bump(search.CachedSearchProvider.GENERATION)
+  
+  @staticmethod
+  def RecordImport(language):
+    """Record the data file the language was imported from.
+    
+    See AppEngineIndex.IsSnapshotCurrent.
+    """
+    
+    generation = models.CacheGeneration.get_by_key_name(
+      cache.CourseCache.GENERATION)
+    models.CatalogImport(key_name=language, source=GetCourseDataHash(),
+                         generation=generation.value if generation else 0).put()
+  
+  @classmethod
+  def ImportAllCourses(cls, language):
+    """Import all courses found in the data file, in the current request.
+    
+    Return the counts of added, changed, removed and unchanged courses.
+    """
+
+    import_stats = cls.CreateImportStats()
+    cls.ImportCourses(ReadCourseDescriptions(), language,
+                      cls.LoadSectionKeys(), import_stats)
+    cls.RemoveMissingCourses(language, import_stats)
+    cls.InvalidateCaches(import_stats)
+    cls.RecordImport(language)
+    
+    return import_stats
   
   def get(self, operation):
     if operation not in ["en", "fr", "sections"]:
       self.abort(400)
       
     self.PopulateSections()
-    if operation in ["en", "fr"]:
-      self.ImportAllCourses(operation)
+    registry.SectionRegistry.Invalidate()
     
     self.SetTextMode()
+    
+    if operation in ["en", "fr"]:
+      job_id = jobs.StartJob(ImportCoursesJob, {"language": operation},
+                             config.BATCH_JOB_SHARDS,
+                             jobs.TaskQueueRunner(config.BATCH_JOB_QUEUE))
+      self.response.out.write("Started the import (%s). Progress at %s\n"
+                              % (operation, self.uri_for("job", job_id=job_id)))
+      return
+    
     self.response.out.write("OK (%s).\n" % operation)
     
 
+class ImportCoursesJob(jobs.ShardedJob):
+  """Imports the courses of a language, by ranges of the data file.
+  
+  Each shard starts at the byte offset of its first line, so it only parses
+  its own descriptions.  The courses missing from the data file are removed
+  at the end.
+  """
+  
+  @classmethod
+  def CreateShards(cls, params, shard_count):
+    offsets = GetCourseLineOffsets()
+    if offsets is None:
+      # The legacy data file is a single document, imported by one shard
+      course_count = sum(1 for _ in ReadCourseDescriptions())
+      return [({"legacy": True, "count": course_count}, course_count)]
+    
+    return [({"offset": offsets[start], "count": end - start}, end - start)
+            for start, end in jobs.SplitRange(len(offsets), shard_count)]
+  
+  @classmethod
+  def RunShard(cls, params, shard_params, position, stats, checkpoint):
+    for key, value in ImportCourseCatalog.CreateImportStats().iteritems():
+      stats.setdefault(key, value)
+    
+    if shard_params.get("legacy"):
+      descriptions = itertools.islice(ReadCourseDescriptions(), position,
+                                      shard_params["count"])
+    else:
+      descriptions = ReadCourseDescriptionRange(shard_params["offset"],
+                                                position,
+                                                shard_params["count"])
+    ImportCourseCatalog.ImportCourses(
+      descriptions, params["language"], ImportCourseCatalog.LoadSectionKeys(),
+      stats, checkpoint=lambda count: checkpoint(position + count, stats))
+    return True
+  
+  @classmethod
+  def Finish(cls, params, stats):
+    for key, value in ImportCourseCatalog.CreateImportStats().iteritems():
+      stats.setdefault(key, value)
+    
+    ImportCourseCatalog.RemoveMissingCourses(params["language"], stats)
+    ImportCourseCatalog.InvalidateCaches(stats)
+    ImportCourseCatalog.RecordImport(params["language"])
+    
+
 class SitemapHandler(base_handler.BaseHandler):
   # TODO(bucur): Cache the site map in the blob store
   def get(self):
@@ -230,22 +548,119 @@ class BuildSearchIndexHandler(base_handler.BaseHandler):
     
     if operation == "erase":
       appsearch_admin.AppEngineIndex.ClearCourseIndex()
+      cache.Generation.Bump(search.CachedSearchProvider.GENERATION)
       self.response.out.write('OK.\n')
       return
     
-    if operation == "rebuild":
-      courses = models.Course.all().fetch(None)
-      appsearch_admin.AppEngineIndex.ClearIndexingStatus(courses)
-    
     if operation == "update" or operation == "rebuild":
-      if appsearch_admin.AppEngineIndex.UpdateCourseIndex():
-        self.response.out.write('OK.\n')
-      else:
-        self.response.out.write("Search quota exceeded. Try again later.\n")
+      job_id = jobs.StartJob(IndexCoursesJob,
+                             {"rebuild": operation == "rebuild"},
+                             config.BATCH_JOB_SHARDS,
+                             jobs.TaskQueueRunner(config.BATCH_JOB_QUEUE))
+      self.response.out.write("Started the index %s. Progress at %s\n"
+                              % (operation, self.uri_for("job", job_id=job_id)))
     else:
       self.abort(400)
       
 
+class IndexCoursesJob(jobs.ShardedJob):
+  """Indexes the courses marked for indexing, or all of them when
+  rebuilding, by ranges of course IDs."""
+  
+  # The courses are indexed in batches of this size
+  batch_size = 50
+  
+  @classmethod
+  def CreateShards(cls, params, shard_count):
+    if params["rebuild"]:
+      query = models.Course.all(keys_only=True)
+      course_ids = sorted(set(key.name()[3:]
+                              for key in query.run(batch_size=1000)))
+    else:
+      course_ids = appsearch_admin.AppEngineIndex.GetCourseIDsToIndex()
+    
+    return [({"course_ids": course_ids[start:end]}, end - start)
+            for start, end in jobs.SplitRange(len(course_ids), shard_count)]
+  
+  @classmethod
+  def RunShard(cls, params, shard_params, position, stats, checkpoint):
+    stats.setdefault("indexed", 0)
+    course_ids = shard_params["course_ids"]
+    
+    while position < len(course_ids):
+      batch_ids = course_ids[position:position + cls.batch_size]
+      if not appsearch_admin.AppEngineIndex.IndexCourses(batch_ids):
+        return False
+      
+      position += len(batch_ids)
+      stats["indexed"] += len(batch_ids)
+      checkpoint(position, stats)
+      
+    return True
+  
+  @classmethod
+  def Pause(cls, params):
+    # Even a partial update changes the search results
+    cache.Generation.Bump(search.CachedSearchProvider.GENERATION)
+  
+  @classmethod
+  def Finish(cls, params, stats):
+    cache.Generation.Bump(search.CachedSearchProvider.GENERATION)
+    
+
+class BatchJobHandler(base_handler.BaseHandler):
+  """Show the progress of the import and indexing jobs, or resume one."""
+  
+  def ListJobs(self):
+    self.response.out.write("Latest jobs:\n\n")
+    for job in models.BatchJob.all().order("-created").fetch(20):
+      self.response.out.write("%s %s (%s): %s\n"
+                              % (self.uri_for("job", job_id=job.key().id()),
+                                 job.job_class.split(".")[-1], job.params,
+                                 job.state))
+  
+  def ShowJob(self, job):
+    self.response.out.write("Job %d, %s (%s), created %s\n"
+                            % (job.key().id(), job.job_class.split(".")[-1],
+                               job.params, job.created))
+    self.response.out.write("State: %s, %d of %d shards done\n"
+                            % (job.state, len(job.done_shards),
+                               job.shard_count))
+    if job.stats:
+      self.response.out.write("Statistics: %s\n" % job.stats)
+    self.response.out.write("\n")
+    
+    for index, shard in enumerate(jobs.GetShards(job)):
+      self.response.out.write("Shard %d: %s, %d of %d done %s\n"
+                              % (index, shard.state, shard.position,
+                                 shard.size, shard.stats or ""))
+      if jobs.IsLeased(shard):
+        self.response.out.write("  Leased until %s\n" % shard.lease_until)
+      if shard.error:
+        self.response.out.write("  Last error: %s\n" % shard.error)
+  
+  def get(self, job_id=None, operation="status"):
+    self.SetTextMode()
+    
+    if job_id is None:
+      self.ListJobs()
+      return
+    
+    job = models.BatchJob.get_by_id(int(job_id))
+    if job is None:
+      self.abort(404)
+      
+    if operation == "resume":
+      if jobs.ResumeJob(job.key().id(),
+                        jobs.TaskQueueRunner(config.BATCH_JOB_QUEUE)):
+        self.response.out.write("Resumed.\n\n")
+      job = models.BatchJob.get_by_id(job.key().id())
+    elif operation != "status":
+      self.abort(400)
+      
+    self.ShowJob(job)
+    
+
 class RemoveSectionHandler(base_handler.BaseHandler):
   def get(self, sec_id, dest_id):
     self.SetTextMode()
@@ -260,6 +675,8 @@ class RemoveSectionHandler(base_handler.BaseHandler):
       
     for course in models.Course.all().filter("section_keys =", section.key()):
       course.needs_indexing_ = True
+      # No longer the imported description, so the next import rewrites it
+      course.content_hash_ = None
       
       course.section_keys = map(lambda key: destination.key()
                                 if key == section.key() else key,
@@ -271,66 +688,126 @@ class RemoveSectionHandler(base_handler.BaseHandler):
       
       course.section_keys = list(section_set)
       courses.append(course)
+    
+    # The view models show the new sections
+    registry.SectionRegistry.Invalidate()
+    for course in courses:
+      viewmodel.CourseView.Store(course)
       
     self.response.out.write("Affected courses: %d...\n" % len(courses))
     
-    db.put(courses)
+    db.put(courses + map(models.CourseSummary.FromCourse, courses))
     
     section.delete()
+    registry.SectionRegistry.Invalidate()
+    cache.CourseCache.Invalidate()
     
     self.response.out.write("OK. The search index needs to be rebuilt.")
       
 
-class QueryStatsHandler(base_handler.BaseHandler):  
+class QueryStatsHandler(base_handler.BaseHandler):
+  """Show the query statistics of the last days, or hours.
+  
+  The window is given by the "days" (7 by default) or "hours" parameter.
+  The queries logged before the statistics rollups are only counted after
+  running BackfillQueryStatsHandler once.
+  """
   
   def get(self):
-    count = 0
-    canned_count = 0
-    
-    no_results = []
-    many_results = []
-    
-    terms = {}
+    now = datetime.datetime.now()
+    hours = self.request.get_range("hours", min_value=0, default=0)
+    if hours:
+      period, length = "hour", hours
+      end = now.replace(minute=0, second=0, microsecond=0)
+      start = end - datetime.timedelta(hours=hours - 1)
+    else:
+      period = "day"
+      length = self.request.get_range("days", min_value=1, default=7)
+      end = now.replace(hour=0, minute=0, second=0, microsecond=0)
+      start = end - datetime.timedelta(days=length - 1)
     
-    sample_queries = set([q[0] for q in config.SAMPLE_QUERIES])
-    
-    for query in models.SearchQueryRecord.all().filter("time_stamp > ",
-                                                       config.LAUNCH_DATE).run():
-      count += 1
-      
-      if query.translated_query in sample_queries:
-        canned_count += 1
-        continue
-      
-      parsed_query = parser.SearchQuery.ParseFromString(query.translated_query)
-      
-      for term in parsed_query.ExtractTerms():
-        terms[term] = terms.get(term, 0) + 1
-      
-      if not query.results_count:
-        no_results.append(query.translated_query)
-      elif query.results_count > config.PAGE_SIZE:
-        many_results.append((query.translated_query, query.results_count))
-        
-    many_results.sort(key=lambda r: r[1], reverse=True)
-    ranked_terms = sorted(terms.items(), key=lambda r: r[1], reverse=True)[:20]
+    stats = querystats.GetStats(start, now)
+    ranked_terms = stats.terms.GetTop(20)
     
     self.SetTextMode()
+    
+    self.response.out.write("Queries in the last %d %s(s), since %s\n\n"
+                            % (length, period, start))
       
-    self.response.out.write("Total queries: %d\n\n" % count)
+    self.response.out.write("Total queries: %d\n\n" % stats.count)
     
-    self.response.out.write("Example queries: %d (will be ignored in the analysis below)\n\n" % canned_count)
+    self.response.out.write("Example queries: %d (will be ignored in the analysis below)\n\n" % stats.canned_count)
     
-    self.response.out.write("%d queries with no results:\n" % len(no_results))
-    pprint.pprint(no_results, self.response.out)
+    self.response.out.write("%d queries with no results:\n" % stats.no_results_count)
+    pprint.pprint(stats.no_results, self.response.out)
     self.response.out.write("\n")
     
-    self.response.out.write("%d queries with many results (> 1 page):\n" % len(many_results))
-    pprint.pprint(many_results, self.response.out)
+    self.response.out.write("%d queries with many results (> 1 page):\n" % stats.many_results_count)
+    pprint.pprint(stats.many_results, self.response.out)
     self.response.out.write("\n")
     
-    self.response.out.write("Total number of terms found in queries: %d\n\n" % len(terms))
-    self.response.out.write("Most popular terms (term, number of occurrences):\n")
+    self.response.out.write("Total number of term occurrences in queries: %d\n\n" % stats.term_count)
+    self.response.out.write("Most popular terms (term, approximate number of occurrences):\n")
     pprint.pprint(ranked_terms, self.response.out)
     self.response.out.write("\n")
 
+
+class BackfillQueryStatsHandler(base_handler.BaseHandler):
+  """Add the queries logged before the statistics rollups to the rollups."""
+  
+  def get(self):
+    self.SetTextMode()
+    
+    end = querystats.GetRollupStart(datetime.datetime.now())
+    job_id = jobs.StartJob(BackfillQueryStatsJob,
+                           {"end": end.strftime(querystats.ROLLUP_FORMAT)},
+                           config.BATCH_JOB_SHARDS,
+                           jobs.TaskQueueRunner(config.BATCH_JOB_QUEUE))
+    self.response.out.write("Started the backfill. Progress at %s\n"
+                            % self.uri_for("job", job_id=job_id))
+
+
+class BackfillQueryStatsJob(jobs.ShardedJob):
+  """Backfills the query statistics rollups, by ranges of hours since the
+  launch, up to the current hour."""
+  
+  @classmethod
+  def CreateShards(cls, params, shard_count):
+    start = querystats.GetRollupStart(config.LAUNCH_DATE)
+    end = datetime.datetime.strptime(params["end"], querystats.ROLLUP_FORMAT)
+    hour_count = int((end - start).total_seconds()) // 3600 + 1
+    
+    shards = []
+    for first, last in jobs.SplitRange(hour_count, shard_count):
+      shard_start = start + first * querystats.ROLLUP_PERIOD
+      shards.append(({"start": shard_start.strftime(querystats.ROLLUP_FORMAT),
+                      "count": last - first}, last - first))
+    return shards
+  
+  @classmethod
+  def RunShard(cls, params, shard_params, position, stats, checkpoint):
+    stats.setdefault("records", 0)
+    start = datetime.datetime.strptime(shard_params["start"],
+                                       querystats.ROLLUP_FORMAT)
+    
+    while position < shard_params["count"]:
+      stats["records"] += querystats.BackfillHour(
+        start + position * querystats.ROLLUP_PERIOD)
+      position += 1
+      checkpoint(position, stats)
+      
+    return True
+
+
+class CacheStatsHandler(base_handler.BaseHandler):
+  """Show the hit and miss counters of the caches in this instance."""
+  
+  def get(self):
+    self.SetTextMode()
+    
+    for name, stats in cache.CacheStats.registry.iteritems():
+      self.response.out.write("Cache '%s' (hit rate %.1f%%):\n"
+                              % (name, 100 * stats.hit_rate))
+      for counter, value in stats.counts.iteritems():
+        self.response.out.write("  %s: %d\n" % (counter, value))
+      self.response.out.write("\n")
@@ -20,42 +20,53 @@
 __author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
 
 
+import email.utils
 import json
-import logging
-import re
+import time
 import unicodedata
+import urllib
 import webapp2
 
-from lxml import etree
-from lxml import html
-
 from webapp2_extras import jinja2
 from webapp2_extras import sessions
 
+from epfl.courses import cache
+from epfl.courses import config
+from epfl.courses import markup
+from epfl.courses import querylog
+
 
 class BaseHandler(webapp2.RequestHandler):
   """Base handler that contains various common utilities."""
   
-  _isa_replacement_map = {
-    "[/b]": "</b>", 
-    "[/i]": "</i>", 
-    "[b]": "<b>", 
-    "[br/]": "<br/>", 
-    "[br]": "<br/>", 
-    "[i]": "<i>", 
-    "[li]": u"•  ",
-  }
+  # Memoized, as the same descriptions are converted for each language
+  # and again for the search index
+  _isa_translator = markup.ISAMarkupTranslator(memo=cache.LRUCache(2000))
   
   # TODO(bucur): Make this a global configuration parameter
   default_language = "en"
   
+  # The language of the URL prefix, see language_prefix
+  url_language_ = None
+  
+  # The search queries, written to the datastore in batches
+  query_log = querylog.QueryLog(querylog.DatastoreWriter(),
+                                batch_size=config.QUERY_LOG_BATCH_SIZE,
+                                max_delay=config.QUERY_LOG_MAX_DELAY)
+  
   def dispatch(self):
-    self.session_store = sessions.get_store(request=self.request)
-    
     try:
       webapp2.RequestHandler.dispatch(self)
     finally:
-      self.session_store.save_sessions(self.response)
+      # The store is only created by the handlers using the session
+      if "session_store" in self.__dict__:
+        self.session_store.save_sessions(self.response)
+      # Any request writes the queries left waiting by the earlier ones
+      self.query_log.FlushIfDue()
+  
+  @webapp2.cached_property
+  def session_store(self):
+    return sessions.get_store(request=self.request)
   
   @webapp2.cached_property
   def jinja2(self):
@@ -75,7 +86,8 @@ class BaseHandler(webapp2.RequestHandler):
       if lang not in ["en", "fr"]:
         self.abort(404)
       
-      if self.language != lang:
+      self.url_language_ = lang
+      if not config.STATELESS_LANGUAGE and self.session.get("language") != lang:
         self.session["language"] = lang
         
       handler_method(self, *args, **kwargs)
@@ -84,8 +96,21 @@ class BaseHandler(webapp2.RequestHandler):
   
   @property
   def language(self):
+    if self.url_language_:
+      return self.url_language_
+    if config.STATELESS_LANGUAGE:
+      return self.request.accept_language.best_match(
+        ["en", "fr"], default_match=self.default_language)
     return self.session.get("language", self.default_language)
   
+  def SetPublicCaching(self, max_age=None):
+    """Let browsers and shared caches keep the response, if it's stateless."""
+    
+    if max_age is None:
+      max_age = config.PUBLIC_CACHE_MAX_AGE
+    if config.STATELESS_LANGUAGE:
+      self.response.headers["Cache-Control"] = "public, max-age=%d" % max_age
+  
   def GetLanguageURLFor(self, _name, language=None, *args, **kwargs):
     language = language or self.language
     if language == "__switch__":
@@ -133,6 +158,68 @@ class BaseHandler(webapp2.RequestHandler):
     result.update(kwargs)
     return result
 
+  def GetNormalizedURL(self):
+    """Return the language, path and sorted non-empty query of the request."""
+
+    params = sorted((k.encode("utf-8"), v.encode("utf-8"))
+                    for k, v in self.request.GET.items() if v)
+    return "%s:%s?%s" % (self.language, self.request.path,
+                         urllib.urlencode(params))
+
+  def SetValidators(self, page):
+    """Set the conditional request headers of a cached page."""
+
+    self.response.headers["ETag"] = '"%s"' % page.etag
+    self.response.headers["Last-Modified"] = email.utils.formatdate(
+      page.last_modified, usegmt=True)
+
+  def IsNotModified(self, page):
+    """Tell if the client already has the current version of a page."""
+
+    if_none_match = self.request.headers.get("If-None-Match")
+    if if_none_match:
+      tags = [tag.strip() for tag in if_none_match.split(",")]
+      return "*" in tags or ('"%s"' % page.etag) in tags
+
+    if_modified_since = self.request.headers.get("If-Modified-Since")
+    if if_modified_since:
+      date = email.utils.parsedate_tz(if_modified_since)
+      return (date is not None
+              and int(page.last_modified) <= email.utils.mktime_tz(date))
+
+    return False
+
+  def ServeCachedPage(self, page):
+    """Write a cached page in the response, or a 304 if not modified."""
+
+    self.SetValidators(page)
+    if self.IsNotModified(page):
+      self.response.set_status(304)
+      return
+
+    self.response.headers["Content-Type"] = page.content_type
+    self.response.out.write(page.body)
+
+  def CacheRenderedPage(self, page_cache, url, version, info=None):
+    """Cache the page rendered in the response.
+
+    Args:
+      page_cache: The PageCache of the handler.
+      url: The normalized URL of the request.
+      version: The version of the content the page was rendered from, as
+        obtained from the cache before rendering.
+      info: Additional data to keep with the page.
+    """
+
+    # Generations are timestamps, so the page changed when the last of its
+    # generations began
+    last_modified = max(version) / 1000.0 if any(version) else time.time()
+    page = cache.CachedPage(self.response.body,
+                            self.response.headers.get("Content-Type"),
+                            last_modified, info=info)
+    page_cache.Put(url, page, version)
+    self.SetValidators(page)
+
   @staticmethod
   def ConvertToASCII(text):
     """Strip accents from Unicode text."""
@@ -143,27 +230,4 @@ class BaseHandler(webapp2.RequestHandler):
   def ISAMarkup(cls, value, cleanup=False):
     """Jinja filter for converting IS Academia markup to HTML."""
     
-    value = value.replace("&amp;", "&")
-    value = value.replace("&nbsp;", " ")
-    
-    tags = re.findall(r"\[[^\[]*?\]", value)
-    
-    for tag in tags:
-      if len(tag) > 7: # Empirical classification of legitimate square parentheses
-        continue
-      if tag in cls._isa_replacement_map:
-        value = value.replace(tag, cls._isa_replacement_map[tag])
-      else:
-        value = value.replace(tag, "")
-        
-    
-    value = " ".join([x.strip() for x in value.split('\n')]).strip()
-    
-    if cleanup:
-      try:
-        html_doc = html.fromstring(value)
-        value = html.tostring(html_doc)
-      except etree.XMLSyntaxError:
-        logging.warning("Very broken HTML encountered in ISA markup.")
-    
-    return value
+    return cls._isa_translator(value, cleanup=cleanup)
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Caching utilities shared by the request handlers."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import collections
+import hashlib
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import db
+
+from epfl.courses import models
+
+
+class LRUCache(object):
+  """A bounded, thread-safe dictionary evicting the least recently used keys."""
+
+  def __init__(self, max_size):
+    self.max_size = max_size
+    self.entries = collections.OrderedDict()
+    self.lock = threading.Lock()
+
+  def Get(self, key, default=None):
+    with self.lock:
+      try:
+        value = self.entries.pop(key)
+      except KeyError:
+        return default
+      self.entries[key] = value
+      return value
+
+  def Put(self, key, value):
+    with self.lock:
+      self.entries.pop(key, None)
+      self.entries[key] = value
+      while len(self.entries) > self.max_size:
+        self.entries.popitem(last=False)
+
+  def Remove(self, key):
+    with self.lock:
+      self.entries.pop(key, None)
+
+  def Clear(self):
+    with self.lock:
+      self.entries.clear()
+
+  def __len__(self):
+    return len(self.entries)
+
+
+class CacheStats(object):
+  """Per-instance hit and miss counters of a cache."""
+
+  # All the counters created in this instance, by name
+  registry = collections.OrderedDict()
+
+  def __init__(self, name):
+    self.name = name
+    self.counts = collections.OrderedDict([("local_hits", 0),
+                                           ("memcache_hits", 0),
+                                           ("misses", 0)])
+    self.registry[name] = self
+
+  @classmethod
+  def Get(cls, name):
+    return cls.registry.get(name) or cls(name)
+
+  def Increment(self, counter, delta=1):
+    self.counts[counter] = self.counts.get(counter, 0) + delta
+
+  @property
+  def hit_rate(self):
+    total = sum(self.counts.values())
+    if not total:
+      return 0.0
+    return float(total - self.counts.get("misses", 0)) / total
+
+
+class TieredCache(object):
+  """Values kept in instance memory and memcache, computed on a miss.
+
+  The keys must identify the version of the value, e.g., by including a
+  Generation number, since the entries are never invalidated explicitly.
+  """
+
+  def __init__(self, name, local_size=100, memcache_time=0):
+    self.name = name
+    self.local_cache = LRUCache(local_size)
+    self.memcache_time = memcache_time
+    self.stats = CacheStats.Get(name)
+
+  def _MemcacheKey(self, key):
+    return "%s:%s" % (self.name, key)
+
+  def Lookup(self, key):
+    """Return the value of a key, or None if it's not cached."""
+
+    value = self.local_cache.Get(key)
+    if value is not None:
+      self.stats.Increment("local_hits")
+      return value
+
+    value = memcache.get(self._MemcacheKey(key))
+    if value is None:
+      self.stats.Increment("misses")
+      return None
+
+    self.stats.Increment("memcache_hits")
+    self.local_cache.Put(key, value)
+    return value
+
+  def Put(self, key, value):
+    memcache.set(self._MemcacheKey(key), value, time=self.memcache_time)
+    self.local_cache.Put(key, value)
+
+  def Get(self, key, compute):
+    value = self.Lookup(key)
+    if value is None:
+      value = compute()
+      self.Put(key, value)
+    return value
+
+
+class CachedPage(object):
+  """A rendered page, with the validators of conditional requests.
+
+  Attributes:
+    body: The encoded response body.
+    content_type: The response content type.
+    etag: The strong entity tag of the body, without quotes.
+    last_modified: The modification time of the page, as a timestamp.
+    info: A dictionary of data needed by the handler when serving the page.
+  """
+
+  def __init__(self, body, content_type, last_modified, info=None):
+    self.body = body
+    self.content_type = content_type
+    self.etag = hashlib.sha1(body).hexdigest()
+    self.last_modified = last_modified
+    self.info = info or {}
+
+
+class PageCache(object):
+  """Rendered pages, by their URL and the generations of their content.
+
+  Attributes:
+    generations: The names of the generations the pages depend on.
+    min_hits: The number of requests of a URL before its page is cached.
+  """
+
+  def __init__(self, name, generations, local_size=100, memcache_time=0,
+               min_hits=1):
+    self.name = name
+    self.generations = generations
+    self.min_hits = min_hits
+    self.pages = TieredCache(name, local_size=local_size,
+                             memcache_time=memcache_time)
+
+  def GetVersion(self):
+    return [Generation.Get(name) for name in self.generations]
+
+  def _GetKey(self, url, version):
+    return "%s:%s" % ("-".join(str(value) for value in version),
+                      hashlib.sha1(url).hexdigest())
+
+  def Get(self, url, version):
+    """Return the CachedPage of a normalized URL and version, or None."""
+
+    return self.pages.Lookup(self._GetKey(url, version))
+
+  def ShouldCache(self, url):
+    """Count a request of an uncached URL and tell if it's popular enough."""
+
+    if self.min_hits <= 1:
+      return True
+
+    key = "%s-hits:%s" % (self.name, hashlib.sha1(url).hexdigest())
+    hits = memcache.incr(key, initial_value=0)
+    return hits is not None and hits >= self.min_hits
+
+  def Put(self, url, page, version):
+    """Cache a page, rendered with the content of the given version."""
+
+    self.pages.Put(self._GetKey(url, version), page)
+
+
+class Generation(object):
+  """A version number that invalidates all the cache entries tagged with it.
+
+  Generations are timestamps, so an evicted memcache value never brings back
+  an older number.  The value is kept in the datastore as well and re-checked
+  in memcache at most every CHECK_INTERVAL seconds.
+  """
+
+  CHECK_INTERVAL = 10
+
+  _local = {}
+  _lock = threading.Lock()
+
+  @classmethod
+  def _MemcacheKey(cls, name):
+    return "generation:%s" % name
+
+  @classmethod
+  def Get(cls, name):
+    now = time.time()
+    with cls._lock:
+      value, checked = cls._local.get(name, (None, 0))
+    if value is not None and now - checked < cls.CHECK_INTERVAL:
+      return value
+
+    value = memcache.get(cls._MemcacheKey(name))
+    if value is None:
+      entity = models.CacheGeneration.get_by_key_name(name)
+      value = entity.value if entity else 0
+      # A Bump since the datastore read has set the newer value
+      if not memcache.add(cls._MemcacheKey(name), value):
+        value = memcache.get(cls._MemcacheKey(name)) or value
+
+    with cls._lock:
+      cls._local[name] = (value, now)
+    return value
+
+  @classmethod
+  def Bump(cls, name):
+    """Start a new generation and return its number."""
+
+    value = int(time.time() * 1000)
+    models.CacheGeneration(key_name=name, value=value).put()
+    memcache.set(cls._MemcacheKey(name), value)
+    with cls._lock:
+      cls._local[name] = (value, time.time())
+    return value
+
+
+class CourseCache(object):
+  """Read-through cache of Course entities, by language and course ID.
+
+  The entities are kept as serialized protocol buffers, both in memcache and
+  in instance memory, so each request decodes its own copy.  The entries are
+  tagged with the catalog generation, which the admin handlers bump after
+  changing courses.
+  """
+
+  GENERATION = "catalog"
+
+  # The number of entities kept in instance memory
+  LOCAL_CACHE_SIZE = 1000
+
+  # The memcache expiration time, in seconds
+  MEMCACHE_TIME = 24 * 3600
+
+  KEY_PREFIX = "course"
+
+  local_cache = LRUCache(LOCAL_CACHE_SIZE)
+  stats = CacheStats.Get("courses")
+
+  @classmethod
+  def _GetKey(cls, generation, course_id, lang):
+    return ("%s:%d:%s:%s" % (cls.KEY_PREFIX, generation, lang,
+                             course_id)).encode("utf-8")
+
+  @classmethod
+  def _Fetch(cls, course_ids, lang):
+    return models.Course.GetByCourseID(course_ids, lang)
+
+  @staticmethod
+  def _Encode(course):
+    return db.model_to_protobuf(course).Encode()
+
+  @staticmethod
+  def _Decode(data):
+    return db.model_from_protobuf(entity_pb.EntityProto(data))
+
+  @classmethod
+  def Get(cls, course_id, lang="en"):
+    """Return the entity of an ID, or the list of entities of a list of IDs.
+
+    Behaves like GetByCourseID, with a single datastore call for all
+    the courses missing from the cache.
+    """
+
+    if isinstance(course_id, basestring):
+      return cls.Get([course_id], lang)[0]
+
+    generation = Generation.Get(cls.GENERATION)
+    keys = [cls._GetKey(generation, cid, lang) for cid in course_id]
+    found = {}
+
+    for key in keys:
+      data = cls.local_cache.Get(key)
+      if data is not None:
+        found[key] = data
+    cls.stats.Increment("local_hits", len(found))
+
+    missing = [key for key in keys if key not in found]
+    if missing:
+      cached = memcache.get_multi(missing)
+      cls.stats.Increment("memcache_hits", len(cached))
+      for key, data in cached.iteritems():
+        cls.local_cache.Put(key, data)
+      found.update(cached)
+
+    missing_ids = [cid for cid, key in zip(course_id, keys) if key not in found]
+    if missing_ids:
+      cls.stats.Increment("misses", len(missing_ids))
+      fetched = {}
+      for cid, course in zip(missing_ids,
+                             cls._Fetch(missing_ids, lang)):
+        if course is None:
+          continue
+        key = cls._GetKey(generation, cid, lang)
+        fetched[key] = cls._Encode(course)
+        cls.local_cache.Put(key, fetched[key])
+      if fetched:
+        memcache.set_multi(fetched, time=cls.MEMCACHE_TIME)
+      found.update(fetched)
+
+    return [cls._Decode(found[key]) if key in found else None for key in keys]
+
+  @classmethod
+  def Invalidate(cls):
+    """Drop the cached courses of all the instances."""
+
+    Generation.Bump(cls.GENERATION)
+
+
+class CourseSummaryCache(CourseCache):
+  """Read-through cache of the CourseSummary entities shown in listings."""
+
+  LOCAL_CACHE_SIZE = 5000
+
+  KEY_PREFIX = "summary"
+
+  local_cache = LRUCache(LOCAL_CACHE_SIZE)
+  stats = CacheStats.Get("summaries")
+
+  @classmethod
+  def _Fetch(cls, course_ids, lang):
+    summaries = models.CourseSummary.GetByCourseID(course_ids, lang)
+
+    # Courses imported before the summaries existed
+    missing = [cid for cid, summary in zip(course_ids, summaries)
+               if summary is None]
+    if missing:
+      courses = dict(zip(missing, models.Course.GetByCourseID(missing, lang)))
+      summaries = [summary or (courses[cid] and
+                               models.CourseSummary.FromCourse(courses[cid]))
+                   for cid, summary in zip(course_ids, summaries)]
+    return summaries
@@ -20,18 +20,30 @@
 __author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
 
 
+import datetime
 import logging
 import os
-import urllib
-import webapp2
+import time
 
 from epfl.courses import base_handler
+from epfl.courses import cache
 from epfl.courses import config
 from epfl.courses import models
+from epfl.courses import registry
 from epfl.courses import search
+from epfl.courses import viewmodel
+from epfl.courses.search import appsearch_admin
 
 
 class SearchPagination(object):
+  """The page links of the search results.
+
+  The App Engine search only reaches offsets up to MAX_OFFSET without a
+  cursor, so the plain offset links stop there.  The pages after it are
+  only reached with the cursor of the Next link.
+  """
+
+  MAX_OFFSET = search.AppSearchProvider.MAX_OFFSET
 
   def __init__(self, results):
     self.offset = results.offset
@@ -45,19 +57,72 @@ class SearchPagination(object):
     if self.total_found:
       self.total_pages = (self.total_found-1)/config.PAGE_SIZE + 1
 
-      for i in range(self.total_pages):
-        self.pages.append((i, i*config.PAGE_SIZE))
-
       self.page = self.offset/config.PAGE_SIZE
 
+      for i in range(self.total_pages):
+        if i*config.PAGE_SIZE <= self.MAX_OFFSET or i == self.page:
+          self.pages.append((i, i*config.PAGE_SIZE))
+
       if self.page > 0:
         self.prev_offset = (min(self.page, self.total_pages) - 1)*config.PAGE_SIZE
+        if self.prev_offset > self.MAX_OFFSET:
+          self.prev_offset = None
       if self.page < self.total_pages - 1:
         self.next_offset = (self.page + 1)*config.PAGE_SIZE
+        # Providers supporting cursors continue from the end of this page
+        if results.next_cursor:
+          self.next_offset = results.next_cursor.Encode()
+        elif self.next_offset > self.MAX_OFFSET:
+          self.next_offset = None
 
 
 class CatalogPage(base_handler.BaseHandler):
 
+  ACCURACY = 2000
+
+  def GetLocalIndexVersion(self):
+    # The local index is reloaded when the courses change
+    return cache.Generation.Get(cache.CourseCache.GENERATION)
+
+  def CreateSearchProviders(self, deadline=None):
+    providers = []
+    if config.USE_LOCAL_SEARCH:
+      providers.append(search.LocalIndexSearchProvider(
+        loader=appsearch_admin.AppEngineIndex.LoadLocalIndex,
+        version=self.GetLocalIndexVersion()))
+    providers.append(search.AppSearchProvider)
+    if config.USE_SITE_SEARCH:
+      providers.append(search.SiteSearchProvider(deadline=deadline))
+
+    return providers
+
+  def CreateSpeller(self):
+    if not config.USE_LOCAL_SEARCH:
+      return None
+
+    return search.GetSharedCorrector(
+      appsearch_admin.AppEngineIndex.LoadLocalIndex,
+      self.GetLocalIndexVersion())
+
+  def CreateSearchProvider(self, exact_search=False):
+    """Create the composite search engine of a request."""
+
+    deadline = time.time() + config.SEARCH_DEADLINE
+    staged_provider = search.StagedSearchProvider(
+      self.CreateSearchProviders(deadline=deadline),
+      hedge_delay=config.SEARCH_HEDGE_DELAY,
+      deadline=deadline)
+
+    autocorr_provider = search.AutocorrectedSearchProvider(
+      staged_provider, exact_search=exact_search,
+      speller_loader=self.CreateSpeller,
+      concurrent=config.CONCURRENT_AUTOCORRECT,
+      suggestion_cache=search.SuggestionCache)
+
+    return search.CachedSearchProvider(autocorr_provider,
+                                       language=self.language,
+                                       exact_search=exact_search)
+
   def BuildQueryFromRequest(self):
     def append_filter(query, id_name, field_name):
       field_value = self.request.get(id_name)
@@ -84,109 +149,152 @@ class CatalogPage(base_handler.BaseHandler):
 
     return query
 
-  def GetOffsetFromRequest(self):
-    offset = 0
-
-    if self.request.get("offset"):
-      try:
-        offset = int(self.request.get("offset"))
-        if offset < 0:
-          offset = 0
-      except ValueError:
-        pass
-
-    return offset
-
-  def RecordQuery(self, query_string, offset):
-    q_record = models.SearchQueryRecord()
-    q_record.q = self.request.get("q")
-    q_record.aq_t = self.request.get("aq_t")
-    q_record.aq_lang = self.request.get("aq_lang")
-    q_record.aq_in = self.request.get("aq_in")
-    q_record.aq_sec = self.request.get("aq_sec")
-    q_record.aq_sem = self.request.get("aq_sem")
-    q_record.aq_exam = self.request.get("aq_exam")
-    q_record.aq_cred = self.request.get("aq_cred")
-    q_record.aq_coeff = self.request.get("aq_coeff")
-    q_record.aq_hours_l = self.request.get("aq_hours_l")
-    q_record.aq_hours_r = self.request.get("aq_hours_r")
-    q_record.aq_hours_p = self.request.get("aq_hours_p")
-
-    q_record.translated_query = query_string
-    q_record.offset = offset
-
-    q_record.client_address = os.environ["REMOTE_ADDR"]
-
-    q_record.put()
-
-    return q_record
-
-  @webapp2.cached_property
-  def section_data(self):
-    result = {}
-    for language in ["en", "fr"]:
-      data = []
-      for school in models.School.all():
-        sections = []
-        for section in school.section_set:
-          if section.alias:
-            continue
-          sections.append((section.code,
-                           section.display_name(use_french=(language == "fr"))))
-
-        sections.sort(key=lambda section: section[1])
-        data.append((school.code if school.code != models.School.OTHER else "",
-                     school.title(use_french=(language == "fr")), sections))
-
-      data.sort(key=lambda school: school[1])
-      result[language] = data
-
-    return result
+  def GetPageCursorFromRequest(self):
+    # The offset parameter holds either a plain offset or a page cursor
+    return search.PageCursor.Parse(self.request.get("offset"))
+
+  def RecordQuery(self, query_string, offset, results_count=None,
+                  suggested_query=None):
+    record = dict((name, self.request.get(name))
+                  for name in ["q", "aq_t", "aq_lang", "aq_in", "aq_sec",
+                               "aq_sem", "aq_exam", "aq_cred", "aq_coeff",
+                               "aq_hours_l", "aq_hours_r", "aq_hours_p"])
+
+    record["translated_query"] = query_string
+    record["offset"] = offset
+    record["results_count"] = results_count
+    record["suggested_query"] = suggested_query
+
+    record["time_stamp"] = datetime.datetime.now()
+    record["client_address"] = os.environ["REMOTE_ADDR"]
+
+    self.query_log.Add(record)
+
+  # The section dropdown data and its rendered HTML, keyed by the version of
+  # the section registry and the language
+  section_cache = cache.TieredCache("sections", local_size=10)
+
+  # The result rows of the courses, without the query-dependent cells
+  row_cache = cache.TieredCache("rows", local_size=1000)
+
+  # The pages of the queries requested often enough
+  page_cache = cache.PageCache("catalog-pages",
+                               [cache.CourseCache.GENERATION,
+                                registry.SectionRegistry.GENERATION,
+                                search.CachedSearchProvider.GENERATION],
+                               min_hits=config.PAGE_CACHE_MIN_HITS)
+
+  @staticmethod
+  def ComputeSectionData(language):
+    data = []
+    for school in registry.SectionRegistry.Get().GetSchools():
+      sections = []
+      for section in school.sections:
+        sections.append((section.code,
+                         section.display_name(use_french=(language == "fr"))))
+
+      sections.sort(key=lambda section: section[1])
+      data.append((school.code if school.code != models.School.OTHER else "",
+                   school.title(use_french=(language == "fr")), sections))
+
+    data.sort(key=lambda school: school[1])
+    return data
+
+  def GetSectionData(self):
+    key = "data:%s:%s" % (registry.SectionRegistry.Get().version,
+                          self.language)
+    return self.section_cache.Get(
+      key, lambda: self.ComputeSectionData(self.language))
+
+  def GetSectionSelect(self):
+    """Return the rendered section dropdown, without result counts."""
+
+    key = "select:%s:%s" % (registry.SectionRegistry.Get().version,
+                            self.language)
+    return self.section_cache.Get(key, lambda: self.GetRenderedTemplate(
+      "section_select.html", {
+        "static": {"sections": self.GetSectionData()},
+        "counts": {},
+      }))
+
+  def GetCourseRows(self, courses):
+    """Return the courses along with the HTML of their cached row cells."""
+
+    version = "%s:%s" % (cache.Generation.Get(cache.CourseCache.GENERATION),
+                         registry.SectionRegistry.Get().version)
+    return [(course, self.row_cache.Get(
+              "%s:%s:%s" % (version, self.language, course.course_id),
+              lambda: self.GetRenderedTemplate("course_row.html", {
+                "course": course,
+                "language": self.language,
+              })))
+            for course in courses]
+
+  def SetPageCaching(self, query_string):
+    # The search result pages are kept shorter, since the queries they answer
+    # aren't recorded
+    if query_string:
+      self.SetPublicCaching(max_age=config.PUBLIC_CACHE_QUERY_MAX_AGE)
+    else:
+      self.SetPublicCaching()
 
   @base_handler.BaseHandler.language_prefix
   def get(self):
-
-    ACCURACY = 2000
-
     query = self.BuildQueryFromRequest()
-    offset = self.GetOffsetFromRequest()
+    page_cursor = self.GetPageCursorFromRequest()
 
     query_string = query.GetString()
+
+    url = self.GetNormalizedURL()
+    version = self.page_cache.GetVersion()
+    if config.USE_PAGE_CACHE:
+      page = self.page_cache.Get(url, version)
+      if page:
+        if query_string:
+          self.RecordQuery(query_string, page_cursor.offset,
+                           results_count=page.info.get("results_count"),
+                           suggested_query=page.info.get("suggested_query"))
+        self.SetPageCaching(query_string)
+        self.ServeCachedPage(page)
+        return
+
     found_courses = None
-    search_results = search.SearchResults(query_string, offset)
+    search_results = search.SearchResults(query_string, page_cursor.offset)
     exact_search = self.request.get("exact")
 
-    # Create the composite search engine
-    staged_provider = search.StagedSearchProvider([search.AppSearchProvider,
-                                                   search.SiteSearchProvider()])
-
-    autocorr_provider = search.AutocorrectedSearchProvider(
-      staged_provider, exact_search=exact_search)
+    search_provider = self.CreateSearchProvider(exact_search=exact_search)
 
     if query_string:
       logging.info("Invoking original search query '%s'" % query_string)
 
-      q_record = self.RecordQuery(query_string, offset)
+      search_provider.Search(query,
+                             search_results,
+                             limit=config.PAGE_SIZE,
+                             offset=page_cursor,
+                             accuracy=self.ACCURACY)
 
-      autocorr_provider.Search(query,
-                               search_results,
-                               limit=config.PAGE_SIZE,
-                               offset=offset,
-                               accuracy=ACCURACY)
-
-      if search_results.results:
-        q_record.results_count = search_results.number_found
-        q_record.suggested_query = autocorr_provider.suggested_query
-        q_record.put()
+      if not search_results.results:
+        self.RecordQuery(query_string, page_cursor.offset)
+      else:
+        self.RecordQuery(query_string, page_cursor.offset,
+                         results_count=search_results.number_found,
+                         suggested_query=search_provider.suggested_query)
 
-        found_courses = models.Course.GetByCourseID(search_results.results,
-                                                    lang=self.language)
+        found_courses = cache.CourseSummaryCache.Get(search_results.results,
+                                                     lang=self.language)
         found_courses = filter(lambda course: course is not None, found_courses)
 
+    # The dropdown is rendered along with the page only if it shows counts
+    section_select = None
+    if not search_results.facets:
+      section_select = self.GetSectionSelect()
+
     template_args = {
       'courses': found_courses,
+      'course_rows': self.GetCourseRows(found_courses or []),
+      'section_select': section_select,
       'static': {
-        'sections': self.section_data[self.language],
+        'sections': self.GetSectionData(),
         'exam': config.EXAM[self.language],
         'credits': config.CREDITS,
         'coeff': config.COEFFICIENT,
@@ -195,9 +303,27 @@ class CatalogPage(base_handler.BaseHandler):
         'project': config.PROJECT_TIME,
         'samples': config.SAMPLE_QUERIES[self.language],
       },
+      # The number of results per option of the advanced search, if known
+      'counts': {
+        'sections': (search_results.facets or {}).get("section"),
+        'semester': search_results.GetFacetCounts(
+          "semester", ["fall", "spring"] if self.language == "en"
+          else ["automne", "printemps"]),
+        'exam': search_results.GetFacetCounts("exam",
+                                              config.EXAM[self.language]),
+        'credits': search_results.GetFacetCounts("credits", config.CREDITS),
+        'coeff': search_results.GetFacetCounts("coefficient",
+                                               config.COEFFICIENT),
+        'lecture': search_results.GetFacetCounts("lecthours",
+                                                 config.LECTURE_TIME),
+        'recitation': search_results.GetFacetCounts("recithours",
+                                                    config.RECITATION_TIME),
+        'project': search_results.GetFacetCounts("projhours",
+                                                 config.PROJECT_TIME),
+      },
       'query': query_string,
-      'original_query': autocorr_provider.original_query,
-      'suggested_query': autocorr_provider.suggested_query,
+      'original_query': search_provider.original_query,
+      'suggested_query': search_provider.suggested_query,
       'offset': search_results.offset,
       'exact': exact_search,
       'pagination': SearchPagination(search_results),
@@ -214,6 +340,17 @@ class CatalogPage(base_handler.BaseHandler):
 
     self.RenderTemplate('catalog.html', template_args)
 
+    # Empty results may come from a failed search, so they aren't kept
+    if not search_results.results and query_string:
+      return
+
+    self.SetPageCaching(query_string)
+    if config.USE_PAGE_CACHE and self.page_cache.ShouldCache(url):
+      self.CacheRenderedPage(self.page_cache, url, version, info={
+        "results_count": search_results.number_found,
+        "suggested_query": search_provider.suggested_query,
+      })
+
 
 class LanguageRedirect(base_handler.BaseHandler):
   def get(self, *args, **kwargs):
@@ -221,54 +358,33 @@ class LanguageRedirect(base_handler.BaseHandler):
 
 
 class CoursePage(base_handler.BaseHandler):
-  def ComputeSectionHierarchy(self, course):
-    course.sections_ = zip(course.sections, course.study_plans, course.urls,
-                           course.code_prefix, course.code_number)
-
-    course.hierarchy_ = {}
-
-    for section_trio in course.sections_:
-      school = section_trio[0].school
-      if school.code == school.OTHER:
-        title = school.title(use_french=(self.language == "fr"))
-      else:
-        title = "%s - %s" % (school.code,
-                             school.title(use_french=(self.language == "fr")))
-
-      school_ = course.hierarchy_.setdefault(title, {})
-
-      section_ = school_.setdefault(section_trio[0].title(use_french=(self.language == "fr")),
-                                    (section_trio[0].code, set()))
-      if section_trio[3] != "XX":
-        section_[1].add("-".join([section_trio[3], section_trio[4]]))
-
-  def ComputeHoursVisibility(self, course):
-    show_vector = [getattr(course, '%s_time' % s, None)
-                   and not getattr(course, '%s_weeks' % s, None)
-                   for s in ["lecture", "recitation", "project"]]
-
-    course.show_trio_ = not reduce(lambda x, y: x or y, show_vector)
-
-  def DecodeLinksURLs(self, course):
-    decoded_links = [urllib.unquote_plus(link) for link in course.links]
-    course.links_ = zip(course.links, decoded_links)
+  page_cache = cache.PageCache("course-pages",
+                               [cache.CourseCache.GENERATION,
+                                registry.SectionRegistry.GENERATION],
+                               local_size=200)
 
   @base_handler.BaseHandler.language_prefix
   def get(self, course_key):
+    self.SetPublicCaching()
+    url = self.GetNormalizedURL()
+    version = self.page_cache.GetVersion()
+    if config.USE_PAGE_CACHE:
+      page = self.page_cache.Get(url, version)
+      if page:
+        self.ServeCachedPage(page)
+        return
+
     try:
-      course = models.Course.GetByCourseID(course_key, self.language)
+      course = cache.CourseCache.Get(course_key, self.language)
     except UnicodeDecodeError:
       self.abort(404)
 
     if not course:
       self.abort(404)
 
-    self.ComputeSectionHierarchy(course)
-    self.ComputeHoursVisibility(course)
-    self.DecodeLinksURLs(course)
-
     template_args = {
       "course": course,
+      "view": viewmodel.CourseView.Get(course),
       "back_link": self.GetLanguageURLFor("catalog",
                                 q=self.request.get("orig_q", "").encode("utf-8"),
                                 offset=self.request.get("orig_offset", "").encode("utf-8"),
@@ -280,3 +396,6 @@ class CoursePage(base_handler.BaseHandler):
     }
 
     self.RenderTemplate('course.html', template_args)
+
+    if config.USE_PAGE_CACHE:
+      self.CacheRenderedPage(self.page_cache, url, version)
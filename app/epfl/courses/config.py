@@ -32,6 +32,54 @@ LAUNCH_DATE = datetime.datetime(2012, 6, 14, 17, 20)
 # The Google Custom Search ID
 SEARCH_ENGINE_ID = "000528554756935640955:t5p6oxkfane"
 
+# Answer queries from an in-process index before using the search services
+USE_LOCAL_SEARCH = True
+
+# Fall back to Google Site Search for queries without results
+USE_SITE_SEARCH = True
+
+# Issue the later remote search stages speculatively once a search has been
+# running for this many seconds (None runs the stages strictly one after
+# another, 0 issues them all at once)
+SEARCH_HEDGE_DELAY = 0.3
+
+# The time budget of a search, in seconds
+SEARCH_DEADLINE = 10
+
+# Issue the search for a known spelling suggestion before the original query,
+# instead of after the original query came back empty
+CONCURRENT_AUTOCORRECT = True
+
+# Serve the course and search result pages from the page cache
+USE_PAGE_CACHE = True
+
+# The number of requests after which a search result page is cached
+PAGE_CACHE_MIN_HITS = 3
+
+# Take the page language from the URL prefix alone, without a session, so
+# the pages can be cached publicly
+STATELESS_LANGUAGE = True
+
+# The time the public caches may keep a page, in seconds
+PUBLIC_CACHE_MAX_AGE = 600
+
+# The time the public caches may keep a search result page, in seconds.  The
+# queries answered by a public cache never reach the query log, so popular
+# queries are undercounted by at most one hit per cache and period.
+PUBLIC_CACHE_QUERY_MAX_AGE = 60
+
+# The number of query records written together to the datastore
+QUERY_LOG_BATCH_SIZE = 20
+
+# The number of seconds a query record may wait before being written
+QUERY_LOG_MAX_DELAY = 60
+
+# The number of parallel tasks of the import and indexing jobs
+BATCH_JOB_SHARDS = 8
+
+# The task queue of the import and indexing jobs, see queue.yaml
+BATCH_JOB_QUEUE = "batch"
+
 
 STUDY_PLANS = {
   "en": {
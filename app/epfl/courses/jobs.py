@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Long administrative jobs, split in shards that run as parallel tasks.
+
+Each shard persists a checkpoint after every unit of work, so a task that
+fails is retried from its last checkpoint, and a paused or stalled job is
+resumed without redoing the finished work.  The job and its shards are
+stored as BatchJob and BatchJobShard entities, which also give the progress
+of the job.
+"""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import collections
+import datetime
+import json
+import logging
+
+import webapp2
+
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+from epfl.courses import models
+
+
+# The time a shard task holds its shard without checkpointing, after which
+# the shard may be run by another task
+SHARD_LEASE_TIME = datetime.timedelta(minutes=5)
+
+
+class ShardLeasedError(Exception):
+  """Raised by a shard task while another task holds the shard."""
+
+
+class ShardedJob(object):
+  """The definition of a job, overridden by the concrete jobs.
+
+  The parameters of the job and of its shards are JSON dictionaries.  The
+  statistics of each shard are a dictionary of counts, summed over the
+  shards when the job finishes.
+
+  A job class defines the following class methods:
+
+    CreateShards(params, shard_count): Return the (parameters, size) of at
+      most shard_count shards.
+
+    RunShard(params, shard_params, position, stats, checkpoint): Do the work
+      of a shard, starting at the given position.  After each unit of work
+      is persisted, checkpoint is called with the new position and the
+      statistics.  Return False to pause the job, e.g., when running out of
+      quota.
+
+  Pause and Finish may be overridden as well.
+  """
+
+  @classmethod
+  def Pause(cls, params):
+    """Called when a shard pauses the job."""
+
+    pass
+
+  @classmethod
+  def Finish(cls, params, stats):
+    """Called once, after all shards are done, with the summed statistics."""
+
+    pass
+
+
+class TaskQueueRunner(object):
+  """Runs the tasks on the App Engine task queue, as deferred calls."""
+
+  def __init__(self, queue_name="default"):
+    self.queue_name = queue_name
+
+  def Add(self, func, args, transactional=False):
+    deferred.defer(func, *args, _queue=self.queue_name,
+                   _transactional=transactional)
+
+
+class LocalTaskRunner(object):
+  """Runs the tasks in the current process, for testing off-platform.
+
+  The tasks run in the order they were added, when calling Run.  A failing
+  task is retried later, as the task queue would, up to max_attempts times.
+  """
+
+  def __init__(self, max_attempts=3):
+    self.max_attempts = max_attempts
+    self.tasks = collections.deque()
+
+  def Add(self, func, args, transactional=False):
+    self.tasks.append((func, args, 1))
+
+  def Run(self):
+    """Run the tasks, including those they add, until none is left."""
+
+    while self.tasks:
+      func, args, attempt = self.tasks.popleft()
+      try:
+        func(*args)
+      except Exception:
+        if attempt >= self.max_attempts:
+          raise
+        logging.exception("Task %s failed, retrying" % func.__name__)
+        self.tasks.append((func, args, attempt + 1))
+
+
+def SplitRange(count, shard_count):
+  """Split [0, count) into at most shard_count (start, end) ranges."""
+
+  shard_count = max(1, min(shard_count, count))
+  bounds = [count * index // shard_count for index in range(shard_count + 1)]
+  return [(start, end) for start, end in zip(bounds, bounds[1:])
+          if start < end]
+
+
+def GetShardKeyName(job_id, index):
+  return "%d:%d" % (job_id, index)
+
+
+def GetShards(job):
+  return models.BatchJobShard.get_by_key_name(
+    [GetShardKeyName(job.key().id(), index)
+     for index in range(job.shard_count)])
+
+
+def StartJob(job_class, params, shard_count, runner):
+  """Create the shards of a job and add their tasks.  Return the job ID."""
+
+  shards = job_class.CreateShards(params, shard_count)
+
+  job = models.BatchJob(job_class="%s.%s" % (job_class.__module__,
+                                             job_class.__name__),
+                        params=json.dumps(params),
+                        shard_count=len(shards))
+  job.put()
+  job_id = job.key().id()
+
+  db.put([models.BatchJobShard(key_name=GetShardKeyName(job_id, index),
+                               params=json.dumps(shard_params),
+                               size=size)
+          for index, (shard_params, size) in enumerate(shards)])
+
+  if not shards:
+    runner.Add(FinishJob, (runner, job_id))
+  for index in range(len(shards)):
+    runner.Add(RunShard, (runner, job_id, index))
+
+  logging.info("Started job %d of %s with %d shards"
+               % (job_id, job.job_class, len(shards)))
+  return job_id
+
+
+def IsLeased(shard):
+  return (shard.lease_until is not None
+          and shard.lease_until > datetime.datetime.now())
+
+
+def _LeaseShard(job_id, index):
+  shard = models.BatchJobShard.get_by_key_name(GetShardKeyName(job_id, index))
+  if shard is None or shard.state == "done":
+    return None
+  if IsLeased(shard):
+    raise ShardLeasedError("Shard %d of job %d is leased until %s"
+                           % (index, job_id, shard.lease_until))
+
+  shard.state = "running"
+  shard.lease_until = datetime.datetime.now() + SHARD_LEASE_TIME
+  shard.put()
+  return shard
+
+
+def RunShard(runner, job_id, index):
+  """The task of a shard, continuing from its last checkpoint.
+
+  The task leases the shard, and renews the lease at each checkpoint.  While
+  the lease of another task is live, it fails, so it's retried later.
+  """
+
+  job = models.BatchJob.get_by_id(job_id)
+  if job is None:
+    return
+  shard = db.run_in_transaction(_LeaseShard, job_id, index)
+  if shard is None:
+    return
+
+  job_class = webapp2.import_string(job.job_class)
+  params = json.loads(job.params)
+  stats = json.loads(shard.stats or "{}")
+
+  def Checkpoint(position, stats):
+    shard.position = position
+    shard.stats = json.dumps(stats)
+    shard.lease_until = datetime.datetime.now() + SHARD_LEASE_TIME
+    shard.put()
+
+  try:
+    done = job_class.RunShard(params, json.loads(shard.params),
+                              shard.position, stats, Checkpoint)
+  except Exception as e:
+    # The task is retried from the last checkpoint
+    shard.error = "%s: %s" % (type(e).__name__, e)
+    shard.lease_until = None
+    shard.put()
+    raise
+
+  shard.lease_until = None
+  if not done:
+    shard.state = "paused"
+    shard.put()
+    db.run_in_transaction(_SetJobState, job_id, "paused")
+    job_class.Pause(params)
+    return
+
+  shard.state = "done"
+  shard.error = None
+  shard.put()
+  db.run_in_transaction(_CompleteShard, runner, job_id, index)
+
+
+def _SetJobState(job_id, state):
+  job = models.BatchJob.get_by_id(job_id)
+  job.state = state
+  job.put()
+
+
+def _CompleteShard(runner, job_id, index):
+  job = models.BatchJob.get_by_id(job_id)
+  if index in job.done_shards:
+    return
+
+  job.done_shards.append(index)
+  if len(job.done_shards) == job.shard_count:
+    job.state = "finishing"
+    runner.Add(FinishJob, (runner, job_id), transactional=True)
+  job.put()
+
+
+def FinishJob(runner, job_id):
+  """The task run after all shards of a job are done."""
+
+  job = models.BatchJob.get_by_id(job_id)
+  if job is None or job.state == "done":
+    return
+
+  stats = {}
+  for shard in GetShards(job):
+    for key, value in json.loads(shard.stats or "{}").iteritems():
+      stats[key] = stats.get(key, 0) + value
+
+  job_class = webapp2.import_string(job.job_class)
+  job_class.Finish(json.loads(job.params), stats)
+
+  job.stats = json.dumps(stats)
+  job.state = "done"
+  job.put()
+  logging.info("Finished job %d: %s" % (job_id, job.stats))
+
+
+def ResumeJob(job_id, runner):
+  """Add again the tasks of the unfinished shards of a paused or stalled job.
+
+  The shards still leased by a running task are left to it.  Return False if
+  there is nothing to resume.
+  """
+
+  job = models.BatchJob.get_by_id(job_id)
+  if job is None or job.state == "done":
+    return False
+
+  if job.state == "finishing":
+    runner.Add(FinishJob, (runner, job_id))
+    return True
+
+  db.run_in_transaction(_SetJobState, job_id, "running")
+  for index, shard in enumerate(GetShards(job)):
+    if index in job.done_shards:
+      continue
+    if IsLeased(shard):
+      logging.info("Shard %d of job %d is still running" % (index, job_id))
+      continue
+    runner.Add(RunShard, (runner, job_id, index))
+  return True
@@ -26,6 +26,8 @@ from webapp2_extras import routes
 from epfl.courses import admin
 from epfl.courses import base_handler
 from epfl.courses import catalog
+from epfl.courses import templating
+from epfl.courses import warmup
 
 config = {}
 config['webapp2_extras.sessions'] = {
@@ -33,6 +35,12 @@ config['webapp2_extras.sessions'] = {
 }
 
 config['webapp2_extras.jinja2'] = {
+  'template_path': templating.TEMPLATE_PATH,
+  'compiled_path': templating.GetCompiledPath(),
+  # The application runs in debug mode, where the precompiled templates
+  # would be ignored otherwise
+  'force_compiled': True,
+  'environment_args': templating.GetEnvironmentArgs(),
   'filters': {
     'isamarkup': base_handler.BaseHandler.ISAMarkup,
   },
@@ -44,6 +52,7 @@ config['webapp2_extras.jinja2'] = {
 
 app = webapp2.WSGIApplication([
    webapp2.Route('/sitemap.xml', handler=admin.SitemapHandler),
+   webapp2.Route('/_ah/warmup', handler=warmup.WarmupHandler),
    
    webapp2.Route('/', handler=catalog.LanguageRedirect,
                  name="catalog-redir"),
@@ -63,7 +72,15 @@ app = webapp2.WSGIApplication([
    routes.PathPrefixRoute('/admin', [
      webapp2.Route('/reinit/<operation>', handler=admin.ImportCourseCatalog),
      webapp2.Route('/index/<operation>', handler=admin.BuildSearchIndexHandler),
+     webapp2.Route('/jobs', handler=admin.BatchJobHandler),
+     webapp2.Route('/jobs/<job_id:\d+>', handler=admin.BatchJobHandler,
+                   name="job"),
+     webapp2.Route('/jobs/<job_id:\d+>/<operation>',
+                   handler=admin.BatchJobHandler),
      webapp2.Route('/qstats', handler=admin.QueryStatsHandler),
+     webapp2.Route('/qstats/backfill',
+                   handler=admin.BackfillQueryStatsHandler),
+     webapp2.Route('/cachestats', handler=admin.CacheStatsHandler),
      webapp2.Route('/section/<sec_id>/remove/<dest_id>',
                    handler=admin.RemoveSectionHandler),
    ])],
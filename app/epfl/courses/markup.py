@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Conversion of the IS Academia markup to HTML.
+
+This module has no App Engine dependencies, so the offline scripts can use
+it as well.
+"""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import hashlib
+import logging
+import re
+
+from lxml import etree
+from lxml import html
+
+
+ISA_REPLACEMENT_MAP = {
+  "[/b]": "</b>",
+  "[/i]": "</i>",
+  "[b]": "<b>",
+  "[br/]": "<br/>",
+  "[br]": "<br/>",
+  "[i]": "<i>",
+  "[li]": u"•  ",
+}
+
+# Bracketed text of at most 7 characters, an empirical classification of
+# the legitimate square parentheses
+ISA_TAG_RE = re.compile(r"\[[^\[\]]{0,5}\]")
+
+# All bracketed text, as found by the original translator
+ISA_BRACKETS_RE = re.compile(r"\[[^\[]*?\]")
+
+
+def _ReplaceTag(match):
+  return ISA_REPLACEMENT_MAP.get(match.group(0), "")
+
+
+class ISAMarkupTranslator(object):
+  """Converts IS Academia markup to HTML, in a single pass over the tags.
+
+  The output is identical to that of the original translator, which
+  replaced each tag in turn over the entire text.  The two only differ when
+  dropping an unknown tag joins the text around it into another tag, as in
+  "[[x]b]", so the original translator handles these rare cases.
+
+  Attributes:
+    memo: An optional cache with Get and Put methods, where the output is
+      kept by a hash of the input.
+  """
+
+  def __init__(self, memo=None):
+    self.memo = memo
+
+  @staticmethod
+  def _Normalize(value):
+    value = value.replace("&amp;", "&")
+    return value.replace("&nbsp;", " ")
+
+  @staticmethod
+  def _JoinLines(value):
+    return " ".join([x.strip() for x in value.split('\n')]).strip()
+
+  @classmethod
+  def TranslateLegacy(cls, value):
+    """The original translator, with a string replacement per tag."""
+
+    value = cls._Normalize(value)
+
+    tags = ISA_BRACKETS_RE.findall(value)
+
+    for tag in tags:
+      if len(tag) > 7:
+        continue
+      if tag in ISA_REPLACEMENT_MAP:
+        value = value.replace(tag, ISA_REPLACEMENT_MAP[tag])
+      else:
+        value = value.replace(tag, "")
+
+    return cls._JoinLines(value)
+
+  @classmethod
+  def Translate(cls, value):
+    """Convert the tags and join the lines of IS Academia markup."""
+
+    normalized = cls._Normalize(value)
+    result = ISA_TAG_RE.sub(_ReplaceTag, normalized)
+    if ISA_TAG_RE.search(result):
+      # A tag formed by dropping another one
+      return cls.TranslateLegacy(value)
+
+    return cls._JoinLines(result)
+
+  @staticmethod
+  def Cleanup(value):
+    """Fix the HTML structure of the converted markup."""
+
+    try:
+      html_doc = html.fromstring(value)
+      value = html.tostring(html_doc)
+    except etree.XMLSyntaxError:
+      logging.warning("Very broken HTML encountered in ISA markup.")
+
+    return value
+
+  def __call__(self, value, cleanup=False):
+    if self.memo is None:
+      return self._Convert(value, cleanup)
+
+    data = value.encode("utf-8") if isinstance(value, unicode) else value
+    key = (hashlib.sha1(data).digest(), cleanup)
+    result = self.memo.Get(key)
+    if result is None:
+      result = self._Convert(value, cleanup)
+      self.memo.Put(key, result)
+    return result
+
+  def _Convert(self, value, cleanup):
+    value = self.Translate(value)
+    if cleanup:
+      value = self.Cleanup(value)
+    return value
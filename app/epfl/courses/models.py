@@ -77,7 +77,34 @@ class Section(db.Model):
     return self.key().name()
 
 
-class Course(db.Model):
+class CourseMixin(object):
+  """The key and section helpers shared by Course and CourseSummary."""
+
+  @property
+  def course_id(self):
+    return self.key().name()[3:]
+
+  @property
+  def sections(self):
+    # Imported here, as the registry is built on top of these models
+    from epfl.courses import registry
+    return registry.SectionRegistry.Get().GetSections(self.section_keys)
+
+  @property
+  def sections_unique(self):
+    return sorted({section.display_name(short=True): section
+                   for section in self.sections}.values(),
+                  key=lambda section: section.display_name(short=True))
+
+  @classmethod
+  def GetByCourseID(cls, course_id, lang="en"):
+    if isinstance(course_id, basestring):
+      return cls.get_by_key_name("%s:%s" % (lang, course_id))
+    else:
+      return cls.get_by_key_name(["%s:%s" % (lang, cid) for cid in course_id])
+
+
+class Course(CourseMixin, db.Model):
   desc_language_ = db.StringProperty(choices=set(["en", "fr"]))
   
   title = db.StringProperty()
@@ -121,37 +148,47 @@ class Course(db.Model):
   links = db.StringListProperty()
 
   needs_indexing_ = db.BooleanProperty(default=True)
+
+  # The JSON view model of the course page, see viewmodel.CourseView
+  view_model_ = db.TextProperty()
+
+  # The hash of the imported description, see admin.ImportCourseCatalog
+  content_hash_ = db.StringProperty(indexed=False)
   
   @classmethod
   def TotalCount(cls):
     stat = stats.KindStat.all().filter("kind_name =", cls.__name__).get()
     return stat.count
   
-  @property
-  def sections(self):
-    return Section.get(self.section_keys)
-
-  @property
-  def sections_unique(self):
-    return sorted({section.display_name(short=True): section
-                   for section in self.sections}.values(),
-                  key=lambda section: section.display_name(short=True))
-  
-  @property
-  def course_id(self):
-    return self.key().name()[3:]
-  
   @property
   def codes(self):
     pass
   
+
+class CourseSummary(CourseMixin, db.Model):
+  """The fields of a course shown in the search result listings.
+
+  Stored under the key name of its Course, so the listings don't load the
+  course descriptions.
+  """
+
+  title = db.StringProperty()
+  instructors = db.StringListProperty()
+  credit_count = db.IntegerProperty()
+  section_keys = db.ListProperty(db.Key)
+
+  # A copy of Course.content_hash_, read when reimporting the catalog
+  content_hash_ = db.StringProperty(indexed=False)
+
   @classmethod
-  def GetByCourseID(cls, course_id, lang="en"):
-    if isinstance(course_id, basestring):
-      return cls.get_by_key_name("%s:%s" % (lang, course_id))
-    else:
-      return cls.get_by_key_name(["%s:%s" % (lang, cid) for cid in course_id])
-  
+  def FromCourse(cls, course):
+    return cls(key_name=course.key().name(),
+               title=course.title,
+               instructors=course.instructors,
+               credit_count=course.credit_count,
+               section_keys=course.section_keys,
+               content_hash_=course.content_hash_)
+
 
 class SearchQueryRecord(db.Model):
   q = db.TextProperty()
@@ -176,3 +213,111 @@ class SearchQueryRecord(db.Model):
   
   time_stamp = db.DateTimeProperty(auto_now_add=True)
   client_address = db.StringProperty()
+
+
+class QueryRollup(db.Model):
+  """The statistics of the queries logged in an hour.
+
+  The key name is the start of the hour, e.g., "hour:2012061417".  See
+  querystats.QueryStats for the fields.
+  """
+  
+  count = db.IntegerProperty(default=0)
+  canned_count = db.IntegerProperty(default=0)
+  term_count = db.IntegerProperty(default=0)
+  no_results_count = db.IntegerProperty(default=0)
+  many_results_count = db.IntegerProperty(default=0)
+  
+  # JSON lists of the queries with no results or with many results
+  no_results = db.TextProperty()
+  many_results = db.TextProperty()
+  
+  # The JSON counters of a SpaceSavingSketch of the query terms
+  terms = db.TextProperty()
+  
+  # The IDs of the last record batches added, so a retried batch is skipped
+  batch_ids = db.StringListProperty(indexed=False)
+  
+  updated = db.DateTimeProperty(auto_now=True)
+
+
+class CatalogImport(db.Model):
+  """The course data file a language was last imported from.
+  
+  The key name is the language.  The generation is that of the course cache
+  right after the import, so later changes of the courses are detected.
+  """
+  
+  # The hex SHA-1 of the data file
+  source = db.StringProperty()
+  generation = db.IntegerProperty(default=0)
+  
+  updated = db.DateTimeProperty(auto_now=True)
+
+
+class CacheGeneration(db.Model):
+  """The current generation of a family of cache entries."""
+  
+  value = db.IntegerProperty(default=0)
+  
+  updated = db.DateTimeProperty(auto_now=True)
+
+
+class IndexSnapshotPart(db.Model):
+  """A part of a local search index snapshot built from the datastore.
+  
+  The key name is the course cache generation the snapshot is current for
+  and the part index, e.g., "1355227010123:0".  See
+  appsearch_admin.StoreLocalIndexSnapshot.
+  """
+  
+  part_count = db.IntegerProperty(default=1)
+  data = db.BlobProperty()
+
+
+class BatchJob(db.Model):
+  """A job split in shards, which run as tasks.  See jobs.ShardedJob."""
+  
+  # The import path of the ShardedJob subclass
+  job_class = db.StringProperty()
+  # The JSON parameters of the job
+  params = db.TextProperty()
+  
+  # One of "running", "paused", "finishing" and "done"
+  state = db.StringProperty(default="running")
+  
+  shard_count = db.IntegerProperty(default=0)
+  done_shards = db.ListProperty(int)
+  
+  # The JSON statistics of the finished job
+  stats = db.TextProperty()
+  
+  created = db.DateTimeProperty(auto_now_add=True)
+  updated = db.DateTimeProperty(auto_now=True)
+
+
+class BatchJobShard(db.Model):
+  """A shard of a BatchJob, with its checkpoint.
+  
+  The key name is the job ID and the shard index, e.g., "12:3".
+  """
+  
+  # The JSON parameters of the shard
+  params = db.TextProperty()
+  
+  # The units of work of the shard, and the number done at the checkpoint
+  size = db.IntegerProperty(default=0)
+  position = db.IntegerProperty(default=0)
+  
+  # One of "pending", "running", "paused" and "done"
+  state = db.StringProperty(default="pending")
+  
+  # The JSON statistics at the checkpoint
+  stats = db.TextProperty()
+  # The last error of the shard task, if any
+  error = db.TextProperty()
+  
+  # The time until which a running task holds the shard
+  lease_until = db.DateTimeProperty()
+  
+  updated = db.DateTimeProperty(auto_now=True)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Buffered logging of the search queries.
+
+The queries are logged once per request, after the search, as dictionaries
+of SearchQueryRecord properties.  They are buffered in instance memory and
+written in batches, so the requests don't wait for the datastore.  The
+buffer is only as durable as the instance, so a few records may be lost
+when an instance shuts down.
+"""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import logging
+import threading
+import time
+import uuid
+
+
+class QueryLog(object):
+  """A buffer of query records, flushed in batches to a writer.
+
+  A batch is flushed when it is full, or when the oldest record in the
+  buffer waited for more than max_delay seconds, checked as records are
+  added and at the end of each request (see FlushIfDue).
+
+  Attributes:
+    writer: A callable receiving the list of records of each batch.
+    batch_size: The number of records in a full batch.
+    max_delay: The number of seconds a record may wait in the buffer.
+  """
+
+  def __init__(self, writer, batch_size=20, max_delay=60):
+    self.writer = writer
+    self.batch_size = batch_size
+    self.max_delay = max_delay
+
+    self.records = []
+    self.oldest = None
+    self.lock = threading.Lock()
+
+  def Add(self, record):
+    now = time.time()
+    with self.lock:
+      self.records.append(record)
+      if self.oldest is None:
+        self.oldest = now
+      if len(self.records) < self.batch_size and not self._IsDue(now):
+        return
+      batch = self._TakeBatch()
+
+    self._Write(batch)
+
+  def FlushIfDue(self):
+    """Write the buffered records if the oldest one waited long enough.
+
+    Called at the end of the requests, so the records of a quiet instance
+    don't wait for the next query to be written.
+    """
+
+    with self.lock:
+      if not self._IsDue(time.time()):
+        return
+      batch = self._TakeBatch()
+    self._Write(batch)
+
+  def Flush(self):
+    """Write the buffered records right away."""
+
+    with self.lock:
+      batch = self._TakeBatch()
+    if batch:
+      self._Write(batch)
+
+  def _IsDue(self, now):
+    return self.oldest is not None and now - self.oldest >= self.max_delay
+
+  def _TakeBatch(self):
+    batch, self.records, self.oldest = self.records, [], None
+    return batch
+
+  def _Write(self, batch):
+    try:
+      self.writer(batch)
+    except Exception:
+      # The query log must never fail a search
+      logging.exception("Could not write %d query records" % len(batch))
+
+
+class MemoryWriter(object):
+  """Keeps the written batches in memory, for testing without App Engine."""
+
+  def __init__(self):
+    self.batches = []
+    self.lock = threading.Lock()
+
+  def __call__(self, batch):
+    with self.lock:
+      self.batches.append(batch)
+
+  @property
+  def records(self):
+    with self.lock:
+      return [record for batch in self.batches for record in batch]
+
+
+class DatastoreWriter(object):
+  """Writes the batches in deferred tasks, which store them as
+  SearchQueryRecord entities and add them to the query statistics.
+
+  Each batch gets an ID, so a retried task doesn't store it twice.
+  """
+
+  def __call__(self, batch):
+    # Imported here, so the log can be used without the App Engine SDK
+    from google.appengine.ext import deferred
+    from epfl.courses import querystats
+
+    deferred.defer(querystats.StoreRecords, batch, uuid.uuid4().hex)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hourly statistics of the logged search queries.
+
+The statistics are rolled up in a QueryRollup entity per hour as the query
+records are written, so the statistics of a time window are merged from a
+few entities instead of reading the entire query log.  There are no daily
+rollups, which all the batches of a day would contend for.
+"""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import datetime
+import json
+
+from google.appengine.ext import db
+
+from epfl.courses import config
+from epfl.courses import models
+from epfl.courses.search import parser
+
+
+# The example queries of the catalog page, left out of the analysis
+SAMPLE_QUERIES = frozenset(sample_query
+                           for samples in config.SAMPLE_QUERIES.itervalues()
+                           for sample_query, _ in samples)
+
+# The format of the rollup hours in their key names, and their length
+ROLLUP_FORMAT = "%Y%m%d%H"
+ROLLUP_PERIOD = datetime.timedelta(hours=1)
+
+
+class SpaceSavingSketch(object):
+  """The approximate most frequent items of a stream, in bounded memory.
+
+  Each of the at most `capacity` counters holds an overestimated count of
+  its item, along with the maximum overestimation.  Any item occurring more
+  than N / capacity times in a stream of N items has a counter.
+  """
+
+  def __init__(self, capacity=100, counters=None):
+    self.capacity = capacity
+    # Maps each item to its [count, error]
+    self.counters = counters or {}
+
+  def Add(self, item, count=1):
+    counter = self.counters.get(item)
+    if counter:
+      counter[0] += count
+      return
+
+    if len(self.counters) < self.capacity:
+      self.counters[item] = [count, 0]
+      return
+
+    # Take over the counter of the least frequent item
+    min_item = min(self.counters, key=lambda key: self.counters[key][0])
+    min_count = self.counters.pop(min_item)[0]
+    self.counters[item] = [min_count + count, min_count]
+
+  def Merge(self, other):
+    """Add the counters of another sketch, keeping the largest ones."""
+
+    for item, (count, error) in other.counters.iteritems():
+      counter = self.counters.setdefault(item, [0, 0])
+      counter[0] += count
+      counter[1] += error
+
+    if len(self.counters) > self.capacity:
+      kept = sorted(self.counters.iteritems(), key=lambda entry: entry[1][0],
+                    reverse=True)[:self.capacity]
+      self.counters = dict(kept)
+
+  def GetTop(self, n):
+    """Return the (item, count) of the n most frequent items."""
+
+    top = sorted(self.counters.iteritems(), key=lambda entry: entry[1][0],
+                 reverse=True)[:n]
+    return [(item, count) for item, (count, _) in top]
+
+  def ToJSON(self):
+    return json.dumps(self.counters, separators=(",", ":"))
+
+  @classmethod
+  def FromJSON(cls, data, capacity=100):
+    return cls(capacity, json.loads(data) if data else None)
+
+
+class QueryStats(object):
+  """The statistics of a set of query records.
+
+  Attributes:
+    count: The number of queries.
+    canned_count: The number of example queries, which are not analyzed.
+    term_count: The number of term occurrences in the queries.
+    no_results_count: The number of queries without results.
+    no_results: At most MAX_LISTED queries without results.
+    many_results_count: The number of queries with more than a page of
+      results.
+    many_results: The (query, results count) of at most MAX_LISTED of these
+      queries, with the most results.
+    terms: A SpaceSavingSketch of the query terms.
+  """
+
+  MAX_LISTED = 200
+
+  def __init__(self):
+    self.count = 0
+    self.canned_count = 0
+    self.term_count = 0
+    self.no_results_count = 0
+    self.no_results = []
+    self.many_results_count = 0
+    self.many_results = []
+    self.terms = SpaceSavingSketch()
+
+  def AddRecord(self, record):
+    """Add a query record, as a dictionary of SearchQueryRecord properties."""
+
+    self.count += 1
+    query_string = record.get("translated_query")
+    if query_string in SAMPLE_QUERIES:
+      self.canned_count += 1
+      return
+
+    for term in parser.SearchQuery.ParseFromString(query_string).ExtractTerms():
+      self.term_count += 1
+      self.terms.Add(term)
+
+    results_count = record.get("results_count")
+    if not results_count:
+      self.no_results_count += 1
+      self._AddListed(self.no_results, [query_string])
+    elif results_count > config.PAGE_SIZE:
+      self.many_results_count += 1
+      self._AddListed(self.many_results, [(query_string, results_count)])
+
+  def Merge(self, other):
+    self.count += other.count
+    self.canned_count += other.canned_count
+    self.term_count += other.term_count
+    self.no_results_count += other.no_results_count
+    self._AddListed(self.no_results, other.no_results)
+    self.many_results_count += other.many_results_count
+    self._AddListed(self.many_results, other.many_results)
+    self.terms.Merge(other.terms)
+
+  def _AddListed(self, listed, values):
+    listed.extend(values)
+    if listed is self.many_results:
+      listed.sort(key=lambda result: result[1], reverse=True)
+    del listed[self.MAX_LISTED:]
+
+  @classmethod
+  def FromRollup(cls, rollup):
+    stats = cls()
+    stats.count = rollup.count
+    stats.canned_count = rollup.canned_count
+    stats.term_count = rollup.term_count
+    stats.no_results_count = rollup.no_results_count
+    stats.no_results = json.loads(rollup.no_results or "[]")
+    stats.many_results_count = rollup.many_results_count
+    stats.many_results = [tuple(result) for result
+                          in json.loads(rollup.many_results or "[]")]
+    stats.terms = SpaceSavingSketch.FromJSON(rollup.terms)
+    return stats
+
+  def ToRollup(self, rollup):
+    rollup.count = self.count
+    rollup.canned_count = self.canned_count
+    rollup.term_count = self.term_count
+    rollup.no_results_count = self.no_results_count
+    rollup.no_results = json.dumps(self.no_results)
+    rollup.many_results_count = self.many_results_count
+    rollup.many_results = json.dumps(self.many_results)
+    rollup.terms = self.terms.ToJSON()
+
+
+def GetRollupStart(time_stamp):
+  return time_stamp.replace(minute=0, second=0, microsecond=0)
+
+
+def GetRollupKeyName(time_stamp):
+  return "hour:%s" % time_stamp.strftime(ROLLUP_FORMAT)
+
+
+# The number of batch IDs remembered by each rollup, which bounds how late a
+# retried batch is still recognized
+MAX_ROLLUP_BATCH_IDS = 200
+
+
+def UpdateRollups(records, batch_id):
+  """Add a batch of query records to the rollups of their hours.
+
+  A rollup the batch was already added to is left unchanged, so the batch
+  can be added again after a failure.
+  """
+
+  batch_stats = {}
+  for record in records:
+    key_name = GetRollupKeyName(record["time_stamp"])
+    batch_stats.setdefault(key_name, QueryStats()).AddRecord(record)
+
+  def MergeRollup(key_name, stats):
+    # The batch statistics stay unchanged if the transaction is retried
+    merged = QueryStats()
+    merged.Merge(stats)
+
+    rollup = models.QueryRollup.get_by_key_name(key_name)
+    if rollup:
+      if batch_id in rollup.batch_ids:
+        return
+      merged.Merge(QueryStats.FromRollup(rollup))
+    else:
+      rollup = models.QueryRollup(key_name=key_name)
+    merged.ToRollup(rollup)
+    rollup.batch_ids = (rollup.batch_ids + [batch_id])[-MAX_ROLLUP_BATCH_IDS:]
+    rollup.put()
+
+  for key_name, stats in batch_stats.iteritems():
+    db.run_in_transaction(MergeRollup, key_name, stats)
+
+
+def StoreRecords(records, batch_id):
+  """Write a batch of query records and add them to the rollups.
+
+  The records are keyed by the batch ID and their position in the batch, so
+  storing the same batch again overwrites them.
+  """
+
+  db.put([models.SearchQueryRecord(key_name="%s:%d" % (batch_id, index),
+                                   **record)
+          for index, record in enumerate(records)])
+  UpdateRollups(records, batch_id)
+
+
+def BackfillHour(start):
+  """Add the query records of an hour that were logged before the rollups.
+
+  Those records have numeric IDs, while the later ones are keyed by their
+  batch and were added as they were written.  The records of the hour are
+  added as a batch of their own, so a backfill can be run again.  Return
+  the number of records found.
+  """
+
+  query = (models.SearchQueryRecord.all()
+           .filter("time_stamp >=", start)
+           .filter("time_stamp <", start + ROLLUP_PERIOD))
+  records = [{"translated_query": record.translated_query,
+              "results_count": record.results_count,
+              "time_stamp": record.time_stamp}
+             for record in query.run(batch_size=1000)
+             if record.key().name() is None]
+  if records:
+    UpdateRollups(records, "backfill:%s" % GetRollupKeyName(start))
+  return len(records)
+
+
+def GetStats(start, end):
+  """Return the QueryStats of the hours starting between start and end."""
+
+  key_names = []
+  start = GetRollupStart(start)
+  while start < end:
+    key_names.append(GetRollupKeyName(start))
+    start += ROLLUP_PERIOD
+
+  stats = QueryStats()
+  for rollup in models.QueryRollup.get_by_key_name(key_names):
+    if rollup:
+      stats.Merge(QueryStats.FromRollup(rollup))
+  return stats
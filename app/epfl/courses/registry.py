@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Instance-wide registry of the schools and sections.
+
+The schools and sections only change through the admin handlers, so they
+are loaded once per instance and shared by all requests as immutable
+objects, with their display names computed up front.
+"""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import logging
+import threading
+
+from epfl.courses import cache
+from epfl.courses import models
+
+
+class SchoolInfo(object):
+  """A read-only copy of a School entity."""
+
+  OTHER = models.School.OTHER
+
+  def __init__(self, school):
+    self.code = school.code
+    self.title_en = school.title_en
+    self.title_fr = school.title_fr
+    self.titles_ = {
+      False: school.title(use_french=False),
+      True: school.title(use_french=True),
+    }
+    self.sections = []
+
+  def title(self, use_french=False):
+    return self.titles_[bool(use_french)]
+
+
+class SectionInfo(object):
+  """A read-only copy of a Section entity, linked to its SchoolInfo."""
+
+  def __init__(self, section, school):
+    self.code = section.code
+    self.school = school
+    self.title_short = section.title_short
+    self.title_en = section.title_en
+    self.title_fr = section.title_fr
+    self.minor = section.minor
+    self.master = section.master
+    self.alias = section.alias
+
+    self.titles_ = {}
+    self.display_names_ = {}
+    for use_french in [False, True]:
+      self.titles_[use_french] = section.title(use_french=use_french)
+      for short in [False, True]:
+        self.display_names_[(use_french, short)] = section.display_name(
+          use_french=use_french, short=short)
+
+  def title(self, use_french=False):
+    return self.titles_[bool(use_french)]
+
+  def display_name(self, use_french=False, short=False):
+    return self.display_names_[(bool(use_french), bool(short))]
+
+
+class SectionRegistry(object):
+  """The schools and sections known to the instance.
+
+  The registry is versioned with the GENERATION cache generation, which the
+  admin handlers bump after changing sections, and is reloaded when it
+  changes.
+  """
+
+  GENERATION = "sections"
+
+  _current = None
+  _lock = threading.Lock()
+
+  def __init__(self, version, schools, sections):
+    self.version = version
+    self.schools = schools
+    self.sections = sections
+
+  @classmethod
+  def Load(cls, version=None):
+    schools = dict((school.code, SchoolInfo(school))
+                   for school in models.School.all())
+
+    sections = {}
+    for section in models.Section.all():
+      # Don't dereference the school, which would cost a datastore call
+      school_key = models.Section.school.get_value_for_datastore(section)
+      school = schools.get(school_key.name()) if school_key else None
+      info = SectionInfo(section, school)
+      sections[info.code] = info
+      if school and not info.alias:
+        school.sections.append(info)
+
+    logging.info("Loaded %d schools and %d sections"
+                 % (len(schools), len(sections)))
+    return cls(version, schools, sections)
+
+  @classmethod
+  def Get(cls):
+    """Return the registry, loading it on first use or after a change."""
+
+    version = cache.Generation.Get(cls.GENERATION)
+    registry = cls._current
+    if registry is None or registry.version != version:
+      with cls._lock:
+        registry = cls._current
+        if registry is None or registry.version != version:
+          registry = cls.Load(version)
+          cls._current = registry
+    return registry
+
+  @classmethod
+  def Invalidate(cls):
+    """Make all the instances reload the registry."""
+
+    cache.Generation.Bump(cls.GENERATION)
+
+  def GetSchools(self):
+    return self.schools.values()
+
+  def GetSection(self, code):
+    return self.sections.get(code)
+
+  def GetSections(self, keys):
+    """Resolve a list of Section keys, in the same order."""
+
+    result = [self.sections.get(key.name()) for key in keys]
+    if None in result:
+      # A section unknown to the registry, which shouldn't happen unless the
+      # datastore was changed behind the admin handlers
+      logging.warning("Sections missing from the registry")
+      missing = models.Section.get([key for key, section in zip(keys, result)
+                                    if section is None])
+      missing.reverse()
+      result = [section or missing.pop() for section in result]
+    return result
@@ -20,11 +20,22 @@
 __author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
 
 
+import hashlib
 import logging
+import time
 
+from google.appengine.api import memcache
+
+from epfl.courses import cache
+
+import localsearch
 from parser import SearchQuery
+from cursor import PageCursor
+from pending import PendingCall
 from appsearch import AppSearchProvider
+from localsearch import LocalIndexSearchProvider
 from sitesearch import SiteSearchProvider
+from spelling import GetSharedCorrector
 
 
 class SearchResults(object):
@@ -38,47 +49,268 @@ class SearchResults(object):
     self.number_found = None
     self.offset = offset
     
+    # The {field: {value: count}} counts of all the results, when available
+    self.facets = None
+
+    # The PageCursor of the next page, if the provider supports cursors
+    self.next_cursor = None
+
     self.original_url_ = None
 
+  def Fork(self):
+    """Return empty results for the same query, to be filled separately."""
+
+    return SearchResults(self.original_query, self.offset)
+
+  def MergeFrom(self, other):
+    """Take over the latest results of a forked search."""
+
+    self.latest_results = other.latest_results
+    self.results.extend(other.latest_results)
+    self.number_found = other.number_found
+    self.offset = other.offset
+    self.facets = other.facets
+    self.next_cursor = other.next_cursor
+    if other.suggested_query:
+      self.suggested_query = other.suggested_query
+    if other.original_url_:
+      self.original_url_ = other.original_url_
+
+  def GetFacetCounts(self, field, values):
+    """Return the counts of the given field values, in the same order.
+
+    The values are matched the same way the index does, so the options of
+    the advanced search form can be passed as they are.  Returns None if
+    there are no counts for the field.
+    """
+
+    if not self.facets or field not in self.facets:
+      return None
+
+    counts = self.facets[field]
+    result = []
+    for value in values:
+      if isinstance(value, basestring):
+        value = localsearch.FoldText(value)
+      result.append(counts.get(value, 0))
+    return result
+
+
+class SuggestionCache(object):
+  """Remembers the spelling suggestions previously obtained for queries."""
+
+  MEMCACHE_TIME = 7 * 24 * 3600
+
+  @classmethod
+  def _GetKey(cls, query_string):
+    key = hashlib.sha1(query_string.encode("utf-8")).hexdigest()
+    return "suggestion:%s" % key
+
+  @classmethod
+  def Get(cls, query_string):
+    return memcache.get(cls._GetKey(query_string))
+
+  @classmethod
+  def Put(cls, query_string, suggested_query):
+    memcache.set(cls._GetKey(query_string), suggested_query,
+                 time=cls.MEMCACHE_TIME)
+
 
 class AutocorrectedSearchProvider(object):
-  def __init__(self, provider, exact_search=False):
+  """Searches again for the suggested spelling of queries without results.
+
+  In concurrent mode, the original query is issued through the SearchAsync
+  method of the provider, and if the stages it searched right away found
+  nothing, a suggestion obtained from the local speller or from the
+  suggestion cache is issued as well, so their remote calls overlap.
+  Providers without SearchAsync are searched sequentially, since request
+  threads would be joined before responding anyway.
+
+  The speller may be given as a loader, which is called the first time a
+  query needs correction.  If loading fails, the queries are searched for
+  without local corrections.
+  """
+
+  def __init__(self, provider, exact_search=False, speller=None,
+               speller_loader=None, concurrent=False, suggestion_cache=None):
     self.provider = provider
     self.original_query = None
     self.suggested_query = None
     self.exact_search = exact_search
-    
+    self.speller = speller
+    self.speller_loader = speller_loader
+    self.concurrent = concurrent
+    self.suggestion_cache = suggestion_cache
+
+  def GetSpeller(self):
+    if self.speller is None and self.speller_loader:
+      loader, self.speller_loader = self.speller_loader, None
+      try:
+        self.speller = loader()
+      except Exception:
+        logging.exception("Could not load the speller, not correcting queries")
+    return self.speller
+
+  def SuggestQuery(self, query):
+    if not query.GetString():
+      return None
+    speller = self.GetSpeller()
+    if not speller:
+      return None
+    return speller.SuggestQuery(query)
+
+  def GetEarlySuggestion(self, query):
+    """Obtain a spelling suggestion without searching."""
+
+    suggestion = self.SuggestQuery(query)
+    if not suggestion and self.suggestion_cache:
+      suggestion = self.suggestion_cache.Get(query.GetString())
+    return suggestion
+
   def Search(self, query, search_results, limit=None, offset=None,
              accuracy=None):
-    query_string = query.GetString()
-    
+    kwargs = dict(limit=limit, offset=offset, accuracy=accuracy)
+    if (self.concurrent and not self.exact_search
+        and hasattr(self.provider, "SearchAsync")):
+      self._ConcurrentSearch(query, search_results, **kwargs)
+      return
+
     logging.info("Searching for original query using '%s'" % self.provider)
-    self.provider.Search(query,
-                         search_results,
-                         limit=limit,
-                         offset=offset,
-                         accuracy=accuracy)
-    
+    self.provider.Search(query, search_results, **kwargs)
+    self._SearchSuggestion(query, search_results, **kwargs)
+
+  def _SearchSuggestion(self, query, search_results, **kwargs):
+    """Search for the suggested spelling of a query without results."""
+
+    query_string = query.GetString()
+
+    # Prefer the local spelling suggestions over the remote ones
+    if not search_results.number_found:
+      local_suggestion = self.SuggestQuery(query)
+      if local_suggestion:
+        search_results.suggested_query = local_suggestion
+
     self.suggested_query = search_results.suggested_query
-    
+
     if (not search_results.number_found and search_results.suggested_query
         and not self.exact_search):
-      logging.info("Searching for autosuggested query using '%s' % self.provider")
+      logging.info("Searching for autosuggested query using '%s'" % self.provider)
       self.original_query = query_string
+      if self.suggestion_cache:
+        self.suggestion_cache.Put(query_string, search_results.suggested_query)
       self.provider.Search(search_results.suggested_query,
                            search_results,
-                           limit=limit,
-                           offset=offset,
-                           accuracy=accuracy)
+                           **kwargs)
+
+  def _ConcurrentSearch(self, query, search_results, **kwargs):
+    original_results = search_results.Fork()
+
+    logging.info("Searching for original query using '%s'" % self.provider)
+    complete_original = self.provider.SearchAsync(query, original_results,
+                                                  **kwargs)
+
+    # A staged provider has searched its local stage by now, and only issued
+    # its remote calls if that found nothing
+    suggestion = None
+    if not original_results.number_found:
+      suggestion = self.GetEarlySuggestion(query)
+    if not suggestion or suggestion == query.GetString():
+      complete_original()
+      search_results.MergeFrom(original_results)
+      self._SearchSuggestion(query, search_results, **kwargs)
+      return
+
+    logging.info("Searching for suggestion '%s' using '%s'"
+                 % (suggestion, self.provider))
+    corrected_results = search_results.Fork()
+    complete_corrected = self.provider.SearchAsync(suggestion,
+                                                   corrected_results, **kwargs)
+    complete_original()
+
+    if original_results.number_found:
+      search_results.MergeFrom(original_results)
+      self.suggested_query = search_results.suggested_query
+      return
+
+    try:
+      complete_corrected()
+    except Exception:
+      logging.exception("Search for the suggested query failed")
+
+    # The same rules as the sequential search: keep the corrected results,
+    # unless the remote providers came up with a different suggestion that
+    # can still be tried.
+    if (not corrected_results.number_found and original_results.suggested_query
+        and original_results.suggested_query != suggestion):
+      suggestion = original_results.suggested_query
+      corrected_results = search_results.Fork()
+      self.provider.Search(suggestion, corrected_results, **kwargs)
+
+    self.original_query = query.GetString()
+    self.suggested_query = suggestion
+    search_results.MergeFrom(corrected_results)
+    search_results.suggested_query = suggestion
 
 
 class StagedSearchProvider(object):
-  def __init__(self, providers, use_all=False):
+  """Runs the providers in turn, until one of them finds results.
+
+  With a hedge delay, the stages that have a SearchAsync method are issued
+  as asynchronous RPCs, while the others, such as the in-memory local index,
+  run in the request thread.  An RPC stage is only issued once the stages
+  before it in the request thread have found nothing, and when its RPC has
+  not completed within the delay, the next RPC stage is issued alongside it
+  (a delay of 0 issues them all at once).  The results of the first stage in
+  priority order that finds anything are used, and the RPCs of the later
+  stages are dropped without being waited for.
+  """
+
+  def __init__(self, providers, use_all=False, hedge_delay=None,
+               deadline=None):
     self.providers = providers
     self.use_all = use_all
-    
+    self.hedge_delay = hedge_delay
+    self.deadline = deadline
+
+  def IsHedged(self):
+    return (self.hedge_delay is not None and not self.use_all
+            and len(self.providers) > 1)
+
+  def SearchAsync(self, query, search_results, limit=None, offset=None,
+                  accuracy=None):
+    """Search up to the first RPC stage, and return a PendingCall for the rest.
+
+    The stages running in the request thread before the first RPC stage are
+    searched right away, and their results are used if they found any.
+    Otherwise, the RPC stage is issued, and the later stages are searched
+    when the call is finished.
+    """
+
+    kwargs = dict(limit=limit, offset=offset, accuracy=accuracy)
+    if not self.IsHedged():
+      return PendingCall(lambda: self.Search(query, search_results, **kwargs))
+
+    pending = {}
+    for stage, provider in enumerate(self.providers):
+      if hasattr(provider, "SearchAsync"):
+        self._IssueStage(stage, query, search_results, pending, **kwargs)
+        break
+      results = self._SearchStage(stage, query, search_results, **kwargs)
+      if results.number_found:
+        logging.info("Using the results of stage %s" % provider)
+        search_results.MergeFrom(results)
+        return PendingCall(lambda: None)
+      pending[stage] = (results, PendingCall(lambda: None))
+    return PendingCall(lambda: self._HedgedSearch(query, search_results,
+                                                  pending=pending, **kwargs))
+
   def Search(self, query, search_results, limit=None, offset=None,
              accuracy=None):
+    if self.IsHedged():
+      self._HedgedSearch(query, search_results, limit=limit, offset=offset,
+                         accuracy=accuracy)
+      return
+
     for provider in self.providers:
       logging.info("Searching using stage %s" % provider)
       provider.Search(query,
@@ -88,3 +320,201 @@ class StagedSearchProvider(object):
                       accuracy=accuracy)
       if search_results.number_found and not self.use_all:
         break
+
+  @staticmethod
+  def _RunStage(provider, func, *args, **kwargs):
+    try:
+      return func(*args, **kwargs)
+    except Exception:
+      logging.exception("Search stage %s failed" % provider)
+
+  def _SearchStage(self, stage, query, search_results, **kwargs):
+    provider = self.providers[stage]
+    logging.info("Searching using stage %s" % provider)
+    results = search_results.Fork()
+    self._RunStage(provider, provider.Search, query, results, **kwargs)
+    return results
+
+  def _IssueStage(self, stage, query, search_results, pending, **kwargs):
+    provider = self.providers[stage]
+    logging.info("Issuing stage %s" % provider)
+    results = search_results.Fork()
+    call = self._RunStage(provider, provider.SearchAsync, query, results,
+                          **kwargs)
+    pending[stage] = (results, call or PendingCall(lambda: None))
+
+  def _Hedge(self, stage, query, search_results, pending, **kwargs):
+    """Issue the next RPC stage after the given one, if there is any.
+
+    Returns:
+      The index of the stage issued, or None if there are no more stages
+      that can be issued without running the request thread stages first.
+    """
+
+    for next_stage in xrange(stage + 1, len(self.providers)):
+      if not hasattr(self.providers[next_stage], "SearchAsync"):
+        return None
+      if next_stage not in pending:
+        logging.info("Stage %s is late, hedging"
+                     % self.providers[next_stage - 1])
+        self._IssueStage(next_stage, query, search_results, pending, **kwargs)
+        return next_stage
+    return None
+
+  def _WaitForStage(self, stage, query, search_results, pending, **kwargs):
+    """Wait for an RPC stage, issuing the next ones each time it's late.
+
+    Returns:
+      Whether the stage completed before the deadline.
+    """
+
+    call = pending[stage][1]
+    hedged = stage
+    while hedged is not None:
+      timeout = self.hedge_delay
+      if self.deadline:
+        timeout = min(timeout, self.deadline - time.time())
+      if call.Wait(max(timeout, 0)):
+        break
+      if self.deadline and time.time() >= self.deadline:
+        return False
+      hedged = self._Hedge(hedged, query, search_results, pending, **kwargs)
+
+    self._RunStage(self.providers[stage], call)
+    return True
+
+  def _HedgedSearch(self, query, search_results, pending=None, **kwargs):
+    stage_results = [None] * len(self.providers)
+    if pending is None:
+      pending = {}  # The stages already started, with the calls finishing them
+
+    for stage, provider in enumerate(self.providers):
+      if self.deadline and time.time() >= self.deadline:
+        logging.warning("Search deadline exceeded at stage %d" % stage)
+        self._MergeSuggestion(stage_results, search_results)
+        return
+
+      if stage in pending or hasattr(provider, "SearchAsync"):
+        if stage not in pending:
+          self._IssueStage(stage, query, search_results, pending, **kwargs)
+        if not self._WaitForStage(stage, query, search_results, pending,
+                                  **kwargs):
+          logging.warning("Search deadline exceeded at stage %d" % stage)
+          self._MergeSuggestion(stage_results, search_results)
+          return
+        results = pending[stage][0]
+      else:
+        results = self._SearchStage(stage, query, search_results, **kwargs)
+      stage_results[stage] = results
+
+      if results.number_found:
+        logging.info("Using the results of stage %s" % provider)
+        search_results.MergeFrom(results)
+        self._MergeSuggestion(stage_results, search_results)
+        return
+
+    search_results.MergeFrom(stage_results[-1])
+    self._MergeSuggestion(stage_results, search_results)
+
+  @staticmethod
+  def _MergeSuggestion(stage_results, search_results):
+    if search_results.suggested_query:
+      return
+    for results in stage_results:
+      if results is not None and results.suggested_query:
+        search_results.suggested_query = results.suggested_query
+        return
+
+
+class CachedSearchProvider(object):
+  """Caches the outcome of a provider chain in instance memory and memcache.
+
+  The entries are keyed on the normalized query and the paging, language and
+  exactness parameters, and are tagged with the search index generation,
+  which BuildSearchIndexHandler bumps whenever the index changes, and with
+  the catalog generation, since the local index follows the courses.
+  """
+
+  GENERATION = "search"
+
+  # The number of entries kept in instance memory
+  LOCAL_CACHE_SIZE = 500
+
+  # The memcache expiration time, in seconds
+  MEMCACHE_TIME = 24 * 3600
+
+  local_cache = cache.LRUCache(LOCAL_CACHE_SIZE)
+  stats = cache.CacheStats.Get("search")
+
+  def __init__(self, provider, language=None, exact_search=False):
+    self.provider = provider
+    self.language = language
+    self.exact_search = exact_search
+    self.original_query = None
+    self.suggested_query = None
+
+  def GetCacheKey(self, query_string, limit, offset):
+    key = repr((cache.Generation.Get(self.GENERATION),
+                cache.Generation.Get(cache.CourseCache.GENERATION),
+                query_string, offset, limit, self.language,
+                bool(self.exact_search)))
+    return "search:%s" % hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+  def _ApplyEntry(self, entry, search_results):
+    search_results.latest_results = list(entry["results"])
+    search_results.results.extend(search_results.latest_results)
+    search_results.number_found = entry["number_found"]
+    search_results.offset = entry["offset"]
+    search_results.suggested_query = entry["suggested_query"]
+    search_results.facets = entry.get("facets")
+    if entry.get("next_cursor"):
+      search_results.next_cursor = PageCursor.Parse(entry["next_cursor"])
+
+    self.original_query = entry["original_query"]
+    self.suggested_query = entry["suggested_query"]
+
+  def Search(self, query, search_results, limit=None, offset=None,
+             accuracy=None):
+    if isinstance(query, basestring):
+      query_string = query
+    else:
+      query_string = query.GetString()
+    key = self.GetCacheKey(query_string, limit, offset)
+
+    entry = self.local_cache.Get(key)
+    if entry is not None:
+      self.stats.Increment("local_hits")
+    else:
+      entry = memcache.get(key)
+      if entry is not None:
+        self.stats.Increment("memcache_hits")
+        self.local_cache.Put(key, entry)
+
+    if entry is not None:
+      logging.info("Found cached search results for '%s'" % query_string)
+      self._ApplyEntry(entry, search_results)
+      return
+
+    self.stats.Increment("misses")
+    self.provider.Search(query, search_results, limit=limit, offset=offset,
+                         accuracy=accuracy)
+    self.original_query = getattr(self.provider, "original_query", None)
+    self.suggested_query = getattr(self.provider, "suggested_query",
+                                   search_results.suggested_query)
+
+    # Failed searches (e.g., over quota) are not cached
+    if search_results.number_found is None:
+      return
+
+    entry = {
+      "results": search_results.latest_results,
+      "number_found": search_results.number_found,
+      "offset": search_results.offset,
+      "suggested_query": self.suggested_query,
+      "original_query": self.original_query,
+      "facets": search_results.facets,
+      "next_cursor": (search_results.next_cursor.Encode()
+                      if search_results.next_cursor else None),
+    }
+    self.local_cache.Put(key, entry)
+    memcache.set(key, entry, time=self.MEMCACHE_TIME)
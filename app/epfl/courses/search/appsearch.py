@@ -25,11 +25,20 @@ import unicodedata
 from google.appengine.api import search
 from google.appengine.runtime import apiproxy_errors
 
+from cursor import PageCursor
+from pending import PendingCall
+
 
 class AppSearchProvider(object):
   INDEX_NAME = 'courses-index'
   
-  MAX_SORT_LIMIT = 500
+  # The number of documents sorted by the search service.  The results past
+  # this limit are dropped, so it covers the whole catalog.
+  MAX_SORT_LIMIT = 10000
+  
+  # The largest offset accepted by the search service, beyond which pages
+  # can only be reached through cursors
+  MAX_OFFSET = 1000
   
   @classmethod
   def GetIndex(cls):
@@ -40,41 +49,90 @@ class AppSearchProvider(object):
     return unicodedata.normalize('NFKD', query.GetString(include_directives=False)).encode("ascii", "ignore")
   
   @classmethod
-  def Search(cls, query, results, limit=None, offset=None, accuracy=None):
-    if isinstance(query, basestring):
-      query_string = query
-    else:
-      query_string = cls.GetQueryString(query)
-      
-    results.latest_results = []
+  def _CallLoggingErrors(cls, func, *args):
+    """Call func, logging the errors of the search service instead."""
     
     try:
-      sort_expr = [
-        search.SortExpression("_score",
-                              direction=search.SortExpression.DESCENDING,
-                              default_value=0.0),
-        search.SortExpression("title",
-                              direction=search.SortExpression.ASCENDING,
-                              default_value="")
-      ]
-      sort_opts = search.SortOptions(sort_expr,
-                                     match_scorer=search.MatchScorer(),
-                                     limit=cls.MAX_SORT_LIMIT)
-      
-      search_query = search.Query(query_string,
-                                  search.QueryOptions(limit=limit,
-                                                      offset=offset,
-                                                      sort_options=sort_opts,
-                                                      number_found_accuracy=accuracy,
-                                                      ids_only=True))
-      search_results = cls.GetIndex().search(search_query)
-      
-      results.number_found = search_results.number_found
-      results.latest_results = [document.doc_id for document in search_results.results]
-      results.results.extend(results.latest_results)
+      return func(*args)
     except apiproxy_errors.OverQuotaError:
       logging.error("Over quota error")
     except ValueError:
       logging.error("Invalid values")
     except Exception:
       logging.exception("Unknown search error")
+  
+  @classmethod
+  def _StartSearch(cls, query_string, limit, accuracy, paging):
+    sort_expr = [
+      search.SortExpression("_score",
+                            direction=search.SortExpression.DESCENDING,
+                            default_value=0.0),
+      search.SortExpression("title",
+                            direction=search.SortExpression.ASCENDING,
+                            default_value="")
+    ]
+    sort_opts = search.SortOptions(sort_expr,
+                                   match_scorer=search.MatchScorer(),
+                                   limit=cls.MAX_SORT_LIMIT)
+    
+    search_query = search.Query(query_string,
+                                search.QueryOptions(limit=limit,
+                                                    sort_options=sort_opts,
+                                                    number_found_accuracy=accuracy,
+                                                    ids_only=True,
+                                                    **paging))
+    return cls.GetIndex().search_async(search_query)
+  
+  @classmethod
+  def _ExtractResults(cls, future, results, page_cursor):
+    search_results = future.get_result()
+    
+    results.number_found = search_results.number_found
+    results.latest_results = [document.doc_id for document in search_results.results]
+    results.results.extend(results.latest_results)
+    
+    if search_results.cursor and results.latest_results:
+      results.next_cursor = PageCursor(
+        page_cursor.offset + len(results.latest_results),
+        appsearch=search_results.cursor.web_safe_string)
+  
+  @classmethod
+  def SearchAsync(cls, query, results, limit=None, offset=None,
+                  accuracy=None):
+    """Issue the search, and return a PendingCall completing the results."""
+    
+    if isinstance(query, basestring):
+      query_string = query
+    else:
+      query_string = cls.GetQueryString(query)
+      
+    results.latest_results = []
+    
+    # Continue from the cursor of the previous page if there is one, since
+    # the cost of an offset grows with the depth of the page.
+    page_cursor = PageCursor.Parse(offset)
+    if page_cursor.appsearch:
+      paging = {"cursor": search.Cursor(web_safe_string=page_cursor.appsearch)}
+    elif page_cursor.offset:
+      if page_cursor.offset > cls.MAX_OFFSET:
+        logging.info("Offset %d too large without a cursor" % page_cursor.offset)
+        return PendingCall(lambda: None)
+      paging = {"offset": page_cursor.offset}
+    else:
+      paging = {"cursor": search.Cursor()}
+    
+    future = cls._CallLoggingErrors(cls._StartSearch, query_string, limit,
+                                    accuracy, paging)
+    
+    def Complete():
+      if future is not None:
+        cls._CallLoggingErrors(cls._ExtractResults, future, results,
+                               page_cursor)
+    
+    # The search API futures keep their RPC to themselves
+    return PendingCall(Complete, getattr(future, "_rpc", None))
+  
+  @classmethod
+  def Search(cls, query, results, limit=None, offset=None, accuracy=None):
+    cls.SearchAsync(query, results, limit=limit, offset=offset,
+                    accuracy=accuracy)()
@@ -20,18 +20,31 @@
 __author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
 
 
-import itertools
+import StringIO
 import logging
+import os
 import re
 import unicodedata
 
 from google.appengine.api import search
+from google.appengine.api import taskqueue
 from google.appengine.ext import db
+from google.appengine.ext import deferred
 from google.appengine.runtime import apiproxy_errors
 
 from epfl.courses import base_handler
+from epfl.courses import cache
 from epfl.courses import config
 from epfl.courses import models
+from epfl.courses.search import localsearch
+from epfl.courses.search import snapshot
+
+
+# The index snapshot compiled offline from the course data
+SEARCH_SNAPSHOT_FILE = "data/search_index.bin"
+
+# The snapshots stored in the datastore are split in parts of this size
+SNAPSHOT_PART_SIZE = 900 * 1024
 
 
 class AppEngineIndex(object):
@@ -71,6 +84,14 @@ class AppEngineIndex(object):
       
       return [self.search_field(name=self.field_name, value=v) for v in values]
       
+  # The local index equivalent of each search field type
+  LOCAL_FIELD_KINDS = [
+    (search.AtomField, localsearch.ATOM),
+    (search.NumberField, localsearch.NUMBER),
+    (search.HtmlField, localsearch.HTML),
+    (search.TextField, localsearch.TEXT),
+  ]
+      
   @classmethod
   def GetIndex(cls, language=None):
     """Obtain the search index where the courses are indexed."""
@@ -93,6 +114,16 @@ class AppEngineIndex(object):
         docindex.delete(document_ids)
         logging.info('Removed %d documents.' % len(document_ids))
       
+  @classmethod
+  def RemoveCourseDocuments(cls, course_ids):
+    """Remove the documents of the given courses from the search index."""
+    
+    if not course_ids:
+      return
+    for docindex in [cls.GetIndex(), cls.GetIndex("en"), cls.GetIndex("fr")]:
+      docindex.delete(course_ids)
+    logging.info('Removed %d documents.' % len(course_ids))
+      
   @classmethod
   def ClearIndexingStatus(cls, courses):
     for course in courses:
@@ -216,54 +247,225 @@ class AppEngineIndex(object):
     try:
       cls.GetIndex().put(docs_all)
       if language_index:
-        cls.GetIndex(language="en").put(docs_en)
-        cls.GetIndex(language="fr").put(docs_fr)
+        cls.GetIndex(language="en").put([doc for doc in docs_en if doc])
+        cls.GetIndex(language="fr").put([doc for doc in docs_fr if doc])
     except apiproxy_errors.OverQuotaError:
       logging.error("Over quota error.")
       return False
     else:
-      db.put(courses_en + courses_fr)
+      db.put([course for course in courses_en + courses_fr if course])
       logging.info('Added %d documents to the index.' % len(doc_bag))
       return True
 
   @classmethod
-  def UpdateCourseIndex(cls, language_index=False):
-    """Update the search index for the given courses."""
+  def GetCourseIDsToIndex(cls):
+    """Return the sorted IDs of the courses marked for indexing.
     
-    queries = {}
+    A course is marked when its description changes in either language, so
+    the descriptions of both languages are then read by key.
+    """
     
-    for language in ["en", "fr"]:
-      q = models.Course.all().filter("needs_indexing_ =", True)
-      q.filter("desc_language_ =", language)
-      q.order("__key__")
-      queries[language] = q.fetch(limit=None)
+    q = models.Course.all(keys_only=True).filter("needs_indexing_ =", True)
+    return sorted(set(key.name()[3:] for key in q.run(batch_size=1000)))
+
+  @classmethod
+  def IndexCourses(cls, course_ids, language_index=False):
+    """Index the courses with the given IDs and clear their indexing status.
     
-    BATCH_SIZE = 50
-    doc_bag = []
+    Return False if the search quota is exceeded.
+    """
+    
+    courses_en = models.Course.GetByCourseID(course_ids, "en")
+    courses_fr = models.Course.GetByCourseID(course_ids, "fr")
     
-    for course_en, course_fr in itertools.izip(queries["en"], queries["fr"]):
-      # Make sure they refer to same course
-      assert course_en.course_id == course_fr.course_id
+    doc_bag = []
+    for course_en, course_fr in zip(courses_en, courses_fr):
+      if not course_en and not course_fr:
+        # Removed since it was marked
+        continue
       
       doc_all = cls._CreateDocumentForCourse(course_en, course_fr)
-      doc_en = cls._CreateDocumentForCourse(course_en, None)
-      doc_fr = cls._CreateDocumentForCourse(None, course_fr)
+      doc_en = course_en and cls._CreateDocumentForCourse(course_en, None)
+      doc_fr = course_fr and cls._CreateDocumentForCourse(None, course_fr)
       
-      course_en.needs_indexing_ = False
-      course_fr.needs_indexing_ = False
+      for course in [course_en, course_fr]:
+        if course:
+          course.needs_indexing_ = False
       
-      doc_bag_item = ((doc_all, doc_en, doc_fr), (course_en, course_fr))
+      doc_bag.append(((doc_all, doc_en, doc_fr), (course_en, course_fr)))
       
-      if len(doc_bag) == BATCH_SIZE:
-        if not cls._IndexDocuments(doc_bag, language_index):
-          return False
-        doc_bag = [doc_bag_item]
-      else:
-        doc_bag.append(doc_bag_item)
-    if doc_bag:
-      if not cls._IndexDocuments(doc_bag, language_index):
+    if not doc_bag:
+      return True
+    return cls._IndexDocuments(doc_bag, language_index)
+
+  @classmethod
+  def UpdateCourseIndex(cls, language_index=False):
+    """Update the search index for the given courses."""
+    
+    course_ids = cls.GetCourseIDsToIndex()
+    
+    BATCH_SIZE = 50
+    
+    for start in range(0, len(course_ids), BATCH_SIZE):
+      if not cls.IndexCourses(course_ids[start:start + BATCH_SIZE],
+                              language_index):
         return False
       
     return True
 
-  
+  @classmethod
+  def _GetLocalFields(cls, document):
+    fields = []
+    for field in document.fields:
+      for field_type, kind in cls.LOCAL_FIELD_KINDS:
+        if isinstance(field, field_type):
+          fields.append((field.name, kind, field.value))
+          break
+    return fields
+
+  @classmethod
+  def BuildLocalIndex(cls):
+    """Build an in-memory index with the same documents as the search API.
+    
+    The descriptions of a course are paired by course ID, as a course may
+    be missing in one of the languages.
+    """
+    
+    courses = {}
+    
+    for language in ["en", "fr"]:
+      q = models.Course.all().filter("desc_language_ =", language)
+      for course in q.run(batch_size=1000):
+        courses.setdefault(course.course_id, {})[language] = course
+      
+    index = localsearch.LocalIndex()
+    
+    for course_id in sorted(courses):
+      course_en = courses[course_id].get("en")
+      course_fr = courses[course_id].get("fr")
+      if not course_en or not course_fr:
+        logging.warning("Course %s has a description in only one language"
+                        % course_id)
+      
+      document = cls._CreateDocumentForCourse(course_en, course_fr)
+      index.AddDocument(document.doc_id, cls._GetLocalFields(document))
+      
+    logging.info("Built a local index of %d documents" % index.DocCount())
+    return index
+
+  @classmethod
+  def GetCourseGeneration(cls):
+    generation = models.CacheGeneration.get_by_key_name(
+      cache.CourseCache.GENERATION)
+    return generation.value if generation else 0
+
+  @classmethod
+  def IsSnapshotCurrent(cls, index_snapshot):
+    """Whether the courses are those the index snapshot was built from.
+    
+    This holds when both languages were last imported from the data file of
+    the snapshot, and no course changed since.
+    """
+    
+    if not index_snapshot.source:
+      return False
+    
+    imports = models.CatalogImport.get_by_key_name(["en", "fr"])
+    if not all(imports) or any(catalog_import.source != index_snapshot.source
+                               for catalog_import in imports):
+      return False
+    
+    return (cls.GetCourseGeneration()
+            == max(catalog_import.generation for catalog_import in imports))
+
+  @classmethod
+  def StoreSnapshot(cls, generation):
+    """Build the index from the datastore, and store its snapshot for the
+    given generation of the courses."""
+
+    index = cls.BuildLocalIndex()
+    f = StringIO.StringIO()
+    snapshot.WriteSnapshot(index, f)
+    data = f.getvalue()
+
+    parts = [data[start:start + SNAPSHOT_PART_SIZE]
+             for start in xrange(0, len(data), SNAPSHOT_PART_SIZE)]
+    db.put([models.IndexSnapshotPart(key_name="%d:%d" % (generation, i),
+                                     part_count=len(parts),
+                                     data=db.Blob(part))
+            for i, part in enumerate(parts)])
+    logging.info("Stored an index snapshot of %d bytes for generation %d"
+                 % (len(data), generation))
+
+  @classmethod
+  def LoadStoredSnapshot(cls, generation):
+    """Return the stored index snapshot of a generation, or None."""
+
+    first = models.IndexSnapshotPart.get_by_key_name("%d:0" % generation)
+    if first is None:
+      return None
+    parts = [first] + models.IndexSnapshotPart.get_by_key_name(
+      ["%d:%d" % (generation, i) for i in xrange(1, first.part_count)])
+    if not all(parts):
+      return None
+    return snapshot.IndexSnapshot("".join(part.data for part in parts))
+
+  @classmethod
+  def LoadLocalIndex(cls):
+    """Open an index snapshot of the current courses.
+    
+    The snapshot is the one shipped with the application, or the one stored
+    for the courses by StoreLocalIndexSnapshot.  When neither is current,
+    the task storing it is scheduled, and IndexNotReadyError is raised with
+    the shipped snapshot as a fallback, so the instances don't build the
+    index while serving requests.  Without a shipped snapshot, as on the
+    development server, the index is built from the datastore right away.
+    """
+    
+    generation = cls.GetCourseGeneration()
+    shipped_snapshot = None
+    if os.path.exists(SEARCH_SNAPSHOT_FILE):
+      try:
+        shipped_snapshot = snapshot.IndexSnapshot.Open(SEARCH_SNAPSHOT_FILE)
+      except snapshot.SnapshotError:
+        logging.exception("Invalid index snapshot at '%s'"
+                          % SEARCH_SNAPSHOT_FILE)
+      else:
+        if cls.IsSnapshotCurrent(shipped_snapshot):
+          return shipped_snapshot
+        logging.info("The courses changed since the index snapshot was built")
+    
+    stored_snapshot = cls.LoadStoredSnapshot(generation)
+    if stored_snapshot:
+      return stored_snapshot
+    
+    if shipped_snapshot is None:
+      return cls.BuildLocalIndex()
+    ScheduleLocalIndexSnapshot(generation)
+    raise localsearch.IndexNotReadyError(
+      "No index snapshot for generation %d yet" % generation,
+      fallback=shipped_snapshot)
+
+
+def StoreLocalIndexSnapshot(generation):
+  """Store the index snapshot of a generation of the courses, unless they
+  changed again since."""
+
+  if AppEngineIndex.GetCourseGeneration() != generation:
+    logging.info("The courses changed since generation %d" % generation)
+    return
+  AppEngineIndex.StoreSnapshot(generation)
+
+
+def ScheduleLocalIndexSnapshot(generation=None):
+  """Schedule the task storing the index snapshot of a generation of the
+  courses, the current one by default.  The task runs once per generation.
+  """
+
+  if generation is None:
+    generation = AppEngineIndex.GetCourseGeneration()
+  try:
+    deferred.defer(StoreLocalIndexSnapshot, generation,
+                   _name="local-index-%d" % generation)
+  except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+    pass
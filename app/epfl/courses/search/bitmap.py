@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compressed bitmaps of document numbers.
+
+The bitmaps follow the layout of roaring bitmaps: the numbers are split by
+their high 16 bits in containers, and each container holds the low 16 bits
+either as a sorted array, while it has at most ARRAY_LIMIT values, or as a
+65536-bit set stored in a Python long.  Set operations pick the cheapest
+method for each pair of containers.
+"""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import array
+import binascii
+import bisect
+
+
+CONTAINER_BITS = 16
+LOW_MASK = (1 << CONTAINER_BITS) - 1
+
+# The largest container kept as a sorted array
+ARRAY_LIMIT = 4096
+
+
+def _IsBitset(container):
+  return not isinstance(container, array.array)
+
+
+def _ToBitset(container):
+  if _IsBitset(container):
+    return container
+
+  data = bytearray(1 << (CONTAINER_BITS - 3))
+  for low in container:
+    data[-1 - (low >> 3)] |= 1 << (low & 7)
+  return int(binascii.hexlify(data), 16)
+
+
+def _ToArray(container):
+  if not _IsBitset(container):
+    return container
+
+  digits = bin(container)[:1:-1]
+  return array.array("H", [i for i, digit in enumerate(digits)
+                           if digit == "1"])
+
+
+def _Cardinality(container):
+  if _IsBitset(container):
+    return bin(container).count("1")
+  return len(container)
+
+
+def _Normalize(container):
+  """Return the container in its preferred form, or None if empty."""
+
+  if _IsBitset(container):
+    count = _Cardinality(container)
+    if not count:
+      return None
+    if count <= ARRAY_LIMIT:
+      return _ToArray(container)
+    return container
+
+  if not container:
+    return None
+  if len(container) > ARRAY_LIMIT:
+    return _ToBitset(container)
+  return container
+
+
+def _AndContainers(a, b):
+  if _IsBitset(a) and _IsBitset(b):
+    return _Normalize(a & b)
+  if _IsBitset(a):
+    a, b = b, a
+  if _IsBitset(b):
+    return _Normalize(array.array("H", [low for low in a if b >> low & 1]))
+  return _Normalize(array.array("H", sorted(set(a).intersection(b))))
+
+
+def _OrContainers(a, b):
+  if _IsBitset(a) or _IsBitset(b):
+    return _Normalize(_ToBitset(a) | _ToBitset(b))
+  return _Normalize(array.array("H", sorted(set(a).union(b))))
+
+
+class Bitmap(object):
+  """An immutable set of non-negative integers."""
+
+  __slots__ = ["containers"]
+
+  def __init__(self, values=None):
+    self.containers = {}
+    if values is None:
+      return
+
+    lows = {}
+    for value in values:
+      lows.setdefault(value >> CONTAINER_BITS, set()).add(value & LOW_MASK)
+    for high, container in lows.iteritems():
+      self.containers[high] = _Normalize(array.array("H", sorted(container)))
+
+  @classmethod
+  def _FromContainers(cls, containers):
+    result = cls()
+    result.containers = dict((high, container)
+                             for high, container in containers.iteritems()
+                             if container is not None)
+    return result
+
+  @classmethod
+  def Union(cls, bitmaps):
+    containers = {}
+    for bitmap in bitmaps:
+      for high, container in bitmap.containers.iteritems():
+        if high in containers:
+          container = _OrContainers(containers[high], container)
+        containers[high] = container
+    return cls._FromContainers(containers)
+
+  @classmethod
+  def Intersection(cls, bitmaps):
+    bitmaps = sorted(bitmaps, key=len)
+    if not bitmaps:
+      raise ValueError("The intersection of no bitmaps is undefined")
+
+    result = bitmaps[0]
+    for bitmap in bitmaps[1:]:
+      if not result:
+        break
+      result = result & bitmap
+    return result
+
+  def __and__(self, other):
+    return self._FromContainers(dict(
+      (high, _AndContainers(container, other.containers[high]))
+      for high, container in self.containers.iteritems()
+      if high in other.containers))
+
+  def __or__(self, other):
+    return self.Union([self, other])
+
+  def __contains__(self, value):
+    container = self.containers.get(value >> CONTAINER_BITS)
+    if container is None:
+      return False
+
+    low = value & LOW_MASK
+    if _IsBitset(container):
+      return bool(container >> low & 1)
+    i = bisect.bisect_left(container, low)
+    return i < len(container) and container[i] == low
+
+  def __iter__(self):
+    for high in sorted(self.containers):
+      base = high << CONTAINER_BITS
+      for low in _ToArray(self.containers[high]):
+        yield base | low
+
+  def __len__(self):
+    return sum(_Cardinality(container)
+               for container in self.containers.itervalues())
+
+  def __nonzero__(self):
+    return bool(self.containers)
+
+  def __eq__(self, other):
+    return (isinstance(other, Bitmap)
+            and sorted(self.containers) == sorted(other.containers)
+            and all(_ToBitset(container) == _ToBitset(other.containers[high])
+                    for high, container in self.containers.iteritems()))
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __repr__(self):
+    return "Bitmap(%d values)" % len(self)
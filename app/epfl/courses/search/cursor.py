@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opaque positions in the results of a search, for paging."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import base64
+import json
+
+
+class PageCursor(object):
+  """The start of a page of search results.
+
+  Besides the absolute offset of the page, a cursor may hold the position
+  reached by each search engine, so the next page is fetched from there
+  instead of skipping over all the results before it.  Cursors are carried
+  in the offset URL parameter, where plain offsets are accepted as well.
+
+  Attributes:
+    offset: The number of results before the page.
+    local: The (score, sort key, doc_id) of the last result before the page
+      in the local index order, or None.
+    appsearch: The web-safe string of an App Engine search cursor, or None.
+  """
+
+  PREFIX = "c"
+
+  def __init__(self, offset=0, local=None, appsearch=None):
+    self.offset = offset
+    self.local = local
+    self.appsearch = appsearch
+
+  @classmethod
+  def Parse(cls, value):
+    """Return the cursor of an offset parameter, an offset or a cursor.
+
+    Invalid values start at the beginning of the results.
+    """
+
+    if isinstance(value, cls):
+      return value
+    if not value:
+      return cls()
+    if isinstance(value, (int, long)):
+      return cls(max(value, 0))
+
+    value = value.strip()
+    if not value.startswith(cls.PREFIX):
+      try:
+        return cls(max(int(value), 0))
+      except ValueError:
+        return cls()
+
+    try:
+      encoded = str(value[len(cls.PREFIX):])
+      encoded += "=" * (-len(encoded) % 4)
+      offset, local, appsearch = json.loads(base64.urlsafe_b64decode(encoded))
+      return cls(max(int(offset), 0),
+                 local=tuple(local) if local else None,
+                 appsearch=appsearch)
+    except (TypeError, ValueError, UnicodeError):
+      return cls()
+
+  @classmethod
+  def GetOffset(cls, value):
+    return cls.Parse(value).offset
+
+  def Encode(self):
+    """Return the URL-safe representation of the cursor."""
+
+    if not self.local and not self.appsearch:
+      return str(self.offset)
+
+    data = json.dumps([self.offset, self.local, self.appsearch],
+                      separators=(",", ":"))
+    return self.PREFIX + base64.urlsafe_b64encode(data).rstrip("=")
+
+  def __eq__(self, other):
+    return (isinstance(other, PageCursor)
+            and (self.offset, self.local, self.appsearch)
+            == (other.offset, other.local, other.appsearch))
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __repr__(self):
+    return "PageCursor(%r)" % self.Encode()
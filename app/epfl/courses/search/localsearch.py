@@ -0,0 +1,901 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process search over an inverted index held in instance memory.
+
+The index holds the same fields that AppEngineIndex._GetDocumentFields emits
+for the App Engine search API, and the provider understands the subset of the
+App Engine query language used by the catalog: plain and quoted terms,
+field restrictions (field:value, numeric comparisons), stemmed terms (~term),
+NOT, OR, and parenthesized groups.
+"""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+import bitmap
+from cursor import PageCursor
+
+
+TEXT = "text"
+HTML = "html"
+ATOM = "atom"
+NUMBER = "number"
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+FILTER_VALUE_RE = re.compile(r"""^(?:[\w.+-]+|"[^"()]*"|'[^'()]*')$""",
+                             re.UNICODE)
+HTML_TAG_RE = re.compile(r"<[^>]*>")
+
+
+def FoldText(value):
+  """Strip accents and lower-case a piece of text."""
+
+  if isinstance(value, str):
+    value = value.decode("utf-8", "ignore")
+  return unicodedata.normalize('NFKD', value).encode("ascii", "ignore").lower()
+
+
+def Tokenize(value, kind=TEXT):
+  """Split a field value in a list of folded words."""
+
+  value = FoldText(value)
+  if kind == HTML:
+    value = HTML_TAG_RE.sub(" ", value)
+  return WORD_RE.findall(value)
+
+
+def Stem(word):
+  """A crude suffix stripper, standing in for the search API stemming."""
+
+  for suffix, replacement in Stem.RULES:
+    if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+      return word[:-len(suffix)] + replacement
+  return word
+
+Stem.RULES = [
+  ("ational", "ate"), ("ization", "ize"), ("ically", "ic"), ("ical", "ic"),
+  ("ogies", "og"), ("ogy", "og"), ("ies", "y"), ("ing", ""), ("ers", "er"),
+  ("ed", ""), ("es", ""), ("ly", ""), ("s", ""),
+]
+
+
+class BaseIndex(object):
+  """Functionality shared by all the index representations.
+
+  Subclasses provide access to the documents, the postings of the text
+  fields, the atom and numeric values, and the field lengths.
+  """
+
+  stems_ = None
+  filters_ = None
+  facets_ = None
+
+  def GetFilterIndex(self):
+    if self.filters_ is None:
+      self.filters_ = FilterIndex(self)
+    return self.filters_
+
+  def GetFacetCounter(self):
+    if self.facets_ is None:
+      self.facets_ = FacetCounter(self)
+    return self.facets_
+
+  def GetStemmedTokens(self, word):
+    if self.stems_ is None:
+      stems = {}
+      for field in self.GetTextFields():
+        for token, _ in self.IterTerms(field):
+          stems.setdefault(Stem(token), set()).add(token)
+      self.stems_ = stems
+
+    return self.stems_.get(Stem(word), set([word]))
+
+
+class LocalIndex(BaseIndex):
+  """An inverted index of course documents, built in memory."""
+
+  def __init__(self):
+    self.doc_ids = []
+    self.sort_keys = []
+    self.kinds = {}
+
+    self.postings = {}
+    self.atoms = {}
+    self.numbers = {}
+    self.lengths = {}
+    self.total_lengths = {}
+
+  def AddDocument(self, doc_id, fields):
+    """Index a document, given as a list of (name, kind, value) fields."""
+
+    doc = len(self.doc_ids)
+    title = None
+    positions = {}
+
+    for name, kind, value in fields:
+      self.kinds.setdefault(name, kind)
+
+      if kind == NUMBER:
+        self.numbers.setdefault(name, {}).setdefault(doc, []).append(value)
+      elif kind == ATOM:
+        self.atoms.setdefault(name, {}).setdefault(FoldText(value),
+                                                   set()).add(doc)
+      else:
+        if name == "title" and title is None:
+          title = FoldText(value)
+
+        field_postings = self.postings.setdefault(name, {})
+        start = positions.get(name, 0)
+        tokens = Tokenize(value, kind)
+        for i, token in enumerate(tokens):
+          field_postings.setdefault(token, {}).setdefault(doc, []).append(start + i)
+        # Leave a gap between the values of multi-valued fields, so phrases
+        # don't match across them.
+        positions[name] = start + len(tokens) + 1
+
+        field_lengths = self.lengths.setdefault(name, {})
+        field_lengths[doc] = field_lengths.get(doc, 0) + len(tokens)
+        self.total_lengths[name] = self.total_lengths.get(name, 0) + len(tokens)
+
+    self.doc_ids.append(doc_id)
+    self.sort_keys.append(title or "")
+    self.stems_ = None
+    self.filters_ = None
+    self.facets_ = None
+
+  def DocCount(self):
+    return len(self.doc_ids)
+
+  def GetDocID(self, doc):
+    return self.doc_ids[doc]
+
+  def GetSortKey(self, doc):
+    return self.sort_keys[doc]
+
+  def GetFieldKind(self, field):
+    return self.kinds.get(field)
+
+  def GetTextFields(self):
+    return self.postings.keys()
+
+  def GetAtomFields(self):
+    return self.atoms.keys()
+
+  def GetNumberFields(self):
+    return self.numbers.keys()
+
+  def GetPostings(self, field, token):
+    """Return a dictionary mapping documents to the token positions."""
+
+    return self.postings.get(field, {}).get(token, {})
+
+  def HasTerm(self, token):
+    """Return whether a token occurs in any of the text fields."""
+
+    return any(token in field_postings
+               for field_postings in self.postings.itervalues())
+
+  def GetFieldLength(self, field, doc):
+    return self.lengths.get(field, {}).get(doc, 0)
+
+  def GetAverageFieldLength(self, field):
+    if not self.doc_ids:
+      return 0.0
+    return float(self.total_lengths.get(field, 0)) / len(self.doc_ids)
+
+  def GetAtomDocs(self, field, value):
+    return self.atoms.get(field, {}).get(FoldText(value), set())
+
+  def GetNumberDocs(self, field, predicate):
+    return set(doc for doc, values in self.numbers.get(field, {}).iteritems()
+               if any(predicate(v) for v in values))
+
+  def IterTerms(self, field):
+    """Iterate over the (token, document frequency) pairs of a text field."""
+
+    for token, docs in self.postings.get(field, {}).iteritems():
+      yield token, len(docs)
+
+  def IterAtoms(self, field):
+    """Iterate over the (folded value, documents) pairs of an atom field."""
+
+    return self.atoms.get(field, {}).iteritems()
+
+  def IterNumbers(self, field):
+    """Iterate over the (document, value) pairs of a numeric field."""
+
+    for doc, values in self.numbers.get(field, {}).iteritems():
+      for value in values:
+        yield doc, value
+
+
+class FilterIndex(object):
+  """Bitmaps of the documents holding each value of the atom and numeric
+  fields of an index, for evaluating restrictions on these fields by set
+  operations alone."""
+
+  def __init__(self, index):
+    self.atoms = {}
+    for field in index.GetAtomFields():
+      self.atoms[field] = dict((value, bitmap.Bitmap(docs))
+                               for value, docs in index.IterAtoms(field))
+
+    self.numbers = {}
+    for field in index.GetNumberFields():
+      docs_by_value = {}
+      for doc, value in index.IterNumbers(field):
+        docs_by_value.setdefault(value, []).append(doc)
+      self.numbers[field] = sorted((value, bitmap.Bitmap(docs))
+                                   for value, docs in docs_by_value.iteritems())
+
+  def GetAtomDocs(self, field, value):
+    return self.atoms.get(field, {}).get(FoldText(value), bitmap.Bitmap())
+
+  def GetNumberDocs(self, field, predicate):
+    return bitmap.Bitmap.Union([docs for value, docs
+                                in self.numbers.get(field, [])
+                                if predicate(value)])
+
+
+
+# The fields offered as dropdowns in the advanced search form
+FACET_FIELDS = ["section", "semester", "exam", "credits", "coefficient",
+                "lecthours", "recithours", "projhours"]
+
+
+class FacetCounter(object):
+  """Counts the documents of a result set per value of the facet fields.
+
+  Each field is laid out as two parallel columns, with an entry for every
+  distinct (document, value) pair: the document and the value code.  The
+  counts are obtained in one vectorized pass per field, by selecting the
+  entries of the matching documents and counting their codes.
+  """
+
+  def __init__(self, index, fields=None):
+    self.doc_count = index.DocCount()
+    self.columns = {}
+
+    for field in (fields or FACET_FIELDS):
+      kind = index.GetFieldKind(field)
+      if kind == ATOM:
+        pairs = set((doc, value) for value, docs in index.IterAtoms(field)
+                    for doc in docs)
+      elif kind == NUMBER:
+        pairs = set(index.IterNumbers(field))
+      else:
+        continue
+
+      values = sorted(set(value for _, value in pairs))
+      codes = dict((value, code) for code, value in enumerate(values))
+      pairs = sorted(pairs)
+      entry_docs = [doc for doc, _ in pairs]
+      entry_codes = [codes[value] for _, value in pairs]
+      if numpy:
+        entry_docs = numpy.array(entry_docs, dtype=numpy.int32)
+        entry_codes = numpy.array(entry_codes, dtype=numpy.int32)
+      self.columns[field] = (values, entry_docs, entry_codes)
+
+  def Count(self, docs):
+    """Return the {field: {value: count}} counts of a set of documents.
+
+    Values without matching documents are left out.
+    """
+
+    if numpy:
+      return self._CountVectorized(docs)
+
+    docs = set(docs)
+    facets = {}
+    for field, (values, entry_docs, entry_codes) in self.columns.iteritems():
+      counts = [0] * len(values)
+      for doc, code in zip(entry_docs, entry_codes):
+        if doc in docs:
+          counts[code] += 1
+      facets[field] = dict((value, count)
+                           for value, count in zip(values, counts) if count)
+    return facets
+
+  def _CountVectorized(self, docs):
+    selected = numpy.zeros(self.doc_count, dtype=bool)
+    selected[numpy.fromiter(docs, dtype=numpy.int32)] = True
+
+    facets = {}
+    for field, (values, entry_docs, entry_codes) in self.columns.iteritems():
+      codes = entry_codes[selected[entry_docs]]
+      if not len(codes):
+        facets[field] = {}
+        continue
+      counts = numpy.bincount(codes)
+      facets[field] = dict((values[code], int(counts[code]))
+                           for code in numpy.flatnonzero(counts))
+    return facets
+
+
+class QuerySyntaxError(Exception):
+  pass
+
+
+class QueryEvaluator(object):
+  """Parses and evaluates a query string against an index.
+
+  Every node evaluates to a dictionary mapping the matching documents to
+  their score.
+  """
+
+  TOKEN_RE = re.compile(r"""
+  (?P<ws>\s+)
+  |(?P<lparen>\()
+  |(?P<rparen>\))
+  |(?P<phrase>"[^"]*(?:"|$)|'[^']*(?:'|$))
+  |(?P<op><=|>=|[:=<>])
+  |(?P<stem>~)
+  |(?P<word>[^\s()"'~:=<>][^\s()"~:=<>]*)
+  """, re.VERBOSE | re.UNICODE)
+
+  # BM25 parameters
+  K1 = 1.2
+  B = 0.75
+
+  FIELD_WEIGHTS = {
+    "title": 3.0,
+    "instructor": 2.0,
+    "keywords": 2.0,
+  }
+
+  # The score of a document matched only by restrictions on atom or numeric
+  # fields.
+  FILTER_SCORE = 0.0
+
+  NUMBER_PREDICATES = {
+    ":": lambda number: lambda v: v == number,
+    "=": lambda number: lambda v: v == number,
+    "<": lambda number: lambda v: v < number,
+    "<=": lambda number: lambda v: v <= number,
+    ">": lambda number: lambda v: v > number,
+    ">=": lambda number: lambda v: v >= number,
+  }
+
+  def __init__(self, index, candidates=None):
+    """Create an evaluator.
+
+    Args:
+      index: The index to evaluate against.
+      candidates: An optional Bitmap of documents, outside which nothing is
+        matched or scored.
+    """
+
+    self.index = index
+    self.candidates = candidates
+    self.tokens = []
+    self.position = 0
+
+  @classmethod
+  def TokenizeQuery(cls, query_string):
+    tokens = []
+    position = 0
+    while position < len(query_string):
+      m = cls.TOKEN_RE.match(query_string, position)
+      if not m:
+        raise QuerySyntaxError("Invalid character at position %d" % position)
+      position = m.end()
+      if m.lastgroup != "ws":
+        tokens.append((m.lastgroup, m.group(m.lastgroup)))
+    return tokens
+
+  def Evaluate(self, query_string):
+    self.tokens = self.TokenizeQuery(query_string)
+    self.position = 0
+
+    if not self.tokens:
+      return {}
+
+    result = self._ParseAnd()
+    if self.position != len(self.tokens):
+      raise QuerySyntaxError("Unexpected token '%s'"
+                             % self.tokens[self.position][1])
+
+    if self.candidates is not None:
+      if result is None:
+        return self._AllDocs()
+      if isinstance(result, _Negation):
+        result = result.Complement(self.index.DocCount())
+      return dict((doc, score) for doc, score in result.iteritems()
+                  if doc in self.candidates)
+    return result
+
+  ##############################################################################
+  # Parsing
+
+  def _Peek(self, offset=0):
+    if self.position + offset < len(self.tokens):
+      return self.tokens[self.position + offset]
+    return (None, None)
+
+  def _Next(self):
+    token = self._Peek()
+    self.position += 1
+    return token
+
+  def _IsKeyword(self, token, keyword):
+    return token[0] == "word" and token[1] == keyword
+
+  def _AtExpressionEnd(self):
+    kind, _ = self._Peek()
+    return kind is None or kind == "rparen"
+
+  def _ParseAnd(self, field=None):
+    operands = [self._ParseOr(field)]
+    while not self._AtExpressionEnd():
+      if self._IsKeyword(self._Peek(), "AND"):
+        self._Next()
+      operands.append(self._ParseOr(field))
+
+    return self._Intersect(operands)
+
+  def _ParseOr(self, field=None):
+    operands = [self._ParseUnary(field)]
+    while self._IsKeyword(self._Peek(), "OR"):
+      self._Next()
+      operands.append(self._ParseUnary(field))
+
+    return self._Union(operands)
+
+  def _ParseUnary(self, field=None):
+    token = self._Peek()
+    if self._IsKeyword(token, "NOT"):
+      self._Next()
+      return self._Negate(self._ParseUnary(field))
+    if token[0] == "word" and token[1].startswith("-") and len(token[1]) > 1:
+      self.tokens[self.position] = ("word", token[1][1:])
+      return self._Negate(self._ParseUnary(field))
+
+    return self._ParsePrimary(field)
+
+  def _ParsePrimary(self, field=None):
+    kind, value = self._Next()
+
+    if kind == "lparen":
+      result = self._ParseAnd(field)
+      if self._Next()[0] != "rparen":
+        raise QuerySyntaxError("Unbalanced parentheses")
+      return result
+
+    if kind == "word" and field is None and self._Peek()[0] == "op":
+      _, op = self._Next()
+      if self._Peek()[0] == "lparen":
+        return self._ParsePrimary(field=(value, op))
+      kind, operand = self._Next()
+      if kind not in ["word", "phrase"]:
+        raise QuerySyntaxError("Missing value for field '%s'" % value)
+      return self._MatchRestriction(value, op, operand)
+
+    if kind == "stem":
+      kind, value = self._Next()
+      if kind != "word":
+        raise QuerySyntaxError("Invalid stemmed term")
+      if field:
+        return self._MatchRestriction(field[0], field[1], value, stemmed=True)
+      return self._MatchTerm(value, stemmed=True)
+
+    if kind in ["word", "phrase"]:
+      if field:
+        return self._MatchRestriction(field[0], field[1], value)
+      return self._MatchTerm(value)
+
+    # Stray operators are ignored, like the search API does.
+    if kind == "op":
+      return None
+
+    raise QuerySyntaxError("Unexpected token '%s'" % value)
+
+  ##############################################################################
+  # Evaluation
+
+  def _AllDocs(self):
+    if self.candidates is not None:
+      return dict.fromkeys(self.candidates, self.FILTER_SCORE)
+    return dict((doc, self.FILTER_SCORE)
+                for doc in xrange(self.index.DocCount()))
+
+  def _Intersect(self, operands):
+    # A None operand matches everything (e.g., a stray operator).
+    operands = [op for op in operands if op is not None]
+    if not operands:
+      return None
+
+    positive = [op for op in operands if not isinstance(op, _Negation)]
+    negative = [op for op in operands if isinstance(op, _Negation)]
+
+    if positive:
+      positive.sort(key=len)
+      result = dict(positive[0])
+      for operand in positive[1:]:
+        result = dict((doc, score + operand[doc])
+                      for doc, score in result.iteritems() if doc in operand)
+    else:
+      result = self._AllDocs()
+
+    for operand in negative:
+      for doc in operand.docs:
+        result.pop(doc, None)
+
+    return result
+
+  def _Union(self, operands):
+    if len(operands) == 1:
+      return operands[0]
+
+    result = {}
+    for operand in operands:
+      if operand is None:
+        return None
+      if isinstance(operand, _Negation):
+        operand = operand.Complement(self.index.DocCount())
+      for doc, score in operand.iteritems():
+        result[doc] = result.get(doc, 0.0) + score
+    return result
+
+  def _Negate(self, operand):
+    if operand is None:
+      return None
+    if isinstance(operand, _Negation):
+      return operand.docs
+    return _Negation(operand)
+
+  def _ScoreTokenMatch(self, field, doc_freqs, doc_count):
+    """Score the documents matching a token or phrase in a given field.
+
+    doc_freqs maps documents to the number of occurrences in the field.
+    """
+
+    n = self.index.DocCount()
+    idf = math.log(1.0 + (n - doc_count + 0.5) / (doc_count + 0.5))
+    avg_length = self.index.GetAverageFieldLength(field) or 1.0
+    weight = self.FIELD_WEIGHTS.get(field, 1.0)
+
+    scores = {}
+    for doc, tf in doc_freqs.iteritems():
+      if self.candidates is not None and doc not in self.candidates:
+        continue
+      norm = 1.0 - self.B + self.B * self.index.GetFieldLength(field, doc) / avg_length
+      scores[doc] = weight * idf * tf * (self.K1 + 1) / (tf + self.K1 * norm)
+    return scores
+
+  def _MatchWordsInField(self, field, words, stemmed=False):
+    if len(words) == 1:
+      if stemmed:
+        tokens = self.index.GetStemmedTokens(words[0])
+      else:
+        tokens = [words[0]]
+
+      doc_freqs = {}
+      for token in tokens:
+        for doc, positions in self.index.GetPostings(field, token).iteritems():
+          doc_freqs[doc] = doc_freqs.get(doc, 0) + len(positions)
+      return self._ScoreTokenMatch(field, doc_freqs, len(doc_freqs))
+
+    # Phrase match: the words must occur at consecutive positions.
+    postings = [self.index.GetPostings(field, word) for word in words]
+    candidates = set(postings[0])
+    for posting in postings[1:]:
+      candidates.intersection_update(posting)
+
+    doc_freqs = {}
+    for doc in candidates:
+      starts = set(postings[0][doc])
+      for i, posting in enumerate(postings[1:]):
+        starts.intersection_update(p - i - 1 for p in posting[doc])
+        if not starts:
+          break
+      if starts:
+        doc_freqs[doc] = len(starts)
+
+    return self._ScoreTokenMatch(field, doc_freqs, len(doc_freqs))
+
+  def _MatchTerm(self, value, stemmed=False):
+    """Match a free term or phrase against all fields."""
+
+    if value.startswith(('"', "'")):
+      value = value.strip("\"'")
+    words = Tokenize(value)
+    if not words:
+      return None
+
+    result = {}
+    for field in self.index.GetTextFields():
+      for doc, score in self._MatchWordsInField(field, words, stemmed).iteritems():
+        result[doc] = result.get(doc, 0.0) + score
+
+    for field in self.index.GetAtomFields():
+      for doc in self.index.GetAtomDocs(field, value):
+        result.setdefault(doc, self.FILTER_SCORE)
+
+    return result
+
+  def _MatchRestriction(self, field, op, value, stemmed=False):
+    kind = self.index.GetFieldKind(field)
+    if value.startswith(('"', "'")):
+      value = value.strip("\"'")
+
+    if kind is None:
+      # Unknown fields don't match anything
+      return {}
+
+    if kind == NUMBER:
+      try:
+        number = float(value)
+      except ValueError:
+        return {}
+      predicate = self.NUMBER_PREDICATES[op](number)
+      return dict((doc, self.FILTER_SCORE)
+                  for doc in self.index.GetNumberDocs(field, predicate))
+
+    if kind == ATOM:
+      return dict((doc, self.FILTER_SCORE)
+                  for doc in self.index.GetAtomDocs(field, value))
+
+    words = Tokenize(value)
+    if not words:
+      return None
+    return self._MatchWordsInField(field, words, stemmed)
+
+
+class _Negation(object):
+  """The complement of a set of documents, kept lazy until intersection."""
+
+  def __init__(self, docs):
+    self.docs = docs
+
+  def Complement(self, doc_count):
+    return dict((doc, QueryEvaluator.FILTER_SCORE)
+                for doc in xrange(doc_count) if doc not in self.docs)
+
+
+class IndexNotReadyError(Exception):
+  """Raised by an index loader when the index of the version isn't ready.
+
+  Attributes:
+    fallback: An older index to use until then, or None.
+  """
+
+  def __init__(self, message, fallback=None):
+    super(IndexNotReadyError, self).__init__(message)
+    self.fallback = fallback
+
+
+# The (version, index) of this instance
+_shared_index = None
+_shared_index_lock = threading.Lock()
+# The time after which a version that wasn't ready is tried again
+_shared_index_retry = 0
+
+# Seconds between the attempts at loading a version that wasn't ready
+SHARED_INDEX_RETRY_INTERVAL = 30
+
+
+def GetSharedIndex(loader, version=None):
+  """Return the index of this instance, loading it on first use and again
+  whenever the version changes.
+
+  Only the first load makes the requests wait.  Afterwards, a single request
+  loads the new version while the others keep using the previous index.  If
+  the loader raises IndexNotReadyError, the previous index, or else the
+  fallback, is kept until the next attempt.
+  """
+
+  global _shared_index, _shared_index_retry
+
+  shared = _shared_index
+  if shared is not None and (shared[0] == version
+                             or time.time() < _shared_index_retry):
+    return shared[1]
+  if not _shared_index_lock.acquire(shared is None):
+    return shared[1]
+
+  try:
+    shared = _shared_index
+    if shared is None or shared[0] != version:
+      logging.info("Loading the local search index (version %s)" % version)
+      try:
+        shared = (version, loader())
+      except IndexNotReadyError, e:
+        if shared is None and e.fallback is None:
+          raise
+        logging.info("The local search index is not ready: %s" % e)
+        _shared_index_retry = time.time() + SHARED_INDEX_RETRY_INTERVAL
+        if shared is None:
+          shared = (None, e.fallback)
+      _shared_index = shared
+  finally:
+    _shared_index_lock.release()
+
+  return shared[1]
+
+
+def ResetSharedIndex():
+  global _shared_index, _shared_index_retry
+
+  with _shared_index_lock:
+    _shared_index = None
+    _shared_index_retry = 0
+
+
+class LocalIndexSearchProvider(object):
+  """Search provider answering queries from an in-process index."""
+
+  def __init__(self, index=None, loader=None, version=None):
+    self.index = index
+    self.loader = loader
+    self.version = version
+
+  def GetIndex(self):
+    if self.index is None and self.loader:
+      self.index = GetSharedIndex(self.loader, self.version)
+    return self.index
+
+  @classmethod
+  def GetQueryString(cls, query):
+    if isinstance(query, basestring):
+      return query
+    return query.GetString(include_directives=False)
+
+  @classmethod
+  def SplitFilters(cls, query, index):
+    """Separate the restrictions on atom and numeric fields that hold for
+    the whole query from the rest of the query.
+
+    Only the filters of queries without groups qualify, and only those
+    neither negated nor taking part in an OR, so the query is equivalent to
+    the conjunction of the filters and the rest.
+
+    Returns:
+      A (filters, rest) pair, with the list of (field, value) filters and the
+      string of the remaining query.
+    """
+
+    if isinstance(query, basestring):
+      return [], query
+
+    components = [(t, value) for t, value in query.components
+                  if t != query.DIRECTIVE]
+    if any("(" in text or ")" in text
+           for t, value in components
+           for text in (value if t == query.FILTER else [value])):
+      return [], cls.GetQueryString(query)
+
+    def IsOperator(i, operators):
+      return (0 <= i < len(components) and components[i][0] == query.TERM
+              and components[i][1] in operators)
+
+    filters = []
+    rest = []
+    for i, (t, value) in enumerate(components):
+      if (t == query.FILTER
+          and index.GetFieldKind(value[0]) in [ATOM, NUMBER]
+          and FILTER_VALUE_RE.match(value[1])
+          and not IsOperator(i - 1, ["OR", "NOT"])
+          and not IsOperator(i + 1, ["OR"])):
+        filters.append((value[0], value[1].strip("\"'")))
+      else:
+        rest.append((t, value))
+
+    remaining = type(query)()
+    remaining.components = rest
+    return filters, remaining.GetString(include_directives=False)
+
+  @classmethod
+  def EvaluateFilters(cls, filters, index):
+    """Return the Bitmap of the documents satisfying all the filters."""
+
+    filter_index = index.GetFilterIndex()
+    matches = []
+    for field, value in filters:
+      if index.GetFieldKind(field) == NUMBER:
+        try:
+          predicate = QueryEvaluator.NUMBER_PREDICATES[":"](float(value))
+        except ValueError:
+          return bitmap.Bitmap()
+        matches.append(filter_index.GetNumberDocs(field, predicate))
+      else:
+        matches.append(filter_index.GetAtomDocs(field, value))
+
+    return bitmap.Bitmap.Intersection(matches)
+
+  def Match(self, query):
+    """Return the entries of the documents matching a query, unordered.
+
+    The entries are (negated score, sort key, doc_id, document) tuples, so
+    their natural order is the result order, and their first three elements
+    identify a stable position in it.
+    """
+
+    index = self.GetIndex()
+    if not index or not index.DocCount():
+      return None
+
+    filters, query_string = self.SplitFilters(query, index)
+    candidates = None
+    if filters:
+      candidates = self.EvaluateFilters(filters, index)
+
+    if not query_string.strip() and candidates is not None:
+      # Filter-only queries skip the scoring altogether
+      matches = dict.fromkeys(candidates, QueryEvaluator.FILTER_SCORE)
+    else:
+      matches = QueryEvaluator(index, candidates).Evaluate(query_string)
+    if matches is None:
+      return []
+
+    return [(-score, index.GetSortKey(doc), index.GetDocID(doc), doc)
+            for doc, score in matches.iteritems()]
+
+  def Search(self, query, results, limit=None, offset=None, accuracy=None):
+    results.latest_results = []
+
+    try:
+      entries = self.Match(query)
+    except QuerySyntaxError as e:
+      logging.info("Cannot evaluate query locally: %s" % e)
+      return
+
+    if entries is None:
+      logging.info("Local search index not available")
+      return
+
+    # Resuming from a cursor position selects the page the same way at any
+    # depth, without ordering the results before it.
+    cursor = PageCursor.Parse(offset)
+    skip = cursor.offset
+    remaining = entries
+    if cursor.local:
+      remaining = [entry for entry in entries if entry[:3] > cursor.local]
+      skip = 0
+
+    if limit:
+      page = heapq.nsmallest(skip + limit, remaining)[skip:]
+    else:
+      page = sorted(remaining)[skip:]
+
+    results.number_found = len(entries)
+    results.latest_results = [doc_id for _, _, doc_id, _ in page]
+    results.results.extend(results.latest_results)
+
+    if page and cursor.offset + len(page) < len(entries):
+      results.next_cursor = PageCursor(cursor.offset + len(page),
+                                       local=page[-1][:3])
+
+    if entries:
+      results.facets = self.GetIndex().GetFacetCounter().Count(
+        [doc for _, _, _, doc in entries])
+
+  def __str__(self):
+    return "LocalIndexSearchProvider"
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Calls that complete after an asynchronous RPC."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import time
+
+from google.appengine.api import apiproxy_rpc
+
+
+class PendingCall(object):
+  """A call issued as an RPC, finished by calling the object.
+
+  The App Engine RPCs can only be waited for without a timeout, so Wait
+  polls the state of the RPC instead.  A call without an RPC has nothing to
+  wait for, and is finished in the request thread.
+  """
+
+  POLL_INTERVAL = 0.01
+
+  def __init__(self, complete, rpc=None):
+    self.complete = complete
+    self.rpc = rpc
+
+  def IsDone(self):
+    """Return whether calling the object would not wait for the RPC."""
+
+    return (self.rpc is None
+            or self.rpc.state == apiproxy_rpc.RPC.FINISHING)
+
+  def Wait(self, timeout):
+    """Wait up to timeout seconds for the RPC, and return whether it's done."""
+
+    end = time.time() + timeout
+    while not self.IsDone():
+      remaining = end - time.time()
+      if remaining <= 0:
+        return False
+      time.sleep(min(self.POLL_INTERVAL, remaining))
+    return True
+
+  def __call__(self):
+    return self.complete()
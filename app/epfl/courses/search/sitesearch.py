@@ -19,15 +19,17 @@
 
 __author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
 
-import contextlib
 import logging
 import unittest
 import urllib
-import urllib2
 from xml.etree import ElementTree
 
 from epfl.courses import config
 
+import transport
+from cursor import PageCursor
+from pending import PendingCall
+
 
 class SiteSearchProvider(object):
   SEARCH_URL = "http://www.google.com/search?hl=en&q=%s&ie=utf8&oe=utf8&client=google-csbe&output=xml_no_dtd&cx=%s"
@@ -59,7 +61,16 @@ class SiteSearchProvider(object):
     'links': "links",
   }
   
-  def __init__(self, avoid_fields=None):
+  # Shared by all the providers of the instance, along with its response
+  # cache and circuit breaker
+  shared_transport = transport.HTTPTransport(
+    timeout=5.0, breaker=transport.CircuitBreaker(failure_threshold=3,
+                                                  slow_threshold=3.0,
+                                                  reset_timeout=30.0))
+  
+  def __init__(self, avoid_fields=None, http_transport=None, deadline=None):
+    self.transport = http_transport or self.shared_transport
+    self.deadline = deadline
     self.avoid_fields = avoid_fields or ["language", "section", "plan",
                                          "credits", "coefficient", "semester",
                                          "exam", "lecthours", "recithours",
@@ -89,6 +100,7 @@ class SiteSearchProvider(object):
       query_string = cls.GetQueryStringFuzzy(query)
 
     escaped_query = cls.EscapeQueryString(query_string)
+    offset = PageCursor.GetOffset(offset)
     
     url = cls.SEARCH_URL % (escaped_query, config.SEARCH_ENGINE_ID)
     if limit:
@@ -131,12 +143,15 @@ class SiteSearchProvider(object):
     if suggestion_node is not None:
       results.suggested_query = suggestion_node.get("q")
 
-  def Search(self, query, results, limit=None, offset=None, accuracy=None):
+  def SearchAsync(self, query, results, limit=None, offset=None,
+                  accuracy=None):
+    """Issue the search, and return a PendingCall completing the results."""
+
     if not isinstance(query, basestring) and query.filters:
       for key, _ in query.filters:
         if key in self.avoid_fields:
           logging.info("Rejecting query as containing avoided fields")
-          return
+          return PendingCall(lambda: None)
 
     # Compose the search URL    
     url = self.GetSearchURL(query, limit, offset)
@@ -144,19 +159,30 @@ class SiteSearchProvider(object):
     results.original_url_ = url
     
     # Perform the query
-    with contextlib.closing(urllib2.urlopen(url)) as f:
-      data = f.read()
-      
-      if f.getcode() != 200:
-        logging.warning("Could not obtain search results from GSS")
+    try:
+      get_data = self.transport.FetchAsync(url, deadline=self.deadline)
+    except transport.TransportError, e:
+      logging.warning("Could not obtain search results from GSS: %s" % e)
+      return PendingCall(lambda: None)
+
+    def Complete():
+      try:
+        data = get_data()
+      except transport.TransportError, e:
+        logging.warning("Could not obtain search results from GSS: %s" % e)
         return
 
       xml_data = ElementTree.fromstring(data)
       logging.debug("XML data: %s" % ElementTree.tostring(xml_data))
       
-    self._ExtractCourseList(xml_data, results)
-    self._ExtractSuggestion(xml_data, results)
+      self._ExtractCourseList(xml_data, results)
+      self._ExtractSuggestion(xml_data, results)
 
+    return PendingCall(Complete, get_data.rpc)
+
+  def Search(self, query, results, limit=None, offset=None, accuracy=None):
+    self.SearchAsync(query, results, limit=limit, offset=offset,
+                     accuracy=accuracy)()
 
 if __name__ == "__main__":
   unittest.main()
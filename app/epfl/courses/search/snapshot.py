@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact binary snapshots of the local search index.
+
+A snapshot is compiled offline and shipped with the application.  At run time
+it is memory-mapped and read in place, so opening it costs no parsing.  All
+integers are little-endian.  The file starts with a header:
+
+  magic     8s    "MYEDUIX3"
+  sections  I     the number of entries in the section table
+  table           (tag 4s, offset I, length I) for each section
+
+and contains the following sections:
+
+  DOCS  I doc count, then doc count + 1 offsets (I) into a blob of
+        "doc_id\\0sort_key" strings.
+  FLDS  I field count, then for each field: kind (B), flags (B), name length
+        (H), name, average length (d), and the offsets (I) of its norms and
+        numeric values, or NONE.  The kind is the first one the field was
+        indexed with, and the flags tell whether the field has atom values,
+        as a field may have both text and atom values.  The text fields are
+        those with norms.
+  TERM  I term count, then term count + 1 key offsets (I) and term count
+        postings offsets (I).  Keys are sorted, made of the field number (>H),
+        with the ATOM_KEY_FLAG bit set for the values of atom fields,
+        followed by the folded token or value.
+  KEYS  The key blob.
+  POST  For each term: doc count n (I), n docs (I), n term frequencies (H),
+        then the positions (H) of each doc in order.
+  NORM  For each text field, doc count field lengths (H).
+  NUMS  For each numeric field, doc count values (d), NaN when missing.
+  SRCE  Optional, the hex SHA-1 of the course data file the snapshot was
+        built from.
+"""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import logging
+import struct
+
+try:
+  import mmap
+except ImportError:
+  mmap = None
+
+import localsearch
+
+
+MAGIC = "MYEDUIX3"
+
+NONE = 0xffffffff
+
+# Keeps apart the atom values and the tokens of fields having both kinds
+ATOM_KEY_FLAG = 0x8000
+
+# The flag of the fields having atom values
+HAS_ATOMS_FLAG = 0x01
+
+KIND_CODES = {
+  localsearch.TEXT: 0,
+  localsearch.HTML: 1,
+  localsearch.ATOM: 2,
+  localsearch.NUMBER: 3,
+}
+
+KIND_NAMES = dict((code, kind) for kind, code in KIND_CODES.iteritems())
+
+
+class SnapshotError(Exception):
+  pass
+
+
+def _PackArray(fmt, values):
+  return struct.pack("<%d%s" % (len(values), fmt), *values)
+
+
+def WriteSnapshot(index, f, source=None):
+  """Serialize a LocalIndex in a file object.
+
+  The source is the hash of the course data the index was built from.
+  """
+
+  doc_count = index.DocCount()
+  fields = sorted(index.kinds.keys())
+  field_numbers = dict((name, i) for i, name in enumerate(fields))
+
+  # The document table
+  blob = []
+  offsets = [0]
+  for doc in xrange(doc_count):
+    entry = "%s\0%s" % (index.GetDocID(doc).encode("utf-8"),
+                        index.GetSortKey(doc))
+    blob.append(entry)
+    offsets.append(offsets[-1] + len(entry))
+  docs_section = (struct.pack("<I", doc_count) + _PackArray("I", offsets)
+                  + "".join(blob))
+
+  # The norms and numeric values
+  norms_section = []
+  norms_offset = 0
+  nums_section = []
+  nums_offset = 0
+  fields_section = [struct.pack("<I", len(fields))]
+
+  for name in fields:
+    kind = index.GetFieldKind(name)
+    field_norms = NONE
+    field_nums = NONE
+
+    if name in index.postings:
+      lengths = [min(index.GetFieldLength(name, doc), 0xffff)
+                 for doc in xrange(doc_count)]
+      norms_section.append(_PackArray("H", lengths))
+      field_norms = norms_offset
+      norms_offset += 2 * doc_count
+    if name in index.numbers:
+      numbers = index.numbers[name]
+      values = [float(numbers[doc][0]) if doc in numbers else float("nan")
+                for doc in xrange(doc_count)]
+      nums_section.append(_PackArray("d", values))
+      field_nums = nums_offset
+      nums_offset += 8 * doc_count
+
+    encoded_name = name.encode("utf-8")
+    flags = HAS_ATOMS_FLAG if name in index.atoms else 0
+    fields_section.append(struct.pack("<BBH", KIND_CODES[kind], flags,
+                                      len(encoded_name)))
+    fields_section.append(encoded_name)
+    fields_section.append(struct.pack("<dII",
+                                      index.GetAverageFieldLength(name),
+                                      field_norms, field_nums))
+
+  # The term dictionary and the postings
+  terms = []
+  for name, field_postings in index.postings.iteritems():
+    for token, postings in field_postings.iteritems():
+      terms.append((struct.pack(">H", field_numbers[name]) + token,
+                    sorted(postings.iteritems())))
+  for name, field_atoms in index.atoms.iteritems():
+    for value, docs in field_atoms.iteritems():
+      terms.append((struct.pack(">H", field_numbers[name] | ATOM_KEY_FLAG)
+                    + value,
+                    [(doc, []) for doc in sorted(docs)]))
+  terms.sort()
+
+  keys = []
+  key_offsets = [0]
+  postings_section = []
+  postings_offsets = []
+  postings_offset = 0
+  for key, postings in terms:
+    keys.append(key)
+    key_offsets.append(key_offsets[-1] + len(key))
+
+    docs = [doc for doc, _ in postings]
+    freqs = [len(positions) for _, positions in postings]
+    positions = [min(p, 0xffff) for _, doc_positions in postings
+                 for p in doc_positions]
+    data = (struct.pack("<I", len(docs)) + _PackArray("I", docs)
+            + _PackArray("H", freqs) + _PackArray("H", positions))
+    postings_section.append(data)
+    postings_offsets.append(postings_offset)
+    postings_offset += len(data)
+
+  term_section = (struct.pack("<I", len(terms)) + _PackArray("I", key_offsets)
+                  + _PackArray("I", postings_offsets))
+
+  sections = [
+    ("DOCS", docs_section),
+    ("FLDS", "".join(fields_section)),
+    ("TERM", term_section),
+    ("KEYS", "".join(keys)),
+    ("POST", "".join(postings_section)),
+    ("NORM", "".join(norms_section)),
+    ("NUMS", "".join(nums_section)),
+  ]
+  if source:
+    sections.append(("SRCE", source))
+
+  offset = len(MAGIC) + 4 + 12 * len(sections)
+  header = [MAGIC, struct.pack("<I", len(sections))]
+  for tag, data in sections:
+    header.append(struct.pack("<4sII", tag, offset, len(data)))
+    offset += len(data)
+
+  f.write("".join(header))
+  for _, data in sections:
+    f.write(data)
+
+
+class IndexSnapshot(localsearch.BaseIndex):
+  """A read-only index backed by the memory image of a snapshot file."""
+
+  def __init__(self, data):
+    # A zero-copy view, so slices and unpacking read the mapped pages directly
+    self.data = buffer(data)
+
+    magic, section_count = struct.unpack_from("<8sI", self.data, 0)
+    if magic != MAGIC:
+      raise SnapshotError("Not an index snapshot")
+
+    self.sections = {}
+    self.source = None
+    for i in xrange(section_count):
+      tag, offset, length = struct.unpack_from("<4sII", self.data,
+                                               len(MAGIC) + 4 + 12 * i)
+      self.sections[tag] = offset
+      if tag == "SRCE":
+        self.source = str(self.data[offset:offset + length])
+
+    self._ReadDocTable()
+    self._ReadFieldTable()
+    self._ReadTermTable()
+
+    self.numbers_ = {}
+
+  @classmethod
+  def Open(cls, file_name):
+    """Map a snapshot file in memory.
+
+    Falls back to reading the file in a string where mmap is not available
+    (e.g., in the App Engine sandbox).
+    """
+
+    with open(file_name, "rb") as f:
+      data = None
+      if mmap:
+        try:
+          data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except EnvironmentError:
+          pass
+      if data is None:
+        data = f.read()
+
+    snapshot = cls(data)
+    logging.info("Opened index snapshot '%s' with %d documents"
+                 % (file_name, snapshot.DocCount()))
+    return snapshot
+
+  def _ReadDocTable(self):
+    base = self.sections["DOCS"]
+    self.doc_count, = struct.unpack_from("<I", self.data, base)
+    self.doc_offsets = base + 4
+    self.doc_blob = self.doc_offsets + 4 * (self.doc_count + 1)
+
+  def _ReadFieldTable(self):
+    base = self.sections["FLDS"]
+    field_count, = struct.unpack_from("<I", self.data, base)
+    position = base + 4
+
+    self.fields = []
+    self.field_info = {}
+    for number in xrange(field_count):
+      kind, flags, name_length = struct.unpack_from("<BBH", self.data,
+                                                    position)
+      position += 4
+      name = self.data[position:position + name_length].decode("utf-8")
+      position += name_length
+      avg_length, norms, nums = struct.unpack_from("<dII", self.data, position)
+      position += 16
+
+      self.fields.append(name)
+      self.field_info[name] = (number, KIND_NAMES[kind], avg_length, norms,
+                               nums, flags)
+
+  def _ReadTermTable(self):
+    base = self.sections["TERM"]
+    self.term_count, = struct.unpack_from("<I", self.data, base)
+    self.key_offsets = base + 4
+    self.postings_offsets = self.key_offsets + 4 * (self.term_count + 1)
+
+  def _GetKey(self, term):
+    start, end = struct.unpack_from("<II", self.data,
+                                    self.key_offsets + 4 * term)
+    base = self.sections["KEYS"]
+    return self.data[base + start:base + end]
+
+  def _FindTerm(self, key):
+    """Binary search for a key in the term dictionary."""
+
+    lo, hi = 0, self.term_count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self._GetKey(mid) < key:
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo
+
+  def _ReadPostings(self, term):
+    offset, = struct.unpack_from("<I", self.data,
+                                 self.postings_offsets + 4 * term)
+    position = self.sections["POST"] + offset
+    count, = struct.unpack_from("<I", self.data, position)
+    position += 4
+    docs = struct.unpack_from("<%dI" % count, self.data, position)
+    position += 4 * count
+    freqs = struct.unpack_from("<%dH" % count, self.data, position)
+    position += 2 * count
+    positions = struct.unpack_from("<%dH" % sum(freqs), self.data, position)
+
+    result = {}
+    start = 0
+    for doc, freq in zip(docs, freqs):
+      result[doc] = positions[start:start + freq]
+      start += freq
+    return result
+
+  def _GetKeyPrefix(self, field, atom=False):
+    info = self.field_info.get(field)
+    if info is None:
+      return None
+    return struct.pack(">H", info[0] | (ATOM_KEY_FLAG if atom else 0))
+
+  def _LookupTerm(self, field, value, atom=False):
+    """Return the number of a term, or None if the index doesn't have it."""
+
+    prefix = self._GetKeyPrefix(field, atom)
+    if prefix is None:
+      return None
+
+    key = prefix + value
+    term = self._FindTerm(key)
+    if term < self.term_count and self._GetKey(term) == key:
+      return term
+    return None
+
+  def _GetTermPostings(self, field, value, atom=False):
+    term = self._LookupTerm(field, value, atom)
+    if term is None:
+      return {}
+    return self._ReadPostings(term)
+
+  def DocCount(self):
+    return self.doc_count
+
+  def _GetDocEntry(self, doc):
+    start, end = struct.unpack_from("<II", self.data,
+                                    self.doc_offsets + 4 * doc)
+    return self.data[self.doc_blob + start:self.doc_blob + end]
+
+  def GetDocID(self, doc):
+    return self._GetDocEntry(doc).split("\0", 1)[0].decode("utf-8")
+
+  def GetSortKey(self, doc):
+    return self._GetDocEntry(doc).split("\0", 1)[1]
+
+  def GetFieldKind(self, field):
+    info = self.field_info.get(field)
+    return info[1] if info else None
+
+  def GetTextFields(self):
+    return [name for name in self.fields if self.field_info[name][3] != NONE]
+
+  def GetAtomFields(self):
+    return [name for name in self.fields
+            if self.field_info[name][5] & HAS_ATOMS_FLAG]
+
+  def GetNumberFields(self):
+    return [name for name in self.fields if self.field_info[name][4] != NONE]
+
+  def GetPostings(self, field, token):
+    if isinstance(token, unicode):
+      token = token.encode("utf-8")
+    return self._GetTermPostings(field, token)
+
+  def HasTerm(self, token):
+    return any(self._LookupTerm(field, token) is not None
+               for field in self.GetTextFields())
+
+  def GetFieldLength(self, field, doc):
+    info = self.field_info.get(field)
+    if info is None or info[3] == NONE:
+      return 0
+    return struct.unpack_from("<H", self.data,
+                              self.sections["NORM"] + info[3] + 2 * doc)[0]
+
+  def GetAverageFieldLength(self, field):
+    info = self.field_info.get(field)
+    return info[2] if info else 0.0
+
+  def GetAtomDocs(self, field, value):
+    return set(self._GetTermPostings(field, localsearch.FoldText(value),
+                                     atom=True))
+
+  def GetNumberValues(self, field):
+    """Return the tuple of values of a numeric field, NaN where missing."""
+
+    if field not in self.numbers_:
+      info = self.field_info.get(field)
+      if info is None or info[4] == NONE:
+        self.numbers_[field] = ()
+      else:
+        self.numbers_[field] = struct.unpack_from(
+          "<%dd" % self.doc_count, self.data, self.sections["NUMS"] + info[4])
+    return self.numbers_[field]
+
+  def GetNumberDocs(self, field, predicate):
+    # NaN never satisfies a comparison, so missing values are skipped.
+    return set(doc for doc, value in enumerate(self.GetNumberValues(field))
+               if predicate(value))
+
+  def IterTerms(self, field):
+    for term, token in self._IterFieldTerms(field):
+      count, = struct.unpack_from(
+        "<I", self.data, self.sections["POST"] + struct.unpack_from(
+          "<I", self.data, self.postings_offsets + 4 * term)[0])
+      yield token, count
+
+  def _IterFieldTerms(self, field, atom=False):
+    prefix = self._GetKeyPrefix(field, atom)
+    if prefix is None:
+      return
+
+    term = self._FindTerm(prefix)
+    while term < self.term_count:
+      key = self._GetKey(term)
+      if not key.startswith(prefix):
+        break
+      yield term, key[len(prefix):]
+      term += 1
+
+  def IterAtoms(self, field):
+    for term, value in self._IterFieldTerms(field, atom=True):
+      yield value, sorted(self._ReadPostings(term))
+
+  def IterNumbers(self, field):
+    for doc, value in enumerate(self.GetNumberValues(field)):
+      if value == value:  # Skip the NaN of missing values
+        yield doc, value
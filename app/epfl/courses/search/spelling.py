@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local spelling correction of search queries.
+
+The corrector uses the symmetric delete algorithm: every vocabulary word is
+stored under all the strings obtained by deleting up to max_distance of its
+characters, so a lookup only generates the deletes of the query word and
+verifies the few candidates found with an edit distance computation.
+"""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import logging
+import re
+import threading
+
+import localsearch
+from parser import SearchQuery
+
+
+WORD_RE = re.compile(r"^[a-z0-9]+$")
+
+
+def EditDistance(a, b, max_distance):
+  """The optimal string alignment distance, or max_distance + 1 if larger."""
+
+  if abs(len(a) - len(b)) > max_distance:
+    return max_distance + 1
+
+  previous2 = None
+  previous = range(len(b) + 1)
+  for i in xrange(1, len(a) + 1):
+    current = [i] + [0] * len(b)
+    row_min = i
+    for j in xrange(1, len(b) + 1):
+      cost = 0 if a[i - 1] == b[j - 1] else 1
+      current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                       previous[j - 1] + cost)
+      if (i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+        current[j] = min(current[j], previous2[j - 2] + 1)
+      row_min = min(row_min, current[j])
+    if row_min > max_distance:
+      return max_distance + 1
+    previous2, previous = previous, current
+
+  return previous[len(b)]
+
+
+class SpellingCorrector(object):
+  """Suggests the closest vocabulary words for misspelled query terms.
+
+  The vocabulary only covers the fields worth suggesting words from, so when
+  the corrector is built from an index, the words found in any of its text
+  fields are left alone.
+  """
+
+  # The index fields whose words make up the vocabulary
+  VOCABULARY_FIELDS = ["title", "instructor", "keywords", "section"]
+
+  # The filters whose values are checked as well
+  CORRECTED_FILTERS = ["title", "instructor"]
+
+  def __init__(self, max_distance=2, prefix_length=7, min_length=4):
+    self.max_distance = max_distance
+    self.prefix_length = prefix_length
+    self.min_length = min_length
+
+    self.words = {}
+    self.deletes = {}
+    self.index = None
+
+  @classmethod
+  def FromIndex(cls, index, fields=None, **kwargs):
+    corrector = cls(**kwargs)
+    corrector.index = index
+    for field in (fields or cls.VOCABULARY_FIELDS):
+      for token, count in index.IterTerms(field):
+        corrector.AddWord(token, count)
+
+    logging.info("Built a spelling vocabulary of %d words"
+                 % len(corrector.words))
+    return corrector
+
+  def _GetDeletes(self, word):
+    """All the strings obtained by removing up to max_distance characters."""
+
+    word = word[:self.prefix_length]
+    result = set([word])
+    edits = [word]
+    for _ in xrange(self.max_distance):
+      next_edits = []
+      for edit in edits:
+        for i in xrange(len(edit)):
+          delete = edit[:i] + edit[i + 1:]
+          if delete not in result:
+            result.add(delete)
+            next_edits.append(delete)
+      edits = next_edits
+    return result
+
+  def AddWord(self, word, count=1):
+    word = localsearch.FoldText(word)
+    if not WORD_RE.match(word):
+      return
+
+    if word in self.words:
+      self.words[word] += count
+      return
+
+    self.words[word] = count
+    for delete in self._GetDeletes(word):
+      self.deletes.setdefault(delete, []).append(word)
+
+  def _IsIndexed(self, word):
+    return self.index is not None and self.index.HasTerm(word)
+
+  def IsKnown(self, word):
+    word = localsearch.FoldText(word)
+    return word in self.words or self._IsIndexed(word)
+
+  def Correct(self, word):
+    """Return the best correction of a word, or the folded word itself."""
+
+    word = localsearch.FoldText(word)
+    if (word in self.words or len(word) < self.min_length
+        or not WORD_RE.match(word) or self._IsIndexed(word)):
+      return word
+
+    best = None
+    best_key = None
+    candidates = set()
+    for delete in self._GetDeletes(word):
+      candidates.update(self.deletes.get(delete, []))
+
+    for candidate in candidates:
+      distance = EditDistance(word, candidate, self.max_distance)
+      if distance > self.max_distance:
+        continue
+      key = (distance, -self.words[candidate], candidate)
+      if best_key is None or key < best_key:
+        best, best_key = candidate, key
+
+    return best or word
+
+  def _CorrectText(self, text):
+    """Correct all the words of a text, returning the text and whether any
+    word was replaced."""
+
+    corrections = []
+
+    def replace(match):
+      word = match.group(0)
+      corrected = self.Correct(word)
+      if corrected == localsearch.FoldText(word):
+        return word
+      corrections.append(corrected)
+      return corrected
+
+    return re.sub(r"\w+", replace, text, flags=re.UNICODE), bool(corrections)
+
+  def SuggestQuery(self, query):
+    """Return a corrected query string, or None if nothing was corrected."""
+
+    if isinstance(query, basestring):
+      query = SearchQuery.ParseFromString(query)
+
+    suggestion = SearchQuery()
+    changed = False
+
+    for t, value in query.components:
+      if t == SearchQuery.TERM and value != "OR":
+        value, corrected = self._CorrectText(value)
+      elif t == SearchQuery.FILTER and value[0] in self.CORRECTED_FILTERS:
+        filter_value, corrected = self._CorrectText(value[1])
+        value = (value[0], filter_value)
+      else:
+        corrected = False
+
+      changed = changed or corrected
+      suggestion.components.append((t, value))
+
+    if not changed:
+      return None
+
+    return suggestion.GetString()
+
+
+# The (index, corrector) of this instance
+_shared_corrector = None
+_shared_corrector_lock = threading.Lock()
+
+
+def GetSharedCorrector(index_loader, version=None):
+  """Return the spelling corrector of this instance, built on first use and
+  again whenever the shared index changes.
+
+  As for the index, a single request builds the new corrector while the
+  others keep using the previous one.
+  """
+
+  global _shared_corrector
+
+  index = localsearch.GetSharedIndex(index_loader, version)
+  shared = _shared_corrector
+  if shared is not None and shared[0] is index:
+    return shared[1]
+  if not _shared_corrector_lock.acquire(shared is None):
+    return shared[1]
+
+  try:
+    shared = _shared_corrector
+    if shared is None or shared[0] is not index:
+      shared = (index, SpellingCorrector.FromIndex(index))
+      _shared_corrector = shared
+  finally:
+    _shared_corrector_lock.release()
+
+  return shared[1]
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""HTTP transport for the remote search services.
+
+The transport bounds each request by the time left to the caller, caches the
+responses by URL, and stops calling a host for a while after repeated
+failures or slow responses.  The requests go through the URL Fetch service,
+which is what httplib is backed by on App Engine anyway, so connections are
+never kept open between requests.
+"""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import logging
+import threading
+import time
+
+from google.appengine.api import urlfetch
+
+from epfl.courses import cache
+
+from pending import PendingCall
+
+
+class TransportError(Exception):
+  pass
+
+
+class CircuitBreaker(object):
+  """Trips after a number of consecutive failures or slow calls.
+
+  While open, calls are refused until reset_timeout seconds have passed,
+  after which a single trial call is let through; its outcome closes the
+  breaker again or re-opens it.  A trial whose outcome never comes, such as
+  a dropped asynchronous call, is followed by another one after the same
+  timeout.
+  """
+
+  CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+  def __init__(self, failure_threshold=3, slow_threshold=None,
+               reset_timeout=30.0):
+    self.failure_threshold = failure_threshold
+    self.slow_threshold = slow_threshold
+    self.reset_timeout = reset_timeout
+
+    self.state = self.CLOSED
+    self.failures = 0
+    self.opened_at = None
+    self.lock = threading.Lock()
+
+  def Allow(self):
+    with self.lock:
+      if self.state == self.CLOSED:
+        return True
+      if time.time() - self.opened_at >= self.reset_timeout:
+        self.state = self.HALF_OPEN
+        self.opened_at = time.time()
+        return True
+      return False
+
+  def RecordSuccess(self, duration=None):
+    if (self.slow_threshold is not None and duration is not None
+        and duration > self.slow_threshold):
+      logging.warning("Slow call of %.2f seconds" % duration)
+      self.RecordFailure()
+      return
+
+    with self.lock:
+      self.state = self.CLOSED
+      self.failures = 0
+
+  def RecordFailure(self):
+    with self.lock:
+      self.failures += 1
+      if (self.state == self.HALF_OPEN
+          or self.failures >= self.failure_threshold):
+        if self.state != self.OPEN:
+          logging.warning("Circuit breaker open after %d failures"
+                          % self.failures)
+        self.state = self.OPEN
+        self.opened_at = time.time()
+
+
+class HTTPTransport(object):
+  """Fetches URLs through the URL Fetch service."""
+
+  def __init__(self, timeout=5.0, cache_size=200, cache_time=600,
+               breaker=None):
+    self.timeout = timeout
+    self.cache_time = cache_time
+    self.breaker = breaker or CircuitBreaker()
+
+    self.response_cache = cache.LRUCache(cache_size)
+
+  def _GetTimeout(self, deadline):
+    if deadline is None:
+      return self.timeout
+    remaining = deadline - time.time()
+    if remaining <= 0:
+      raise TransportError("Deadline exceeded")
+    return min(self.timeout, remaining)
+
+  def FetchAsync(self, url, deadline=None):
+    """Start a GET request, and return a PendingCall returning its body.
+
+    The request is issued as an asynchronous URL Fetch call, which is only
+    waited for when the returned call is finished.  The arguments and the
+    errors are those of Fetch, the latter raised by either call.
+    """
+
+    entry = self.response_cache.Get(url)
+    if entry is not None and time.time() - entry[0] < self.cache_time:
+      return PendingCall(lambda: entry[1])
+
+    timeout = self._GetTimeout(deadline)
+    if not self.breaker.Allow():
+      raise TransportError("Circuit breaker open")
+
+    start = time.time()
+    rpc = urlfetch.create_rpc(deadline=timeout)
+
+    def GetResult():
+      try:
+        try:
+          response = rpc.get_result()
+        except urlfetch.Error, e:
+          raise TransportError("Request to '%s' failed: %s" % (url, e))
+
+        if response.status_code != 200:
+          raise TransportError("Request to '%s' returned status %d"
+                               % (url, response.status_code))
+      except Exception:
+        # Any failure counts, or a half-open breaker would never close again
+        self.breaker.RecordFailure()
+        raise
+
+      self.breaker.RecordSuccess(time.time() - start)
+      self.response_cache.Put(url, (time.time(), response.content))
+      return response.content
+
+    try:
+      urlfetch.make_fetch_call(rpc, url)
+    except Exception:
+      self.breaker.RecordFailure()
+      raise
+    return PendingCall(GetResult, rpc)
+
+  def Fetch(self, url, deadline=None):
+    """Return the body of a successful response to a GET request.
+
+    Args:
+      url: The URL to fetch.
+      deadline: The absolute time by which the request must complete.
+
+    Raises:
+      TransportError: If the circuit breaker is open, the deadline expired,
+        or the request did not succeed.
+    """
+
+    return self.FetchAsync(url, deadline=deadline)()
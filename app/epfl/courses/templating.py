@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Setup of the Jinja2 template environment.
+
+New instances don't parse the templates when they can get them either from
+the precompiled template modules, or from the bytecode cache shared in
+memcache.  The templates are precompiled by running this module as a
+script before deploying:
+
+  python -m epfl.courses.templating
+
+The precompiled templates are stamped with a hash of the template sources,
+and are only used while the sources still match it, so a template changed
+since the last compilation is read from its source.  They must be compiled
+with the Jinja2 version used in production.
+"""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+
+import jinja2
+
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..", "..")
+
+TEMPLATE_PATH = os.path.join(APP_DIR, "templates")
+COMPILED_PATH = os.path.join(APP_DIR, "templates_compiled")
+
+# The file of the compiled templates holding the hash of their sources
+COMPILED_STAMP = "sources.sha1"
+
+# The memcache expiration time of the template bytecode, in seconds
+BYTECODE_CACHE_TIME = 24 * 3600
+
+
+def GetDeployVersion():
+  """Return the version of the deployed application, or "dev"."""
+
+  return re.sub(r"[^\w.-]", "_", os.environ.get("CURRENT_VERSION_ID", "dev"))
+
+
+def CreateBytecodeCache():
+  """Return the bytecode cache of the templates, specific to the deploy.
+
+  The App Engine servers, including the development one, share the bytecode
+  through memcache.  Other local runs, such as the tests, keep it in the
+  temporary directory.
+  """
+
+  version = GetDeployVersion()
+  if os.environ.get("SERVER_SOFTWARE"):
+    # Imported here, so the templates compile without the App Engine SDK
+    from google.appengine.api import memcache
+    return jinja2.MemcachedBytecodeCache(memcache,
+                                         prefix="jinja2:%s:" % version,
+                                         timeout=BYTECODE_CACHE_TIME)
+
+  return jinja2.FileSystemBytecodeCache(
+    pattern="__jinja2_myedu_%s_%%s.cache" % version)
+
+
+def GetTemplatesHash():
+  """Return the hash of the names and contents of the template sources."""
+
+  digest = hashlib.sha1()
+  for dir_path, dir_names, file_names in os.walk(TEMPLATE_PATH):
+    dir_names.sort()
+    for file_name in sorted(file_names):
+      path = os.path.join(dir_path, file_name)
+      digest.update(os.path.relpath(path, TEMPLATE_PATH) + "\0")
+      with open(path, "rb") as f:
+        digest.update(f.read())
+  return digest.hexdigest()
+
+
+def GetCompiledPath():
+  """Return the path of the precompiled templates, or None if they are
+  missing or out of date."""
+
+  try:
+    with open(os.path.join(COMPILED_PATH, COMPILED_STAMP)) as f:
+      stamp = f.read().strip()
+  except IOError:
+    return None
+
+  if stamp != GetTemplatesHash():
+    logging.warning("The precompiled templates are out of date, "
+                    "using the template sources")
+    return None
+  return COMPILED_PATH
+
+
+def GetEnvironmentArgs():
+  """Return the arguments of the template environment."""
+
+  return {
+    "autoescape": True,
+    "extensions": [
+      "jinja2.ext.autoescape",
+      "jinja2.ext.with_",
+    ],
+    "bytecode_cache": CreateBytecodeCache(),
+  }
+
+
+def CompileTemplates():
+  """Precompile the template sources into Python modules."""
+
+  args = GetEnvironmentArgs()
+  args["loader"] = jinja2.FileSystemLoader(TEMPLATE_PATH)
+  del args["bytecode_cache"]
+
+  # The modules of removed templates must not be left behind
+  if os.path.isdir(COMPILED_PATH):
+    shutil.rmtree(COMPILED_PATH)
+
+  environment = jinja2.Environment(**args)
+  environment.compile_templates(COMPILED_PATH, zip=None,
+                                log_function=logging.info,
+                                ignore_errors=False)
+  with open(os.path.join(COMPILED_PATH, COMPILED_STAMP), "w") as f:
+    f.write(GetTemplatesHash() + "\n")
+
+
+if __name__ == "__main__":
+  logging.basicConfig(level=logging.INFO)
+  CompileTemplates()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The ready-to-render data of the course pages.
+
+The view model of a course is computed when the course is imported and is
+stored along with it as JSON, so the course page only fills in the template.
+"""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import json
+import urllib
+
+from epfl.courses import base_handler
+from epfl.courses import registry
+
+
+# The free text fields, converted from IS Academia markup to HTML
+FREE_TEXT_FIELDS = [
+  "learning_outcomes",
+  "content",
+  "prior_knowledge",
+  "type_of_teaching",
+  "bibliography",
+  "keywords",
+  "exam_form_detail",
+  "note",
+  "prerequisite_for",
+]
+
+
+class CourseView(object):
+  """Computes and stores the view models of courses.
+
+  A view model is a dictionary with the following keys:
+    hierarchy: The schools of the course, mapped to its sections, each
+      mapped to the section code and the list of study plan codes.
+    homepages: The (URL, name, short name) of the IS Academia homepage of
+      each study plan entry.
+    show_trio: Whether the hours are shown as lecture-recitation-project.
+    links: The (URL, decoded URL) of each course link.
+    free_text: The free text fields, as HTML.
+  """
+
+  @classmethod
+  def ComputeSectionHierarchy(cls, course, use_french):
+    sections = registry.SectionRegistry.Get().GetSections(course.section_keys)
+
+    hierarchy = {}
+    homepages = []
+    for section, url, code_prefix, code_number in zip(
+        sections, course.urls, course.code_prefix, course.code_number):
+      school = section.school
+      if school.code == school.OTHER:
+        title = school.title(use_french=use_french)
+      else:
+        title = "%s - %s" % (school.code, school.title(use_french=use_french))
+
+      school_ = hierarchy.setdefault(title, {})
+      section_ = school_.setdefault(section.title(use_french=use_french),
+                                    (section.code, set()))
+      if code_prefix != "XX":
+        section_[1].add("-".join([code_prefix, code_number]))
+
+      homepages.append((url, section.display_name(use_french=use_french),
+                        section.display_name(use_french=use_french,
+                                             short=True)))
+
+    for school_ in hierarchy.itervalues():
+      for title, (code, study_codes) in school_.items():
+        school_[title] = (code, sorted(study_codes))
+
+    return hierarchy, homepages
+
+  @classmethod
+  def ComputeHoursVisibility(cls, course):
+    show_vector = [getattr(course, '%s_time' % s, None)
+                   and not getattr(course, '%s_weeks' % s, None)
+                   for s in ["lecture", "recitation", "project"]]
+
+    return not reduce(lambda x, y: x or y, show_vector)
+
+  @classmethod
+  def DecodeLinksURLs(cls, course):
+    return [(link, urllib.unquote_plus(link)) for link in course.links]
+
+  @classmethod
+  def Compute(cls, course):
+    """Compute the view model of a course."""
+
+    hierarchy, homepages = cls.ComputeSectionHierarchy(
+      course, use_french=(course.desc_language_ == "fr"))
+
+    free_text = {}
+    for attr in FREE_TEXT_FIELDS:
+      value = getattr(course, attr)
+      if value:
+        free_text[attr] = base_handler.BaseHandler.ISAMarkup(value,
+                                                             cleanup=True)
+
+    return {
+      "hierarchy": hierarchy,
+      "homepages": homepages,
+      "show_trio": cls.ComputeHoursVisibility(course),
+      "links": cls.DecodeLinksURLs(course),
+      "free_text": free_text,
+    }
+
+  @classmethod
+  def Store(cls, course):
+    """Compute the view model of a course and keep it in the entity."""
+
+    course.view_model_ = json.dumps(cls.Compute(course), separators=(",", ":"))
+
+  @classmethod
+  def Get(cls, course):
+    """Return the view model of a course.
+
+    Courses imported before the view models existed get theirs computed.
+    """
+
+    if course.view_model_:
+      return json.loads(course.view_model_)
+    return cls.Compute(course)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Preparation of new instances, before they receive user requests."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import logging
+import time
+
+from epfl.courses import base_handler
+from epfl.courses import catalog
+from epfl.courses import config
+from epfl.courses import registry
+from epfl.courses import search
+
+
+class WarmupHandler(base_handler.BaseHandler):
+  """Loads what the first requests of an instance would otherwise wait for.
+
+  Each phase is timed, and the timings are logged and returned as text.  A
+  failing phase is logged along with its timing, and the next ones still run.
+  """
+
+  TEMPLATES = [
+    "base.html",
+    "catalog.html",
+    "course.html",
+    "course_row.html",
+    "section_select.html",
+    "sitemap.xml",
+  ]
+
+  def CreateCatalogPage(self, language):
+    page = catalog.CatalogPage(self.request, self.response)
+    page.url_language_ = language
+    return page
+
+  def WarmTemplates(self):
+    for name in self.TEMPLATES:
+      self.jinja2.environment.get_template(name)
+
+  def WarmSections(self):
+    registry.SectionRegistry.Get()
+    for language in ["en", "fr"]:
+      page = self.CreateCatalogPage(language)
+      page.GetSectionData()
+      page.GetSectionSelect()
+
+  def WarmSearchIndex(self):
+    # Loads the local index along with the spelling corrector
+    self.CreateCatalogPage(self.default_language).CreateSpeller()
+
+  def WarmSampleQueries(self):
+    for language, samples in config.SAMPLE_QUERIES.iteritems():
+      page = self.CreateCatalogPage(language)
+      search_provider = page.CreateSearchProvider()
+      for sample_query, _ in samples:
+        query = search.SearchQuery.ParseFromString(sample_query)
+        search_provider.Search(
+          query, search.SearchResults(query.GetString(), 0),
+          limit=config.PAGE_SIZE, offset=0, accuracy=page.ACCURACY)
+
+  def get(self):
+    phases = [
+      ("templates", self.WarmTemplates),
+      ("sections", self.WarmSections),
+      ("search index", self.WarmSearchIndex),
+      ("sample queries", self.WarmSampleQueries),
+    ]
+
+    self.SetTextMode()
+    for name, phase in phases:
+      start = time.time()
+      try:
+        phase()
+      except Exception:
+        # The next phases may still succeed, and the instance serves anyway
+        duration = (time.time() - start) * 1000
+        logging.exception("Warmup phase '%s' failed after %.1f ms"
+                          % (name, duration))
+        self.response.out.write("%s: failed after %.1f ms\n" % (name, duration))
+        continue
+      duration = (time.time() - start) * 1000
+      logging.info("Warmup phase '%s' took %.1f ms" % (name, duration))
+      self.response.out.write("%s: %.1f ms\n" % (name, duration))
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL. All rights reserved.
+
+"""Unit testing for the compressed bitmaps."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import random
+import sys
+import unittest
+
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from epfl.courses.search.bitmap import Bitmap
+
+
+class TestBitmap(unittest.TestCase):
+  def setUp(self):
+    rng = random.Random(42)
+    # Sparse and dense containers, across container boundaries
+    self.sets = [
+      set(rng.sample(xrange(200000), 3000)),
+      set(rng.sample(xrange(70000), 20000)),
+      set(xrange(60000, 140000, 3)),
+      set(),
+    ]
+
+  def test_membership(self):
+    for values in self.sets:
+      bitmap = Bitmap(values)
+      self.assertEqual(len(bitmap), len(values))
+      self.assertEqual(list(bitmap), sorted(values))
+      for value in list(values)[:100]:
+        self.assertTrue(value in bitmap)
+      self.assertFalse(200001 in bitmap)
+
+  def test_operations(self):
+    for a in self.sets:
+      for b in self.sets:
+        self.assertEqual(list(Bitmap(a) & Bitmap(b)), sorted(a & b))
+        self.assertEqual(list(Bitmap(a) | Bitmap(b)), sorted(a | b))
+
+  def test_intersection(self):
+    bitmaps = [Bitmap(values) for values in self.sets[:3]]
+    self.assertEqual(list(Bitmap.Intersection(bitmaps)),
+                     sorted(self.sets[0] & self.sets[1] & self.sets[2]))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL. All rights reserved.
+
+"""Unit testing for the caching utilities."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import sys
+import time
+import unittest
+
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.api import memcache
+from google.appengine.ext import testbed
+
+from epfl.courses import cache
+from epfl.courses import models
+
+
+class TestLRUCache(unittest.TestCase):
+  def test_eviction(self):
+    lru = cache.LRUCache(2)
+    lru.Put("a", 1)
+    lru.Put("b", 2)
+    lru.Get("a")
+    lru.Put("c", 3)
+    self.assertEqual(lru.Get("a"), 1)
+    self.assertEqual(lru.Get("b"), None)
+    self.assertEqual(len(lru), 2)
+
+
+class TestTieredCache(unittest.TestCase):
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_memcache_stub()
+    self.computed = []
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def Compute(self):
+    self.computed.append(True)
+    return "value"
+
+  def test_tiers(self):
+    tiered = cache.TieredCache("test")
+    self.assertEqual(tiered.Get("key", self.Compute), "value")
+    self.assertEqual(tiered.Get("key", self.Compute), "value")
+    self.assertEqual(len(self.computed), 1)
+    self.assertEqual(memcache.get("test:key"), "value")
+
+    # Another instance finds the value in memcache
+    other = cache.TieredCache("test")
+    self.assertEqual(other.Get("key", self.Compute), "value")
+    self.assertEqual(len(self.computed), 1)
+    self.assertEqual(other.stats.counts["memcache_hits"], 1)
+
+
+class TestGeneration(unittest.TestCase):
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def test_concurrent_bump(self):
+    cache.Generation.Bump("test-race")
+    memcache.delete("generation:test-race")
+    cache.Generation._local.clear()
+
+    # Another instance bumps the generation after the datastore was read
+    bumped = []
+    stale_entity = models.CacheGeneration.get_by_key_name("test-race")
+    def GetAndBump(name):
+      time.sleep(0.002)
+      bumped.append(cache.Generation.Bump(name))
+      cache.Generation._local.clear()
+      return stale_entity
+    models.CacheGeneration.get_by_key_name = staticmethod(GetAndBump)
+    try:
+      self.assertEqual(cache.Generation.Get("test-race"), bumped[0])
+    finally:
+      del models.CacheGeneration.get_by_key_name
+    self.assertEqual(memcache.get("generation:test-race"), bumped[0])
+
+
+class TestPageCache(unittest.TestCase):
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def test_versions(self):
+    pages = cache.PageCache("test-pages", ["test"])
+    version = pages.GetVersion()
+    pages.Put("en:/en/?q=x", cache.CachedPage("body", "text/html", 0),
+              version)
+    self.assertEqual(pages.Get("en:/en/?q=x", version).body, "body")
+
+    cache.Generation.Bump("test")
+    self.assertEqual(pages.Get("en:/en/?q=x", pages.GetVersion()), None)
+
+  def test_min_hits(self):
+    pages = cache.PageCache("test-pages", ["test"], min_hits=2)
+    self.assertFalse(pages.ShouldCache("en:/en/?q=x"))
+    self.assertTrue(pages.ShouldCache("en:/en/?q=x"))
+
+
+class TestCourseCache(unittest.TestCase):
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    cache.CourseCache.local_cache.Clear()
+    cache.CourseSummaryCache.local_cache.Clear()
+
+    models.Course(key_name="en:cs-101", title="Programming").put()
+    models.Course(key_name="en:cs-102", title="Algorithms").put()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def test_read_through(self):
+    courses = cache.CourseCache.Get(["cs-101", "cs-999", "cs-102"])
+    self.assertEqual([course and course.title for course in courses],
+                     ["Programming", None, "Algorithms"])
+
+    # Served from memory, even after the datastore changes
+    models.Course(key_name="en:cs-101", title="Changed").put()
+    self.assertEqual(cache.CourseCache.Get("cs-101").title, "Programming")
+
+    # Served from memcache on another instance
+    cache.CourseCache.local_cache.Clear()
+    self.assertEqual(cache.CourseCache.Get("cs-101").title, "Programming")
+
+  def test_invalidate(self):
+    cache.CourseCache.Get("cs-101")
+    models.Course(key_name="en:cs-101", title="Changed").put()
+    cache.CourseCache.Invalidate()
+    self.assertEqual(cache.CourseCache.Get("cs-101").title, "Changed")
+
+  def test_summaries(self):
+    course = models.Course.GetByCourseID("cs-102")
+    models.CourseSummary.FromCourse(course).put()
+
+    # The summary of cs-101 is derived from its course
+    summaries = cache.CourseSummaryCache.Get(["cs-101", "cs-102"])
+    self.assertEqual([summary.title for summary in summaries],
+                     ["Programming", "Algorithms"])
+    self.assertTrue(isinstance(summaries[1], models.CourseSummary))
+    self.assertEqual(summaries[1].course_id, "cs-102")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL. All rights reserved.
+
+"""Unit testing for the incremental course catalog import."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.ext import testbed
+
+from epfl.courses import admin
+from epfl.courses import jobs
+from epfl.courses import models
+from epfl.courses import registry
+from epfl.courses import static_data
+
+
+def CreateDescription(course_id, title):
+  return {
+    "id": course_id,
+    "en": {
+      "title": title,
+      "language": "English",
+      "instructors": [{"name": "Ada Lovelace"}],
+      "credits": 4,
+      "coefficient": 4.0,
+      "semester": "Fall",
+      "exam_form": "Written",
+      "lecture": {"week_hours": 2, "weeks": 14},
+      "recitation": None,
+      "project": None,
+      "lab": None,
+      "practical": None,
+      "library_recommends": None,
+      "links": [],
+      "free_text": {"Content": "[b]Loops[/b]"},
+    },
+    "study_plan_entry": [{
+      "section": "IN",
+      "plan": "ba1",
+      "code": ["CS", "101"],
+      "url": "http://isa/en",
+      "url_fr": "http://isa/fr",
+    }],
+  }
+
+
+class TestImportCourseCatalog(unittest.TestCase):
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_search_stub()
+    registry.SectionRegistry._current = None
+
+    self.data_dir = tempfile.mkdtemp()
+    self.saved_data_file = admin.COURSES_DATA_FILE
+    admin.COURSES_DATA_FILE = os.path.join(self.data_dir, "courses.jsonl")
+
+    admin.ImportCourseCatalog.PopulateSections()
+
+  def tearDown(self):
+    admin.COURSES_DATA_FILE = self.saved_data_file
+    shutil.rmtree(self.data_dir)
+    self.testbed.deactivate()
+
+  def WriteDescriptions(self, descriptions):
+    with open(admin.COURSES_DATA_FILE, "w") as f:
+      for course_desc in descriptions:
+        f.write(json.dumps(course_desc) + "\n")
+
+  def test_reimport(self):
+    descriptions = [CreateDescription("cs-101", "Programming"),
+                    CreateDescription("cs-102", "Algorithms")]
+    self.WriteDescriptions(descriptions)
+    self.assertEqual(admin.ImportCourseCatalog.ImportAllCourses("en"),
+                     {"added": 2, "changed": 0, "removed": 0, "unchanged": 0})
+
+    course = models.Course.GetByCourseID("cs-101")
+    self.assertEqual(course.title, "Programming")
+    self.assertEqual(course.section_keys[0].name(), "IN")
+    course.needs_indexing_ = False
+    course.put()
+
+    self.assertEqual(admin.ImportCourseCatalog.ImportAllCourses("en"),
+                     {"added": 0, "changed": 0, "removed": 0, "unchanged": 2})
+    self.assertFalse(models.Course.GetByCourseID("cs-101").needs_indexing_)
+
+    changed = copy.deepcopy(descriptions[0])
+    changed["en"]["title"] = "Programming I"
+    self.WriteDescriptions([changed])
+    self.assertEqual(admin.ImportCourseCatalog.ImportAllCourses("en"),
+                     {"added": 0, "changed": 1, "removed": 1, "unchanged": 0})
+
+    course = models.Course.GetByCourseID("cs-101")
+    self.assertEqual(course.title, "Programming I")
+    self.assertTrue(course.needs_indexing_)
+    self.assertIsNone(models.Course.GetByCourseID("cs-102"))
+    self.assertIsNone(models.CourseSummary.GetByCourseID("cs-102"))
+
+  def test_section_names_in_hash(self):
+    course_desc = CreateDescription("cs-101", "Programming")
+    section_keys = admin.ImportCourseCatalog.LoadSectionKeys()
+    content_hash = admin.ImportCourseCatalog.ComputeContentHash(
+      course_desc, "en", section_keys)
+
+    section = static_data.SECTIONS["IN"]
+    saved_title, section.title_en = section.title_en, "Informatics"
+    try:
+      self.assertNotEqual(admin.ImportCourseCatalog.ComputeContentHash(
+        course_desc, "en", section_keys), content_hash)
+    finally:
+      section.title_en = saved_title
+
+  def test_description_range(self):
+    descriptions = [CreateDescription("cs-%d" % index, "Course %d" % index)
+                    for index in range(5)]
+    self.WriteDescriptions(descriptions)
+
+    offsets = admin.GetCourseLineOffsets()
+    self.assertEqual(len(offsets), 5)
+    self.assertEqual([course_desc["id"] for course_desc
+                      in admin.ReadCourseDescriptionRange(offsets[2], 1, 3)],
+                     ["cs-3", "cs-4"])
+    self.assertRaises(ValueError, list,
+                      admin.ReadCourseDescriptionRange(offsets[2] + 1, 0, 1))
+
+  def test_sharded_import(self):
+    self.WriteDescriptions([CreateDescription("cs-%d" % index,
+                                              "Course %d" % index)
+                            for index in range(5)])
+    runner = jobs.LocalTaskRunner()
+    job_id = jobs.StartJob(admin.ImportCoursesJob, {"language": "en"}, 2,
+                           runner)
+    runner.Run()
+
+    job = models.BatchJob.get_by_id(job_id)
+    self.assertEqual(job.state, "done")
+    self.assertEqual(json.loads(job.stats),
+                     {"added": 5, "changed": 0, "removed": 0, "unchanged": 0})
+    self.assertEqual(models.Course.GetByCourseID("cs-4").title, "Course 4")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL. All rights reserved.
+
+"""Unit testing for the sharded administrative jobs."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import datetime
+import json
+import sys
+import unittest
+
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.ext import testbed
+
+from epfl.courses import jobs
+from epfl.courses import models
+
+
+class SumJob(jobs.ShardedJob):
+  """Sums the integers of a range, failing or pausing once on demand."""
+
+  processed = []
+  failures = set()
+  pauses = set()
+
+  @classmethod
+  def CreateShards(cls, params, shard_count):
+    return [({"start": start, "end": end}, end - start)
+            for start, end in jobs.SplitRange(params["count"], shard_count)]
+
+  @classmethod
+  def RunShard(cls, params, shard_params, position, stats, checkpoint):
+    stats.setdefault("sum", 0)
+    while position < shard_params["end"] - shard_params["start"]:
+      value = shard_params["start"] + position
+      if value in cls.failures:
+        cls.failures.remove(value)
+        raise ValueError(value)
+      if value in cls.pauses:
+        cls.pauses.remove(value)
+        return False
+
+      cls.processed.append(value)
+      stats["sum"] += value
+      position += 1
+      checkpoint(position, stats)
+    return True
+
+
+class TestShardedJob(unittest.TestCase):
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+
+    SumJob.processed = []
+    SumJob.failures = set()
+    SumJob.pauses = set()
+    self.runner = jobs.LocalTaskRunner()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def test_split_range(self):
+    self.assertEqual(jobs.SplitRange(10, 3), [(0, 3), (3, 6), (6, 10)])
+    self.assertEqual(jobs.SplitRange(2, 8), [(0, 1), (1, 2)])
+    self.assertEqual(jobs.SplitRange(0, 8), [])
+
+  def test_retry_from_checkpoint(self):
+    SumJob.failures = set([7])
+    job_id = jobs.StartJob(SumJob, {"count": 20}, 4, self.runner)
+    self.runner.Run()
+
+    job = models.BatchJob.get_by_id(job_id)
+    self.assertEqual(job.state, "done")
+    self.assertEqual(json.loads(job.stats), {"sum": sum(range(20))})
+    # Each value is processed once, despite the failed task
+    self.assertEqual(sorted(SumJob.processed), range(20))
+
+  def test_pause_and_resume(self):
+    SumJob.pauses = set([12])
+    job_id = jobs.StartJob(SumJob, {"count": 20}, 2, self.runner)
+    self.runner.Run()
+
+    job = models.BatchJob.get_by_id(job_id)
+    self.assertEqual(job.state, "paused")
+    self.assertEqual(job.done_shards, [0])
+    self.assertEqual(jobs.GetShards(job)[1].position, 2)
+
+    self.assertTrue(jobs.ResumeJob(job_id, self.runner))
+    self.runner.Run()
+
+    job = models.BatchJob.get_by_id(job_id)
+    self.assertEqual(job.state, "done")
+    self.assertEqual(json.loads(job.stats), {"sum": sum(range(20))})
+    self.assertEqual(sorted(SumJob.processed), range(20))
+    self.assertFalse(jobs.ResumeJob(job_id, self.runner))
+
+  def test_leased_shard(self):
+    job_id = jobs.StartJob(SumJob, {"count": 10}, 1, self.runner)
+    shard = jobs.GetShards(models.BatchJob.get_by_id(job_id))[0]
+    shard.state = "running"
+    shard.lease_until = datetime.datetime.now() + datetime.timedelta(hours=1)
+    shard.put()
+
+    # The task keeps failing while another task holds the shard
+    self.assertRaises(jobs.ShardLeasedError, self.runner.Run)
+    self.assertEqual(SumJob.processed, [])
+
+    # Resuming leaves the shard to the task holding it
+    self.assertTrue(jobs.ResumeJob(job_id, self.runner))
+    self.assertEqual(len(self.runner.tasks), 0)
+
+    shard.lease_until = datetime.datetime.now() - datetime.timedelta(hours=1)
+    shard.put()
+    self.assertTrue(jobs.ResumeJob(job_id, self.runner))
+    self.runner.Run()
+
+    job = models.BatchJob.get_by_id(job_id)
+    self.assertEqual(job.state, "done")
+    self.assertEqual(json.loads(job.stats), {"sum": sum(range(10))})
+    self.assertIsNone(jobs.GetShards(job)[0].lease_until)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL. All rights reserved.
+
+"""Unit testing for the in-process search index."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import StringIO
+import sys
+import threading
+import unittest
+
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from epfl.courses.search import PageCursor
+from epfl.courses.search import SearchResults
+from epfl.courses.search import localsearch
+from epfl.courses.search.localsearch import ATOM, HTML, NUMBER, TEXT
+from epfl.courses.search.localsearch import LocalIndex
+from epfl.courses.search.localsearch import LocalIndexSearchProvider
+from epfl.courses.search.parser import SearchQuery
+from epfl.courses.search.snapshot import IndexSnapshot
+from epfl.courses.search.snapshot import WriteSnapshot
+
+
+def CreateTestIndex():
+  index = LocalIndex()
+  index.AddDocument("advanced-computer-architecture", [
+    ("title", TEXT, "Advanced computer architecture"),
+    ("instructor", TEXT, "Paolo Ienne"),
+    ("section", ATOM, "IN"),
+    ("section", TEXT, "Computer Science"),
+    ("semester", ATOM, "Spring"),
+    ("credits", NUMBER, 4),
+    ("codeplan", ATOM, "4"),
+    ("content", HTML, "Processor <b>design</b> and programming"),
+  ])
+  index.AddDocument("biology-for-engineers", [
+    ("title", TEXT, "Biology for engineers"),
+    ("instructor", TEXT, "Jean-Yves Le Boudec"),
+    ("section", ATOM, "SV"),
+    ("section", TEXT, "Life Sciences"),
+    ("semester", ATOM, "Fall"),
+    ("credits", NUMBER, 2),
+    ("codeplan", ATOM, "1"),
+    ("content", HTML, "Cells and biological systems"),
+  ])
+  index.AddDocument("litterature-francaise", [
+    ("title", TEXT, u"Littérature française"),
+    ("instructor", TEXT, u"André Garçon"),
+    ("section", ATOM, "SHS"),
+    ("section", TEXT, "Humanities"),
+    ("semester", ATOM, "Fall"),
+    ("credits", NUMBER, 2),
+    ("codeplan", ATOM, "5"),
+    ("content", HTML, "Literature and design of the novel"),
+  ])
+  return index
+
+
+class TestLocalIndexSearch(unittest.TestCase):
+  def setUp(self):
+    self.provider = LocalIndexSearchProvider(index=CreateTestIndex())
+
+  def Search(self, query_string, **kwargs):
+    results = SearchResults(query_string)
+    self.provider.Search(SearchQuery.ParseFromString(query_string), results,
+                         **kwargs)
+    return results
+
+  def test_term(self):
+    results = self.Search("architecture")
+    self.assertEqual(results.results, ["advanced-computer-architecture"])
+    self.assertEqual(results.number_found, 1)
+
+  def test_accents(self):
+    results = self.Search(u"litterature andre")
+    self.assertEqual(results.results, ["litterature-francaise"])
+
+  def test_atom_filter(self):
+    results = self.Search("section:sv")
+    self.assertEqual(results.results, ["biology-for-engineers"])
+
+  def test_number_filter(self):
+    results = self.Search("credits:2")
+    self.assertEqual(sorted(results.results),
+                     ["biology-for-engineers", "litterature-francaise"])
+
+  def test_or(self):
+    results = self.Search("semester:fall literature OR cells")
+    self.assertEqual(sorted(results.results),
+                     ["biology-for-engineers", "litterature-francaise"])
+
+  def test_grouped_filters(self):
+    results = self.Search("(codeplan:4 OR codeplan:5) design")
+    self.assertEqual(sorted(results.results),
+                     ["advanced-computer-architecture",
+                      "litterature-francaise"])
+
+  def test_phrase(self):
+    results = self.Search('instructor:"le boudec"')
+    self.assertEqual(results.results, ["biology-for-engineers"])
+    results = self.Search('instructor:"boudec le"')
+    self.assertEqual(results.number_found, 0)
+
+  def test_stemming(self):
+    results = self.Search("~biology")
+    self.assertEqual(results.results, ["biology-for-engineers"])
+
+  def test_negation(self):
+    results = self.Search("credits:2 NOT section:shs")
+    self.assertEqual(results.results, ["biology-for-engineers"])
+
+  def test_title_ranking(self):
+    results = self.Search("computer OR design")
+    self.assertEqual(results.results[0], "advanced-computer-architecture")
+
+  def test_paging(self):
+    results = self.Search("semester:fall", limit=1, offset=1)
+    self.assertEqual(results.number_found, 2)
+    self.assertEqual(results.results, ["litterature-francaise"])
+
+  def test_cursor_paging(self):
+    first = self.Search("design OR cells OR computer", limit=1)
+    self.assertEqual(first.number_found, 3)
+    cursor = PageCursor.Parse(first.next_cursor.Encode())
+    self.assertEqual(cursor.offset, 1)
+
+    second = self.Search("design OR cells OR computer", limit=1,
+                         offset=cursor)
+    by_offset = self.Search("design OR cells OR computer", limit=1, offset=1)
+    self.assertEqual(second.results, by_offset.results)
+
+    third = self.Search("design OR cells OR computer", limit=1,
+                        offset=second.next_cursor)
+    self.assertEqual(len(set(first.results + second.results + third.results)),
+                     3)
+    self.assertEqual(third.next_cursor, None)
+
+  def test_split_filters(self):
+    query = SearchQuery.ParseFromString(
+      "design credits:2 NOT section:shs semester:fall OR semester:spring")
+    filters, rest = LocalIndexSearchProvider.SplitFilters(query,
+                                                          self.provider.index)
+    self.assertEqual(filters, [("credits", "2")])
+    self.assertEqual(rest, "design NOT section:shs semester:fall OR "
+                     "semester:spring")
+
+  def test_filter_only(self):
+    results = self.Search('semester:fall credits:2 language:"english"')
+    self.assertEqual(results.number_found, 0)
+    results = self.Search("credits:2 semester:fall")
+    self.assertEqual(results.results, ["biology-for-engineers",
+                                       "litterature-francaise"])
+
+  def test_facets(self):
+    results = self.Search("semester:fall")
+    self.assertEqual(results.facets["section"], {"sv": 1, "shs": 1})
+    self.assertEqual(results.facets["credits"], {2.0: 2})
+    self.assertEqual(results.GetFacetCounts("credits", [2, 4]), [2, 0])
+    self.assertEqual(results.GetFacetCounts("semester", ["Fall", "Spring"]),
+                     [2, 0])
+    self.assertEqual(results.GetFacetCounts("exam", ["Oral"]), None)
+
+  def test_prefiltered_terms(self):
+    results = self.Search("design codeplan:5")
+    self.assertEqual(results.results, ["litterature-francaise"])
+
+  def test_mixed_kind_field(self):
+    # The section has both atom values (codes) and text values (titles)
+    results = self.Search("humanities")
+    self.assertEqual(results.results, ["litterature-francaise"])
+    results = self.Search("section:SV")
+    self.assertEqual(results.results, ["biology-for-engineers"])
+
+
+class TestIndexSnapshotSearch(TestLocalIndexSearch):
+  """Runs the same searches against a snapshot of the test index."""
+
+  def setUp(self):
+    f = StringIO.StringIO()
+    WriteSnapshot(CreateTestIndex(), f)
+    self.provider = LocalIndexSearchProvider(index=IndexSnapshot(f.getvalue()))
+
+  def test_terms(self):
+    terms = dict(self.provider.index.IterTerms("title"))
+    self.assertEqual(terms["computer"], 1)
+    self.assertEqual(sorted(terms), ["advanced", "architecture", "biology",
+                                     "computer", "engineers", "for",
+                                     "francaise", "litterature"])
+
+  def test_fields(self):
+    index = CreateTestIndex()
+    snapshot = self.provider.index
+    self.assertEqual(sorted(snapshot.GetTextFields()),
+                     sorted(index.GetTextFields()))
+    self.assertEqual(sorted(snapshot.GetAtomFields()),
+                     sorted(index.GetAtomFields()))
+    self.assertEqual(sorted(snapshot.GetNumberFields()),
+                     sorted(index.GetNumberFields()))
+    for field in index.GetTextFields():
+      self.assertEqual([snapshot.GetFieldLength(field, doc)
+                        for doc in range(index.DocCount())],
+                       [index.GetFieldLength(field, doc)
+                        for doc in range(index.DocCount())])
+      self.assertEqual(snapshot.GetAverageFieldLength(field),
+                       index.GetAverageFieldLength(field))
+
+  def test_has_term(self):
+    index = CreateTestIndex()
+    snapshot = self.provider.index
+    for token in ["humanities", "biology", "algebra", "xyzzy"]:
+      self.assertEqual(snapshot.HasTerm(token), index.HasTerm(token))
+    self.assertTrue(snapshot.HasTerm("humanities"))
+    self.assertFalse(snapshot.HasTerm("xyzzy"))
+
+  def test_source(self):
+    self.assertIsNone(self.provider.index.source)
+    f = StringIO.StringIO()
+    WriteSnapshot(CreateTestIndex(), f, source="0123abcd")
+    self.assertEqual(IndexSnapshot(f.getvalue()).source, "0123abcd")
+
+
+class TestSharedIndex(unittest.TestCase):
+  def setUp(self):
+    localsearch.ResetSharedIndex()
+    self.loads = []
+
+  def tearDown(self):
+    localsearch.ResetSharedIndex()
+
+  def Load(self):
+    self.loads.append(LocalIndex())
+    return self.loads[-1]
+
+  def test_version(self):
+    index = localsearch.GetSharedIndex(self.Load, version=1)
+    self.assertIs(localsearch.GetSharedIndex(self.Load, version=1), index)
+    self.assertIsNot(localsearch.GetSharedIndex(self.Load, version=2), index)
+    self.assertEqual(len(self.loads), 2)
+
+  def test_reload_in_progress(self):
+    index = localsearch.GetSharedIndex(self.Load, version=1)
+    loading = threading.Event()
+    release = threading.Event()
+    def SlowLoad():
+      loading.set()
+      release.wait()
+      return self.Load()
+
+    thread = threading.Thread(target=localsearch.GetSharedIndex,
+                              args=(SlowLoad, 2))
+    thread.start()
+    loading.wait()
+    # The other requests keep using the previous index meanwhile
+    self.assertIs(localsearch.GetSharedIndex(self.Load, version=2), index)
+    release.set()
+    thread.join()
+    self.assertIsNot(localsearch.GetSharedIndex(self.Load, version=2), index)
+    self.assertEqual(len(self.loads), 2)
+
+  def test_not_ready(self):
+    fallback = LocalIndex()
+    def LoadNotReady():
+      raise localsearch.IndexNotReadyError("Not ready", fallback=fallback)
+
+    self.assertIs(localsearch.GetSharedIndex(LoadNotReady, version=1),
+                  fallback)
+    # The next attempt waits for the retry interval
+    self.assertIs(localsearch.GetSharedIndex(self.Load, version=1), fallback)
+    self.assertEqual(self.loads, [])
+
+    localsearch.ResetSharedIndex()
+    index = localsearch.GetSharedIndex(self.Load, version=1)
+    self.assertIs(localsearch.GetSharedIndex(LoadNotReady, version=2), index)
+
+
+if __name__ == "__main__":
+  unittest.main()
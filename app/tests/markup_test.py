@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL. All rights reserved.
+
+"""Unit testing for the IS Academia markup conversion."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import sys
+import unittest
+
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from epfl.courses import cache
+from epfl.courses import markup
+
+
+class TestISAMarkupTranslator(unittest.TestCase):
+  samples = [
+    u"[b]Bold[/b] and [i]italic[/i][br]next line",
+    u"[li]first\n  [li]second  \n",
+    u"Unknown [x] tags and [long text] in brackets [",
+    u"Nested [[x]b]tags[/b] and [a[b]c]",
+    u"Entities &amp;nbsp; &amp; &nbsp; [br/]",
+    u"Accents é à [b]ü[/b]",
+  ]
+
+  def test_legacy_output(self):
+    for sample in self.samples:
+      self.assertEqual(markup.ISAMarkupTranslator.Translate(sample),
+                       markup.ISAMarkupTranslator.TranslateLegacy(sample))
+
+  def test_translate(self):
+    self.assertEqual(markup.ISAMarkupTranslator.Translate(self.samples[0]),
+                     u"<b>Bold</b> and <i>italic</i><br/>next line")
+    self.assertEqual(markup.ISAMarkupTranslator.Translate(self.samples[2]),
+                     u"Unknown  tags and [long text] in brackets [")
+
+  def test_memo(self):
+    memo = cache.LRUCache(10)
+    translator = markup.ISAMarkupTranslator(memo=memo)
+    first = translator(self.samples[0], cleanup=True)
+    self.assertEqual(len(memo), 1)
+    self.assertTrue(translator(self.samples[0], cleanup=True) is first)
+    self.assertEqual(translator(self.samples[0]),
+                     markup.ISAMarkupTranslator.Translate(self.samples[0]))
+    self.assertEqual(len(memo), 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
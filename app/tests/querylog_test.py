@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL. All rights reserved.
+
+"""Unit testing for the buffered query log."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import sys
+import threading
+import unittest
+
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from epfl.courses import querylog
+
+
+class TestQueryLog(unittest.TestCase):
+  def setUp(self):
+    self.writer = querylog.MemoryWriter()
+
+  def test_batches(self):
+    log = querylog.QueryLog(self.writer, batch_size=3)
+    for i in range(7):
+      log.Add({"q": str(i)})
+    self.assertEqual([len(batch) for batch in self.writer.batches], [3, 3])
+
+    log.Flush()
+    self.assertEqual([record["q"] for record in self.writer.records],
+                     [str(i) for i in range(7)])
+
+  def test_delay(self):
+    log = querylog.QueryLog(self.writer, batch_size=100, max_delay=0)
+    log.Add({"q": "a"})
+    self.assertEqual(len(self.writer.batches), 1)
+
+  def test_flush_if_due(self):
+    log = querylog.QueryLog(self.writer, batch_size=100, max_delay=60)
+    log.Add({"q": "a"})
+    log.FlushIfDue()
+    self.assertEqual(self.writer.batches, [])
+
+    log.oldest -= 60
+    log.FlushIfDue()
+    self.assertEqual(self.writer.records, [{"q": "a"}])
+
+    log.FlushIfDue()
+    self.assertEqual(len(self.writer.batches), 1)
+
+  def test_concurrent(self):
+    log = querylog.QueryLog(self.writer, batch_size=10)
+
+    def LogQueries(thread_id):
+      for i in range(500):
+        log.Add({"q": "%d-%d" % (thread_id, i)})
+
+    threads = [threading.Thread(target=LogQueries, args=(i,))
+               for i in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    log.Flush()
+
+    records = self.writer.records
+    self.assertEqual(len(records), 4000)
+    self.assertEqual(len(set(record["q"] for record in records)), 4000)
+
+  def test_writer_errors(self):
+    def FailingWriter(batch):
+      raise IOError("datastore unavailable")
+
+    log = querylog.QueryLog(FailingWriter, batch_size=1)
+    log.Add({"q": "a"})
+
+
+if __name__ == "__main__":
+  unittest.main()
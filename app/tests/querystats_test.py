@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL. All rights reserved.
+
+"""Unit testing for the query statistics rollups."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import datetime
+import sys
+import unittest
+
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.ext import testbed
+
+from epfl.courses import config
+from epfl.courses import models
+from epfl.courses import querystats
+
+
+class TestSpaceSavingSketch(unittest.TestCase):
+  def test_heavy_hitters(self):
+    sketch = querystats.SpaceSavingSketch(capacity=4)
+    for item in "aaaaaabbbbbbcdefaa":
+      sketch.Add(item)
+    # Any item occurring more than 18 / 4 times is counted, possibly over
+    self.assertEqual(sketch.GetTop(1), [("a", 8)])
+    self.assertTrue("b" in sketch.counters)
+    self.assertTrue(sketch.counters["b"][0] >= 6)
+    self.assertEqual(len(sketch.counters), 4)
+
+  def test_merge(self):
+    first = querystats.SpaceSavingSketch(capacity=2)
+    second = querystats.SpaceSavingSketch(capacity=2)
+    for item in "aab":
+      first.Add(item)
+    for item in "acc":
+      second.Add(item)
+    first.Merge(querystats.SpaceSavingSketch.FromJSON(second.ToJSON()))
+    self.assertEqual(first.GetTop(2), [("a", 3), ("c", 2)])
+
+
+class TestQueryStats(unittest.TestCase):
+  def test_records(self):
+    stats = querystats.QueryStats()
+    stats.AddRecord({"translated_query": config.SAMPLE_QUERIES["fr"][0][0],
+                     "results_count": 10})
+    stats.AddRecord({"translated_query": "machine learning",
+                     "results_count": 50})
+    stats.AddRecord({"translated_query": "quantum cooking",
+                     "results_count": None})
+    self.assertEqual(stats.count, 3)
+    self.assertEqual(stats.canned_count, 1)
+    self.assertEqual(stats.term_count, 4)
+    self.assertEqual(stats.no_results, ["quantum cooking"])
+    self.assertEqual(stats.many_results, [("machine learning", 50)])
+
+
+class TestRollups(unittest.TestCase):
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def test_windows(self):
+    day = datetime.datetime(2012, 10, 1)
+    records = [{"translated_query": "java", "results_count": 5,
+                "time_stamp": day + datetime.timedelta(hours=hour)}
+               for hour in [1, 1, 5, 30]]
+    querystats.UpdateRollups(records[:2], "first")
+    querystats.UpdateRollups(records[2:], "second")
+
+    self.assertEqual(querystats.GetStats(
+      day, day + datetime.timedelta(days=1)).count, 3)
+    self.assertEqual(querystats.GetStats(
+      day, day + datetime.timedelta(hours=2)).count, 2)
+    stats = querystats.GetStats(day, day + datetime.timedelta(days=2))
+    self.assertEqual(stats.terms.GetTop(1), [("java", 4)])
+    # There are only hourly rollups
+    self.assertEqual(len(models.QueryRollup.get_by_key_name(
+      ["hour:2012100101", "hour:2012100105", "hour:2012100206"])), 3)
+    self.assertEqual(models.QueryRollup.get_by_key_name("day:20121001"), None)
+
+  def test_store_records(self):
+    time_stamp = datetime.datetime(2012, 10, 1, 12)
+    records = [{"translated_query": query, "results_count": 5,
+                "time_stamp": time_stamp} for query in ["java", "scala"]]
+    querystats.StoreRecords(records, "batch")
+    # A retried task stores the same batch again
+    querystats.StoreRecords(records, "batch")
+
+    stored = models.SearchQueryRecord.get_by_key_name(["batch:0", "batch:1"])
+    self.assertEqual([record.translated_query for record in stored],
+                     ["java", "scala"])
+    self.assertEqual(querystats.GetStats(
+      time_stamp, time_stamp + datetime.timedelta(hours=1)).count, 2)
+
+  def test_backfill(self):
+    hour = datetime.datetime(2012, 10, 1, 12)
+    models.SearchQueryRecord(translated_query="java", results_count=5,
+                             time_stamp=hour).put()
+    querystats.StoreRecords([{"translated_query": "scala", "results_count": 5,
+                              "time_stamp": hour}], "batch")
+
+    # The records stored with the rollups are not added again
+    self.assertEqual(querystats.BackfillHour(hour), 1)
+    self.assertEqual(querystats.BackfillHour(hour), 1)
+    stats = querystats.GetStats(hour, hour + datetime.timedelta(hours=1))
+    self.assertEqual(stats.count, 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
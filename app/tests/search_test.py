@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL. All rights reserved.
+
+"""Unit testing for the composite search providers."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import sys
+import threading
+import time
+import unittest
+
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.api import apiproxy_rpc
+from google.appengine.ext import testbed
+
+from epfl.courses import cache
+from epfl.courses.search import AutocorrectedSearchProvider
+from epfl.courses.search import CachedSearchProvider
+from epfl.courses.search import SearchResults
+from epfl.courses.search import StagedSearchProvider
+from epfl.courses.search.parser import SearchQuery
+from epfl.courses.search.pending import PendingCall
+
+
+class ThreadRPC(object):
+  """Stands for an RPC, running the call in a thread."""
+
+  def __init__(self, target, *args, **kwargs):
+    self.thread = threading.Thread(target=target, args=args, kwargs=kwargs)
+    self.thread.daemon = True
+    self.thread.start()
+
+  @property
+  def state(self):
+    if self.thread.is_alive():
+      return apiproxy_rpc.RPC.RUNNING
+    return apiproxy_rpc.RPC.FINISHING
+
+  @classmethod
+  def Call(cls, target, *args, **kwargs):
+    rpc = cls(target, *args, **kwargs)
+    return PendingCall(rpc.thread.join, rpc)
+
+
+class FakeProvider(object):
+  def __init__(self, results, delay=0.0, suggestion=None):
+    self.results = results
+    self.delay = delay
+    self.suggestion = suggestion
+    self.calls = 0
+
+  def Search(self, query, results, limit=None, offset=None, accuracy=None):
+    self.calls += 1
+    time.sleep(self.delay)
+    results.latest_results = list(self.results)
+    results.results.extend(results.latest_results)
+    results.number_found = len(self.results)
+    if self.suggestion:
+      results.suggested_query = self.suggestion
+
+
+class AsyncFakeProvider(FakeProvider):
+  """Searches in a thread, standing for an asynchronous RPC."""
+
+  def SearchAsync(self, query, results, **kwargs):
+    return ThreadRPC.Call(self.Search, query, results, **kwargs)
+
+
+class TestStagedSearchProvider(unittest.TestCase):
+  def Search(self, provider):
+    results = SearchResults("query", 0)
+    provider.Search("query", results, limit=20, offset=0)
+    return results
+
+  def test_sequential(self):
+    stages = [FakeProvider([]), FakeProvider(["a"]), FakeProvider(["b"])]
+    results = self.Search(StagedSearchProvider(stages))
+    self.assertEqual(results.results, ["a"])
+    self.assertEqual([stage.calls for stage in stages], [1, 1, 0])
+
+  def test_hedged_priority(self):
+    # The slow first stage wins, since it has priority
+    stages = [AsyncFakeProvider(["a"], delay=0.2), AsyncFakeProvider(["b"])]
+    results = self.Search(StagedSearchProvider(stages, hedge_delay=0.0))
+    self.assertEqual(results.results, ["a"])
+    self.assertEqual(stages[1].calls, 1)
+
+  def test_hedged_miss(self):
+    stages = [AsyncFakeProvider([], delay=0.1),
+              AsyncFakeProvider(["b"], delay=0.1)]
+    start = time.time()
+    results = self.Search(StagedSearchProvider(stages, hedge_delay=0.0))
+    self.assertEqual(results.results, ["b"])
+    self.assertEqual(results.number_found, 1)
+    self.assertTrue(time.time() - start < 0.19)
+
+  def test_hedged_late_rpc(self):
+    # The second stage is still running after the delay, so the third one is
+    # issued alongside it
+    stages = [FakeProvider([]), AsyncFakeProvider([], delay=0.3),
+              AsyncFakeProvider(["c"], delay=0.1)]
+    start = time.time()
+    results = self.Search(StagedSearchProvider(stages, hedge_delay=0.1))
+    self.assertEqual(results.results, ["c"])
+    self.assertEqual(stages[2].calls, 1)
+    self.assertTrue(time.time() - start < 0.38)
+
+  def test_hedged_fast_rpc(self):
+    stages = [AsyncFakeProvider(["a"], delay=0.05), AsyncFakeProvider(["b"])]
+    results = self.Search(StagedSearchProvider(stages, hedge_delay=0.5))
+    self.assertEqual(results.results, ["a"])
+    self.assertEqual(stages[1].calls, 0)
+
+  def test_hedged_unused_stage_dropped(self):
+    stages = [AsyncFakeProvider(["a"]), AsyncFakeProvider(["b"], delay=0.5)]
+    start = time.time()
+    results = self.Search(StagedSearchProvider(stages, hedge_delay=0.0))
+    self.assertEqual(results.results, ["a"])
+    self.assertTrue(time.time() - start < 0.4)
+
+  def test_hedged_no_hedging_needed(self):
+    # The remote stages are never issued before the local one has missed
+    stages = [FakeProvider(["a"], delay=0.1), AsyncFakeProvider(["b"])]
+    results = self.Search(StagedSearchProvider(stages, hedge_delay=0.0))
+    self.assertEqual(results.results, ["a"])
+    self.assertEqual(stages[1].calls, 0)
+
+  def test_async_local_hit(self):
+    stages = [FakeProvider(["a"]), AsyncFakeProvider(["b"])]
+    results = SearchResults("query", 0)
+    complete = StagedSearchProvider(stages, hedge_delay=0.0).SearchAsync(
+      "query", results, limit=20, offset=0)
+    self.assertEqual(stages[1].calls, 0)
+    complete()
+    self.assertEqual(results.results, ["a"])
+    self.assertEqual(stages[1].calls, 0)
+
+  def test_hedged_suggestion(self):
+    stages = [FakeProvider([]), AsyncFakeProvider([], suggestion="fixed")]
+    results = self.Search(StagedSearchProvider(stages, hedge_delay=0.0))
+    self.assertEqual(results.number_found, 0)
+    self.assertEqual(results.suggested_query, "fixed")
+
+  def test_deadline(self):
+    stages = [FakeProvider([], delay=0.2), AsyncFakeProvider(["b"])]
+    results = self.Search(StagedSearchProvider(stages, hedge_delay=0.0,
+                                               deadline=time.time() + 0.1))
+    self.assertEqual(results.number_found, None)
+    self.assertEqual(stages[1].calls, 0)
+
+
+class DictProvider(object):
+  """Answers queries from a dictionary of query strings to results."""
+
+  def __init__(self, answers, delay=0.0):
+    self.answers = answers
+    self.delay = delay
+    self.queries = []
+
+  def Search(self, query, results, limit=None, offset=None, accuracy=None):
+    if not isinstance(query, basestring):
+      query = query.GetString()
+    self.queries.append(query)
+    time.sleep(self.delay)
+    results.latest_results = list(self.answers.get(query, []))
+    results.results.extend(results.latest_results)
+    results.number_found = len(results.latest_results)
+
+
+class AsyncDictProvider(DictProvider):
+  def SearchAsync(self, query, results, **kwargs):
+    return ThreadRPC.Call(self.Search, query, results, **kwargs)
+
+
+class FakeSpeller(object):
+  def __init__(self, suggestions):
+    self.suggestions = suggestions
+    self.queries = []
+
+  def SuggestQuery(self, query):
+    self.queries.append(query.GetString())
+    return self.suggestions.get(query.GetString())
+
+
+class TestAutocorrectedSearchProvider(unittest.TestCase):
+  def Search(self, provider, query_string):
+    results = SearchResults(query_string, 0)
+    provider.Search(SearchQuery.ParseFromString(query_string), results,
+                    limit=20, offset=0)
+    return results
+
+  def test_concurrent_correction(self):
+    inner = AsyncDictProvider({"algebra": ["a"]}, delay=0.1)
+    provider = AutocorrectedSearchProvider(
+      inner, speller=FakeSpeller({"algaebra": "algebra"}), concurrent=True)
+    start = time.time()
+    results = self.Search(provider, "algaebra")
+    self.assertTrue(time.time() - start < 0.19)
+    self.assertEqual(results.results, ["a"])
+    self.assertEqual(results.suggested_query, "algebra")
+    self.assertEqual(provider.original_query, "algaebra")
+    self.assertEqual(sorted(inner.queries), ["algaebra", "algebra"])
+
+  def test_concurrent_original_found(self):
+    inner = AsyncDictProvider({"algaebra": ["x"], "algebra": ["a"]})
+    provider = AutocorrectedSearchProvider(
+      inner, speller=FakeSpeller({"algaebra": "algebra"}), concurrent=True)
+    results = self.Search(provider, "algaebra")
+    self.assertEqual(results.results, ["x"])
+    self.assertEqual(provider.original_query, None)
+
+  def test_concurrent_without_async(self):
+    # Without SearchAsync, the suggestion is searched for sequentially
+    inner = DictProvider({"algebra": ["a"]})
+    provider = AutocorrectedSearchProvider(
+      inner, speller=FakeSpeller({"algaebra": "algebra"}), concurrent=True)
+    results = self.Search(provider, "algaebra")
+    self.assertEqual(results.results, ["a"])
+    self.assertEqual(inner.queries, ["algaebra", "algebra"])
+
+  def test_concurrent_staged(self):
+    stages = [DictProvider({}), AsyncDictProvider({"algebra": ["a"]},
+                                                  delay=0.1)]
+    provider = AutocorrectedSearchProvider(
+      StagedSearchProvider(stages, hedge_delay=0.0),
+      speller=FakeSpeller({"algaebra": "algebra"}), concurrent=True)
+    start = time.time()
+    results = self.Search(provider, "algaebra")
+    self.assertTrue(time.time() - start < 0.19)
+    self.assertEqual(results.results, ["a"])
+    self.assertEqual(sorted(stages[1].queries), ["algaebra", "algebra"])
+
+  def test_concurrent_staged_local_hit(self):
+    # The local stage finds the original query, so there is nothing to
+    # correct and no remote search
+    stages = [DictProvider({"algaebra": ["x"]}),
+              AsyncDictProvider({"algebra": ["a"]})]
+    speller = FakeSpeller({"algaebra": "algebra"})
+    provider = AutocorrectedSearchProvider(
+      StagedSearchProvider(stages, hedge_delay=0.0), speller=speller,
+      concurrent=True)
+    results = self.Search(provider, "algaebra")
+    self.assertEqual(results.results, ["x"])
+    self.assertEqual(speller.queries, [])
+    self.assertEqual(stages[1].queries, [])
+
+  def test_exact_search(self):
+    inner = DictProvider({"algebra": ["a"]})
+    provider = AutocorrectedSearchProvider(
+      inner, exact_search=True, speller=FakeSpeller({"algaebra": "algebra"}),
+      concurrent=True)
+    results = self.Search(provider, "algaebra")
+    self.assertEqual(results.number_found, 0)
+    self.assertEqual(inner.queries, ["algaebra"])
+
+  def test_lazy_speller(self):
+    loads = []
+    def LoadSpeller():
+      loads.append(True)
+      return FakeSpeller({"algaebra": "algebra"})
+
+    inner = DictProvider({"algebra": ["a"]})
+    provider = AutocorrectedSearchProvider(inner, speller_loader=LoadSpeller)
+    self.Search(provider, "algebra")
+    self.assertEqual(loads, [])
+    results = self.Search(provider, "algaebra")
+    self.assertEqual(results.results, ["a"])
+    self.Search(provider, "algaebra")
+    self.assertEqual(loads, [True])
+
+  def test_speller_load_failure(self):
+    def LoadSpeller():
+      raise IOError("No index")
+
+    inner = DictProvider({"algebra": ["a"]})
+    provider = AutocorrectedSearchProvider(inner, speller_loader=LoadSpeller,
+                                           concurrent=True)
+    results = self.Search(provider, "algaebra")
+    self.assertEqual(results.number_found, 0)
+    self.assertEqual(inner.queries, ["algaebra"])
+
+
+class TestCachedSearchProvider(unittest.TestCase):
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    CachedSearchProvider.local_cache.Clear()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def Search(self, provider, query_string):
+    results = SearchResults(query_string, 0)
+    provider.Search(query_string, results, limit=20, offset=0)
+    return results
+
+  def test_cached(self):
+    inner = FakeProvider(["a"])
+    provider = CachedSearchProvider(inner)
+    self.assertEqual(self.Search(provider, "algebra").results, ["a"])
+    inner.results = ["b"]
+    self.assertEqual(self.Search(provider, "algebra").results, ["a"])
+    self.assertEqual(inner.calls, 1)
+
+  def test_import_invalidates(self):
+    inner = FakeProvider(["a"])
+    provider = CachedSearchProvider(inner)
+    self.Search(provider, "biology")
+    # An import that changes the courses only bumps the catalog generation
+    inner.results = ["b"]
+    cache.CourseCache.Invalidate()
+    self.assertEqual(self.Search(provider, "biology").results, ["b"])
+    self.assertEqual(inner.calls, 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -6,8 +6,74 @@
 
 __author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
 
+import sys
 import unittest
 
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.ext import testbed
+
+from epfl.courses import models
+from epfl.courses import registry
+
+
+class TestSectionRegistry(unittest.TestCase):
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    registry.SectionRegistry._current = None
+
+    school = models.School(key_name="IC",
+                           title_en="Computer and Communication Sciences",
+                           title_fr=u"Informatique et communications")
+    school.put()
+    models.Section(key_name="IN", school=school, title_short="IN",
+                   title_en="Computer Science",
+                   title_fr=u"Informatique").put()
+    models.Section(key_name="MIN-BIO", school=school, title_en="Biocomputing",
+                   title_fr=u"Biocomputing", minor=True).put()
+    models.Section(key_name="SC-ALIAS", school=school, title_en="Alias",
+                   alias="IN").put()
+
+    self.course = models.Course(key_name="en:test-course")
+    self.course.section_keys = [models.Section.get_by_key_name(code).key()
+                                for code in ["MIN-BIO", "IN"]]
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def test_course_sections(self):
+    sections = self.course.sections
+    self.assertEqual([section.code for section in sections], ["MIN-BIO", "IN"])
+    self.assertEqual(sections[0].display_name(use_french=True),
+                     "Biocomputing (mineur)")
+    self.assertEqual(sections[1].school.title(use_french=True),
+                     u"Informatique et communications")
+    self.assertEqual([section.display_name(short=True)
+                      for section in self.course.sections_unique],
+                     ["IN", "MIN-BIO (minor)"])
+
+  def test_school_sections(self):
+    schools = registry.SectionRegistry.Get().GetSchools()
+    self.assertEqual([school.code for school in schools], ["IC"])
+    self.assertEqual(sorted(section.code for section in schools[0].sections),
+                     ["IN", "MIN-BIO"])
+
+  def test_invalidate(self):
+    first = registry.SectionRegistry.Get()
+    self.assertTrue(registry.SectionRegistry.Get() is first)
+
+    models.Section(key_name="IN", school=models.School.get_by_key_name("IC"),
+                   title_en="Informatics").put()
+    registry.SectionRegistry.Invalidate()
+    self.assertEqual(registry.SectionRegistry.Get().GetSection("IN").title(),
+                     "Informatics")
+
 
 if __name__ == "__main__":
-  unittest.main()
\ No newline at end of file
+  unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL. All rights reserved.
+
+"""Unit testing for the local spelling correction."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import sys
+import unittest
+
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from epfl.courses.search import localsearch
+from epfl.courses.search.spelling import EditDistance
+from epfl.courses.search.spelling import SpellingCorrector
+
+
+VOCABULARY = [
+  ("linear", 12), ("algebra", 62), ("algorithms", 20), ("christoph", 1),
+  ("koch", 1), ("chappelier", 4), (u"mathématiques", 4), ("mathematics", 30),
+  ("programming", 25), ("candea", 2), ("george", 3), ("andre", 43),
+]
+
+
+class TestEditDistance(unittest.TestCase):
+  def test_distance(self):
+    self.assertEqual(EditDistance("algebra", "algebra", 2), 0)
+    self.assertEqual(EditDistance("algaebra", "algebra", 2), 1)
+    self.assertEqual(EditDistance("cristoph", "christoph", 2), 1)
+    self.assertEqual(EditDistance("koch", "kohc", 2), 1)
+
+  def test_cutoff(self):
+    self.assertEqual(EditDistance("programming", "algebra", 2), 3)
+
+
+class TestSpellingCorrector(unittest.TestCase):
+  def setUp(self):
+    self.corrector = SpellingCorrector()
+    for word, count in VOCABULARY:
+      self.corrector.AddWord(word, count)
+
+  def test_known_words(self):
+    self.assertEqual(self.corrector.Correct("algebra"), "algebra")
+    self.assertEqual(self.corrector.SuggestQuery("linear algebra"), None)
+
+  def test_accents(self):
+    self.assertTrue(self.corrector.IsKnown(u"Mathématiques"))
+    self.assertEqual(self.corrector.SuggestQuery(u"Mathématiques"), None)
+    self.assertEqual(self.corrector.Correct(u"mathématique"), "mathematiques")
+
+  def test_filters(self):
+    self.assertEqual(self.corrector.SuggestQuery('instructor:"george cadnea"'),
+                     'instructor:"george candea"')
+    self.assertEqual(self.corrector.SuggestQuery("section:programing"), None)
+
+  def test_operators(self):
+    self.assertEqual(self.corrector.SuggestQuery("algaebra OR programing"),
+                     "algebra OR programming")
+
+
+class TestIndexCorrector(unittest.TestCase):
+  def setUp(self):
+    index = localsearch.LocalIndex()
+    index.AddDocument("linear-algebra", [
+      ("title", localsearch.TEXT, u"Linear Algebra"),
+      ("description", localsearch.TEXT, u"Algèbre linéaire"),
+    ])
+    self.corrector = SpellingCorrector.FromIndex(index)
+
+  def test_indexed_words(self):
+    # The description words are not suggested, but not corrected either
+    self.assertEqual(self.corrector.SuggestQuery("algebre"), None)
+    self.assertTrue(self.corrector.IsKnown(u"linéaire"))
+    self.assertEqual(self.corrector.SuggestQuery("algabra"), "algebra")
+
+
+class TestBenchmarkQueries(unittest.TestCase):
+  """The misspellings of the end-to-end test scenarios."""
+
+  def setUp(self):
+    self.corrector = SpellingCorrector()
+    for word, count in VOCABULARY:
+      self.corrector.AddWord(word, count)
+
+  def test_algaebra(self):
+    self.assertEqual(self.corrector.SuggestQuery("algaebra"), "algebra")
+
+  def test_cristoph_koch(self):
+    self.assertEqual(self.corrector.SuggestQuery("cristoph koch"),
+                     "christoph koch")
+
+  def test_chappelier(self):
+    self.assertEqual(self.corrector.SuggestQuery("chappelier"), None)
+    self.assertEqual(self.corrector.SuggestQuery("chapelier"), "chappelier")
+
+  def test_matematics(self):
+    self.assertEqual(self.corrector.SuggestQuery("matematics"), "mathematics")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL. All rights reserved.
+
+"""Unit testing for the precompiled templates."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+import jinja2
+
+from epfl.courses import templating
+
+
+class TestPrecompiledTemplates(unittest.TestCase):
+  sections = [
+    ("IC", "School of Computer and Communication Sciences", [
+      ("IN", u"Computer Science"),
+      ("SC", u"Communication Systems <&>"),
+    ]),
+    ("", u"Others", [("HUM", u"Humanités")]),
+  ]
+
+  def setUp(self):
+    self.saved_compiled_path = templating.COMPILED_PATH
+    self.compiled_dir = tempfile.mkdtemp()
+    templating.COMPILED_PATH = os.path.join(self.compiled_dir, "compiled")
+    templating.CompileTemplates()
+
+  def tearDown(self):
+    templating.COMPILED_PATH = self.saved_compiled_path
+    shutil.rmtree(self.compiled_dir)
+
+  def CreateEnvironment(self, loader):
+    args = templating.GetEnvironmentArgs()
+    del args["bytecode_cache"]
+    return jinja2.Environment(loader=loader, **args)
+
+  def test_same_output(self):
+    source_env = self.CreateEnvironment(
+      jinja2.FileSystemLoader(templating.TEMPLATE_PATH))
+    compiled_env = self.CreateEnvironment(
+      jinja2.ModuleLoader(templating.GetCompiledPath()))
+
+    for counts in [{}, {"sections": {"in": 3, "hum": 1}}]:
+      template_args = {"static": {"sections": self.sections},
+                       "counts": counts}
+      self.assertEqual(
+        compiled_env.get_template("section_select.html").render(
+          template_args),
+        source_env.get_template("section_select.html").render(
+          template_args))
+
+  def test_out_of_date(self):
+    self.assertEqual(templating.GetCompiledPath(), templating.COMPILED_PATH)
+
+    with open(os.path.join(templating.COMPILED_PATH,
+                           templating.COMPILED_STAMP), "w") as f:
+      f.write("0" * 40 + "\n")
+    self.assertIsNone(templating.GetCompiledPath())
+
+    shutil.rmtree(templating.COMPILED_PATH)
+    self.assertIsNone(templating.GetCompiledPath())
+
+
+if __name__ == "__main__":
+  unittest.main()
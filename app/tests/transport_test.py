@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL. All rights reserved.
+
+"""Unit testing for the Google Site Search provider and its transport."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import BaseHTTPServer
+import SocketServer
+import sys
+import threading
+import time
+import unittest
+
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.api import urlfetch
+from google.appengine.ext import testbed
+
+from epfl.courses.search import SearchResults
+from epfl.courses.search.sitesearch import SiteSearchProvider
+from epfl.courses.search.transport import CircuitBreaker
+from epfl.courses.search.transport import HTTPTransport
+
+
+CANNED_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<GSP VER="3.2">
+  <Spelling><Suggestion q="computer architecture">computer architecture</Suggestion></Spelling>
+  <RES SN="1" EN="2">
+    <M>2</M>
+    <R N="1"><U>http://example.com/course/advanced-computer-architecture</U></R>
+    <R N="2"><U>http://example.com/course/computer-networks</U></R>
+  </RES>
+</GSP>
+"""
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def do_GET(self):
+    self.server.requests.append(self.path)
+    time.sleep(self.server.delay)
+    body = CANNED_RESPONSE if self.server.status == 200 else "error"
+    self.send_response(self.server.status)
+    self.send_header("Content-Type", "text/xml")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+  def handle_error(self, request, client_address):
+    # The clients hang up on the slow responses
+    pass
+
+
+class TestSiteSearchTransport(unittest.TestCase):
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_urlfetch_stub()
+
+    self.server = StubServer(("127.0.0.1", 0), StubHandler)
+    self.server.requests = []
+    self.server.delay = 0.0
+    self.server.status = 200
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    class StubSiteSearchProvider(SiteSearchProvider):
+      SEARCH_URL = ("http://127.0.0.1:%d/search?q=%%s&cx=%%s"
+                    % self.server.server_address[1])
+
+    self.provider_class = StubSiteSearchProvider
+    self.transport = HTTPTransport(
+      timeout=1.0, breaker=CircuitBreaker(failure_threshold=2,
+                                          reset_timeout=60.0))
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    self.testbed.deactivate()
+
+  def Search(self, query_string, **kwargs):
+    provider = self.provider_class(http_transport=self.transport, **kwargs)
+    results = SearchResults(query_string)
+    provider.Search(query_string, results, limit=10)
+    return results
+
+  def test_results(self):
+    results = self.Search("computer architecure")
+    self.assertEqual(results.number_found, 2)
+    self.assertEqual(results.results, ["advanced-computer-architecture",
+                                       "computer-networks"])
+    self.assertEqual(results.suggested_query, "computer architecture")
+    self.assertEqual(results.offset, 0)
+
+  def test_response_cache(self):
+    self.Search("networks")
+    results = self.Search("networks")
+    self.assertEqual(results.number_found, 2)
+    self.assertEqual(len(self.server.requests), 1)
+
+  def test_deadline(self):
+    self.server.delay = 0.5
+    start = time.time()
+    results = self.Search("networks", deadline=time.time() + 0.1)
+    self.assertTrue(time.time() - start < 0.4)
+    self.assertEqual(results.number_found, None)
+
+  def test_circuit_breaker(self):
+    self.server.status = 500
+    self.Search("networks")
+    self.Search("architecture")
+    self.server.status = 200
+    results = self.Search("biology")
+    self.assertEqual(results.number_found, None)
+    self.assertEqual(len(self.server.requests), 2)
+
+  def test_half_open_failure(self):
+    self.transport.breaker.reset_timeout = 0.0
+    self.server.status = 500
+    self.Search("networks")
+    self.Search("architecture")
+    self.assertEqual(self.transport.breaker.state, CircuitBreaker.OPEN)
+
+    # The trial call fails to be issued, which re-opens the breaker
+    trial_states = []
+    def FailingFetchCall(rpc, url):
+      trial_states.append(self.transport.breaker.state)
+      raise RuntimeError("Unexpected")
+    saved_make_fetch_call = urlfetch.make_fetch_call
+    urlfetch.make_fetch_call = FailingFetchCall
+    try:
+      self.assertRaises(RuntimeError, self.transport.FetchAsync,
+                        "http://127.0.0.1:%d/" % self.server.server_port)
+    finally:
+      urlfetch.make_fetch_call = saved_make_fetch_call
+    self.assertEqual(trial_states, [CircuitBreaker.HALF_OPEN])
+    self.assertEqual(self.transport.breaker.state, CircuitBreaker.OPEN)
+
+if __name__ == "__main__":
+  unittest.main()
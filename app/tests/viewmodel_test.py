@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL. All rights reserved.
+
+"""Unit testing for the course page view models."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import sys
+import unittest
+
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.ext import testbed
+
+from epfl.courses import models
+from epfl.courses import registry
+from epfl.courses import viewmodel
+
+
+class TestCourseView(unittest.TestCase):
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    registry.SectionRegistry._current = None
+
+    school = models.School(key_name="IC", title_en="Computer Science",
+                           title_fr=u"Informatique")
+    school.put()
+    section = models.Section(key_name="IN", school=school, title_short="IN",
+                             title_en="Computer Science",
+                             title_fr=u"Informatique")
+    section.put()
+
+    self.course = models.Course(key_name="en:cs-101", desc_language_="en",
+                                section_keys=[section.key()],
+                                urls=["http://isa/in"], code_prefix=["CS"],
+                                code_number=["101"], lecture_time=28,
+                                links=["http%3A%2F%2Fexample.com"],
+                                content="[b]Loops[/b]")
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def test_compute(self):
+    view = viewmodel.CourseView.Compute(self.course)
+    self.assertEqual(view["hierarchy"],
+                     {"IC - Computer Science":
+                      {"Computer Science": ("IN", ["CS-101"])}})
+    self.assertEqual(view["homepages"],
+                     [("http://isa/in", "Computer Science", "IN")])
+    self.assertFalse(view["show_trio"])
+    self.assertEqual(view["links"],
+                     [("http%3A%2F%2Fexample.com", "http://example.com")])
+    self.assertEqual(view["free_text"], {"content": "<b>Loops</b>"})
+
+  def test_stored(self):
+    viewmodel.CourseView.Store(self.course)
+    self.course.put()
+
+    course = models.Course.GetByCourseID("cs-101")
+    view = viewmodel.CourseView.Get(course)
+    self.assertEqual(view["free_text"]["content"], "<b>Loops</b>")
+    self.assertEqual(view["hierarchy"]["IC - Computer Science"],
+                     {"Computer Science": ["IN", ["CS-101"]]})
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable-msg=W0311
+
+"""Compare the ISA markup translators on the consolidated descriptions."""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import json
+import os
+import sys
+import timeit
+
+
+this_dir = os.path.dirname(__file__)
+app_dir = os.path.join(this_dir, "..", "..", "app")
+
+sys.path.insert(0, app_dir)
+
+from epfl.courses import markup
+
+
+consolidated_desc_path = os.path.join(this_dir, "consolidated_desc.json")
+
+
+class DictMemo(object):
+  """An unbounded memo, to measure the cost of the hits alone."""
+
+  def __init__(self):
+    self.entries = {}
+
+  def Get(self, key):
+    return self.entries.get(key)
+
+  def Put(self, key, value):
+    self.entries[key] = value
+
+
+def GetFreeTexts(course_data):
+  values = []
+  for course_desc in course_data["consolidations"]:
+    for language in ["en", "fr"]:
+      values.extend(value for value in
+                    course_desc[language]["free_text"].itervalues() if value)
+  return values
+
+
+def Main():
+  with open(consolidated_desc_path, "r") as f:
+    course_data = json.load(f, encoding="utf-8")
+
+  values = GetFreeTexts(course_data)
+  print "Free text values:", len(values)
+  print "Total size:", sum(len(value) for value in values)
+
+  translator = markup.ISAMarkupTranslator
+  mismatches = [value for value in values
+                if translator.Translate(value) != translator.TranslateLegacy(value)]
+  print "Mismatches:", len(mismatches)
+
+  memoized = markup.ISAMarkupTranslator(memo=DictMemo())
+  for value in values:
+    memoized(value)
+
+  repeat = 5
+  for name, convert in [("legacy", translator.TranslateLegacy),
+                        ("single pass", translator.Translate),
+                        ("memoized", memoized)]:
+    duration = min(timeit.repeat(lambda: map(convert, values),
+                                 repeat=repeat, number=1))
+    print "%-12s %8.1f ms" % (name, duration * 1000)
+
+
+if __name__ == "__main__":
+  Main()
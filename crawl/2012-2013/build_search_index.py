@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2012 EPFL.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable-msg=W0311
+
+"""Compile the consolidated course information in a search index snapshot.
+
+The courses are imported in an in-memory datastore and indexed by the
+application code itself, so the snapshot holds the same documents as the
+index the application builds.  The script needs the App Engine SDK.
+"""
+
+__author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
+
+
+import logging
+import os
+import sys
+
+
+sdk_path = "/usr/local/google_appengine"
+sys.path.insert(0, sdk_path)
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+this_dir = os.path.dirname(__file__)
+app_dir = os.path.join(this_dir, "..", "..", "app")
+sys.path.insert(0, app_dir)
+
+from google.appengine.ext import testbed
+
+from epfl.courses import admin
+from epfl.courses.search import appsearch_admin
+from epfl.courses.search import snapshot
+
+
+consolidated_lines_path = os.path.join(this_dir, "consolidated_desc.jsonl")
+search_index_path = os.path.join(this_dir, "search_index.bin")
+
+
+def BuildSearchIndex():
+  """Import the courses of the data file and index them."""
+
+  bed = testbed.Testbed()
+  bed.activate()
+  try:
+    bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+
+    admin.ImportCourseCatalog.PopulateSections()
+    for language in ["en", "fr"]:
+      admin.ImportCourseCatalog.ImportAllCourses(language)
+
+    return appsearch_admin.AppEngineIndex.BuildLocalIndex()
+  finally:
+    bed.deactivate()
+
+
+def Main():
+  logging.basicConfig(level=logging.INFO)
+
+  admin.COURSES_DATA_FILE = consolidated_lines_path
+  index = BuildSearchIndex()
+
+  with open(search_index_path, "wb") as f:
+    snapshot.WriteSnapshot(index, f, source=admin.GetCourseDataHash())
+
+  print "Indexed courses:", index.DocCount()
+  print "Snapshot size:", os.path.getsize(search_index_path)
+
+
+if __name__ == "__main__":
+  Main()
@@ -21,6 +21,7 @@
 __author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
 
 
+import json
 import logging
 import os
 import re
@@ -32,6 +33,7 @@ import parse_study_plans as psp
 
 this_dir = os.path.dirname(__file__)
 consolidated_desc_path = os.path.join(this_dir, "consolidated_desc.json")
+consolidated_lines_path = os.path.join(this_dir, "consolidated_desc.jsonl")
 
 
 class ConsolidationError(Exception):
@@ -160,6 +162,18 @@ def ConsolidateCourseDescriptions(course_desc):
   }
 
 
+def WriteConsolidationLines(consolidations):
+  """Write the consolidated descriptions as JSON Lines, for the importer."""
+
+  with open(consolidated_lines_path, "w") as f:
+    for cons_desc in consolidations["consolidations"]:
+      f.write(json.dumps(cons_desc, sort_keys=True))
+      f.write("\n")
+  logging.info("Saved %d descriptions at '%s'"
+               % (len(consolidations["consolidations"]),
+                  consolidated_lines_path))
+
+
 def Main():
   logging.basicConfig(level=logging.INFO)
   
@@ -168,6 +182,7 @@ def Main():
   course_desc = psp.FetchCourseDescriptions(courses)
   
   consolidations = ConsolidateCourseDescriptions(course_desc)
+  WriteConsolidationLines(consolidations)
   
   print "Total course descriptions:", len(course_desc["descriptions"])
   print "Unique course titles:",